@@ -1,20 +1,88 @@
 # app.py
 from flask import Flask, request, jsonify
-import json
+import atexit
+import logging
 import os
+import threading
 import uuid
-import datetime
 
-from config import VERIFY_TOKEN
+from config import (
+    VERIFY_TOKEN, WEBHOOK_MODE, WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_ENQUEUE_TIMEOUT_SECONDS, WEBHOOK_DRAIN_TIMEOUT_SECONDS,
+    METRICS_ADMIN_TOKEN, PROFILER_INTERVAL_SECONDS
+)
 from database import (
-    get_customer_by_phone, add_customer, get_available_services,
-    get_service_by_id, get_available_time_slots, book_appointment,
-    log_message, update_appointment_confirmation_id
+    resolve_customer, resolve_customers, get_available_time_slots, find_next_available_slots, book_appointment,
+    update_appointment_confirmation_id, update_appointment_status,
+    get_customer_appointments, get_customer_appointment, get_pool_stats
+)
+from whatsapp_api import send_whatsapp_message
+from outbound import send_batch_or_inline, get_dispatcher
+from service_catalog import get_service_catalog
+from workers import KeyedWorkerPool
+from conversation import (
+    ConversationBackend, ConversationFlow, blocking, run_sync, new_webhook_events, deduplicator, process_status
 )
-from whatsapp_api import send_whatsapp_message, send_template_message
+import metrics
+from metrics import timed
+from structured_log import configure_logging
+
+configure_logging()
+log = logging.getLogger("app")
 
 app = Flask(__name__)
 
+# Load the service catalog up front so the first "Book Appointment" doesn't pay for it
+try:
+    get_service_catalog().reload()
+except Exception as e:
+    log.warning("Could not preload service catalog, will load on first use: %s", e)
+
+# --- Metrics ---
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Sampling profiler, switchable at runtime:
+#   POST /debug/profiler?token=...&action=start[&interval=0.005] | stop | reset
+#   GET  /debug/profiler?token=...   -> collapsed stacks for flamegraph.pl / speedscope
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def profiler_endpoint():
+    if not METRICS_ADMIN_TOKEN or request.args.get('token') != METRICS_ADMIN_TOKEN:
+        return 'Forbidden', 403
+    if request.method == 'GET':
+        return metrics.profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    action = request.args.get('action')
+    if action == 'start':
+        try:
+            interval = float(request.args.get('interval', PROFILER_INTERVAL_SECONDS))
+        except ValueError:
+            interval = 0
+        if not 0 < interval < 60: # also rejects nan and inf
+            return 'interval must be a number of seconds between 0 and 60', 400
+        metrics.profiler.start(interval)
+    elif action == 'stop':
+        metrics.profiler.stop()
+    elif action == 'reset':
+        metrics.profiler.reset()
+    else:
+        return 'Unknown action', 400
+    return jsonify({'running': metrics.profiler.running, 'samples': metrics.profiler.samples})
+
+def _prefixed(prefix, stats):
+    return {f"{prefix}_{key}": value for key, value in stats.items()}
+
+@metrics.register_collector
+def collect_component_stats():
+    # The caches, writers and conversation state both serving modes share are
+    # collected in conversation.py
+    values = {}
+    values.update(_prefixed("db_pool", get_pool_stats()))
+    values.update(_prefixed("outbound", get_dispatcher().stats()))
+    if _webhook_pool is not None:
+        values.update(_prefixed("webhook_queue", _webhook_pool.stats()))
+    return values
+
 # --- Webhook Verification Endpoint ---
 @app.route('/webhook', methods=['GET'])
 def verify_webhook():
@@ -24,7 +92,7 @@ def verify_webhook():
 
     if mode and token:
         if mode == 'subscribe' and token == VERIFY_TOKEN:
-            print('WEBHOOK_VERIFIED')
+            log.info("Webhook verified")
             return challenge, 200
         else:
             return 'Verification token mismatch', 403
@@ -32,237 +100,88 @@ def verify_webhook():
 
 # --- Webhook for Incoming Messages ---
 @app.route('/webhook', methods=['POST'])
+@timed("http")
 def handle_webhook():
     data = request.get_json()
-    print("Received Webhook Data:", json.dumps(data, indent=4))
+    # Serialized on the logging thread, and only when DEBUG is on for "app"
+    log.debug("Received webhook", extra={'event': 'webhook_received', 'payload': data})
 
     # Check if the webhook event is a message
     if data and data.get('object') == 'whatsapp_business_account':
-        for entry in data.get('entry', []):
-            for change in entry.get('changes', []):
-                if change.get('field') == 'messages':
-                    value = change.get('value', {})
-                    messages = value.get('messages', [])
-                    statuses = value.get('statuses', [])
-
-                    # Handle incoming messages
-                    for message in messages:
-                        from_number = message.get('from')
-                        message_type = message.get('type')
-                        message_id = message.get('id')
-                        timestamp = datetime.datetime.fromtimestamp(int(message.get('timestamp')))
-                        
-                        customer = get_customer_by_phone(from_number)
-                        if not customer:
-                            # Automatically add new customer if not found
-                            print(f"New customer: {from_number}. Adding to DB.")
-                            # You might want to ask for their name here via WhatsApp first
-                            customer_id = add_customer(from_number, f"User_{from_number[-4:]}") # Generic name for now
-                        else:
-                            customer_id = customer['customer_id']
-
-                        # Log the incoming message
-                        log_message(message_id, 'inbound', customer_id, timestamp, json.dumps(message), data)
-
-                        if message_type == 'text':
-                            text_body = message['text']['body'].lower()
-                            handle_text_message(from_number, customer_id, text_body)
-                        elif message_type == 'interactive':
-                            # Handle interactive replies (e.g., button clicks, list selections)
-                            interactive_data = message['interactive']
-                            handle_interactive_message(from_number, customer_id, interactive_data)
-                        else:
-                            send_whatsapp_message(from_number, "I can only process text messages and interactive selections for now. How can I help you book an appointment?")
-                    
-                    # Handle message status updates (e.g., delivered, read)
-                    for status in statuses:
-                        print(f"Message Status Update: {status.get('status')} for message ID {status.get('id')}")
-                        # You can update your messages_log table here with status changes
-                        # e.g., update messages_log SET status = 'delivered' WHERE whatsapp_message_id = status.get('id')
-                        log_message(status.get('id'), 'outbound_status_update', None, datetime.datetime.fromtimestamp(int(status.get('timestamp'))), json.dumps(status), data)
-
-
-    return 'OK', 200
-
-# --- Message Handling Logic ---
-conversation_states = {} # A simple in-memory store for conversation state for a beta
-
-def handle_text_message(from_number, customer_id, text_body):
-    current_state = conversation_states.get(from_number, {'step': 'start'})
-
-    if "hello" in text_body or "hi" in text_body or "start" in text_body:
-        send_whatsapp_message(from_number, "Hello! Welcome to our appointment booking service. How can I help you?")
-        # Offer options like "Book Appointment", "View My Appointments", "Services"
-        # Using interactive buttons is much better here
-        send_interactive_main_menu(from_number)
-        conversation_states[from_number] = {'step': 'main_menu'}
-    elif current_state['step'] == 'select_service_text_input':
-        # User is typing service name (less ideal than interactive lists)
-        services = get_available_services()
-        matched_service = next((s for s in services if s['name'].lower() == text_body), None)
-        if matched_service:
-            conversation_states[from_number] = {
-                'step': 'select_date',
-                'service_id': matched_service['service_id'],
-                'service_name': matched_service['name'],
-                'duration': matched_service['duration_minutes']
-            }
-            send_whatsapp_message(from_number, f"Great! You selected {matched_service['name']}. Please provide the date you'd like to book (YYYY-MM-DD):")
-        else:
-            send_whatsapp_message(from_number, "Sorry, I couldn't find that service. Please try again or type 'services' to see the list.")
-    elif current_state['step'] == 'select_date':
-        try:
-            selected_date = datetime.datetime.strptime(text_body, "%Y-%m-%d").date()
-            if selected_date < datetime.date.today():
-                send_whatsapp_message(from_number, "You cannot book an appointment in the past. Please provide a future date (YYYY-MM-DD):")
-                return
-            
-            # Fetch and display available time slots
-            service_duration = current_state['duration']
-            available_slots = get_available_time_slots(service_duration, selected_date.strftime("%Y-%m-%d"))
-
-            if available_slots:
-                send_whatsapp_message(from_number, f"Available slots for {current_state['service_name']} on {selected_date.strftime('%Y-%m-%d')}:")
-                # Send as a list or buttons
-                slot_options = [{"id": f"book_slot_{selected_date.strftime('%Y-%m-%d')} {slot}", "title": slot} for slot in available_slots]
-                send_interactive_list_message(from_number, "Choose a time slot:", "Available Times", slot_options)
-                
-                conversation_states[from_number]['step'] = 'select_time'
-                conversation_states[from_number]['selected_date'] = selected_date.strftime("%Y-%m-%d")
-            else:
-                send_whatsapp_message(from_number, "No slots available for that date. Please try another date or type 'cancel' to start over.")
-        except ValueError:
-            send_whatsapp_message(from_number, "Invalid date format. Please use YYYY-MM-DD.")
-    elif "cancel" in text_body:
-        send_whatsapp_message(from_number, "Okay, booking cancelled. How else can I help you?")
-        conversation_states.pop(from_number, None) # Clear state
-        send_interactive_main_menu(from_number) # Go back to main menu
-    else:
-        send_whatsapp_message(from_number, "I'm not sure how to respond to that. Please type 'hi' to start over or 'cancel' to stop.")
-        send_interactive_main_menu(from_number)
-        conversation_states.pop(from_number, None) # Clear state if unknown input
-
-
-def handle_interactive_message(from_number, customer_id, interactive_data):
-    current_state = conversation_states.get(from_number, {'step': 'start'})
-    message_type = interactive_data.get('type')
-
-    if message_type == 'button':
-        button_id = interactive_data['button_reply']['id']
-        handle_button_click(from_number, customer_id, button_id, current_state)
-    elif message_type == 'list':
-        list_id = interactive_data['list_reply']['id']
-        handle_list_selection(from_number, customer_id, list_id, current_state)
-
-def handle_button_click(from_number, customer_id, button_id, current_state):
-    if button_id == 'book_appointment':
-        services = get_available_services()
-        if services:
-            # Prepare interactive list message for services
-            service_options = [{"id": s['service_id'], "title": s['name']} for s in services]
-            send_interactive_list_message(from_number, "Please select a service:", "Our Services", service_options)
-            conversation_states[from_number] = {'step': 'select_service'}
+        if WEBHOOK_MODE == 'queued':
+            if not enqueue_webhook(data):
+                # Queue is full: let WhatsApp retry later instead of piling up
+                return 'Busy', 503
         else:
-            send_whatsapp_message(from_number, "Sorry, no services are currently available.")
-    elif button_id == 'view_appointments':
-        send_whatsapp_message(from_number, "This feature is coming soon! For now, please contact us directly to view your appointments.")
-        send_interactive_main_menu(from_number)
-        conversation_states.pop(from_number, None)
-    elif button_id == 'get_help':
-        send_whatsapp_message(from_number, "Please type your question or call us at [Your Phone Number].")
-        send_interactive_main_menu(from_number)
-        conversation_states.pop(from_number, None)
+            process_webhook(data)
 
+    return 'OK', 200
 
-def handle_list_selection(from_number, customer_id, list_id, current_state):
-    if current_state['step'] == 'select_service':
-        service_id = list_id
-        service = get_service_by_id(service_id)
-        if service:
-            conversation_states[from_number] = {
-                'step': 'select_date',
-                'service_id': service['service_id'],
-                'service_name': service['name'],
-                'duration': service['duration_minutes']
-            }
-            send_whatsapp_message(from_number, f"You've selected {service['name']}. Now, please enter the desired date for your appointment in YYYY-MM-DD format (e.g., 2025-07-20).")
+# --- Conversation flow (conversation.py) over the blocking database and Graph API calls ---
+def send_confirmation(to_number, appointment_id, messages):
+    # Off the request thread (inline if the queue is full); the confirmation
+    # id is stored once it's sent
+    sent = send_batch_or_inline(to_number, messages)
+    sent.add_done_callback(lambda f: store_confirmation_id(appointment_id, f))
+
+def store_confirmation_id(appointment_id, sent_future):
+    if sent_future.exception():
+        log.error("Error sending booking confirmation for %s: %s", appointment_id, sent_future.exception())
+        return
+    sent_msg_id = sent_future.result()[0]
+    if sent_msg_id:
+        update_appointment_confirmation_id(appointment_id, sent_msg_id)
+
+flow = ConversationFlow(ConversationBackend(**{fn.__name__: blocking(fn) for fn in (
+    resolve_customer, resolve_customers, get_available_time_slots, find_next_available_slots, book_appointment,
+    get_customer_appointments, get_customer_appointment, update_appointment_status,
+    send_whatsapp_message, send_confirmation,
+)}))
+
+def process_webhook(data):
+    run_sync(flow.process_webhook(data))
+
+def process_message(message, data):
+    run_sync(flow.process_message(message, data))
+
+def enqueue_webhook(data):
+    # Messages are keyed by sender so one customer's messages stay in order,
+    # statuses by recipient so they land after the messages that caused them.
+    pool = get_webhook_pool()
+    events = new_webhook_events(data)
+    for i, (kind, event) in enumerate(events):
+        if kind == 'message':
+            accepted = pool.submit(event.get('from'), process_message, event, data, timeout=WEBHOOK_ENQUEUE_TIMEOUT_SECONDS)
         else:
-            send_whatsapp_message(from_number, "Invalid service selected. Please try again.")
-            send_interactive_main_menu(from_number) # Reset
-            conversation_states.pop(from_number, None)
-
-    elif current_state['step'] == 'select_time':
-        # list_id will contain something like "book_slot_2025-07-20 09:00"
-        try:
-            full_datetime_str = list_id.replace("book_slot_", "")
-            
-            # Ensure the service details are in the state
-            if 'service_id' not in current_state or 'duration' not in current_state:
-                send_whatsapp_message(from_number, "Oops, something went wrong with the service selection. Please start over.")
-                send_interactive_main_menu(from_number)
-                conversation_states.pop(from_number, None)
-                return
-
-            appointment_id = book_appointment(
-                customer_id,
-                current_state['service_id'],
-                full_datetime_str,
-                current_state['duration'],
-                from_number # Using from_number as conversation_id for simplicity here
-            )
-
-            if appointment_id:
-                confirmation_msg = f"Your {current_state['service_name']} appointment is confirmed for {full_datetime_str} (SAST). We look forward to seeing you!"
-                sent_msg_id = send_whatsapp_message(from_number, confirmation_msg)
-                if sent_msg_id:
-                    update_appointment_confirmation_id(appointment_id, sent_msg_id)
-                send_whatsapp_message(from_number, "Is there anything else I can assist you with?")
-                send_interactive_main_menu(from_number) # Go back to main menu
-                conversation_states.pop(from_number, None) # Clear state
-            else:
-                send_whatsapp_message(from_number, "Sorry, that time slot is no longer available or there was an issue booking. Please try another time or date.")
-                # Re-offer slots or main menu
-                send_interactive_main_menu(from_number)
-                conversation_states.pop(from_number, None)
-
-        except Exception as e:
-            print(f"Error processing time slot selection: {e}")
-            send_whatsapp_message(from_number, "There was an error processing your request. Please try again or type 'cancel'.")
-            send_interactive_main_menu(from_number)
-            conversation_states.pop(from_number, None)
-
-# --- Helper functions for sending interactive messages ---
-def send_interactive_main_menu(to_number):
-    buttons = [
-        {"type": "reply", "reply": {"id": "book_appointment", "title": "Book Appointment"}},
-        {"type": "reply", "reply": {"id": "view_appointments", "title": "View My Appointments"}},
-        {"type": "reply", "reply": {"id": "get_help", "title": "Get Help"}}
-    ]
-    interactive_body = {
-        "type": "button",
-        "body": {"text": "How can I help you today?"},
-        "action": {"buttons": buttons}
-    }
-    send_whatsapp_message(to_number, interactive_body, message_type="interactive")
-
-def send_interactive_list_message(to_number, header_text, button_text, sections_data):
-    # sections_data is a list of {"id": "...", "title": "..."} for list items
-    list_sections = [
-        {
-            "rows": sections_data
-        }
-    ]
-    interactive_body = {
-        "type": "list",
-        "header": {"type": "text", "text": header_text},
-        "body": {"text": "Please choose from the following:"},
-        "action": {
-            "button": button_text,
-            "sections": list_sections
-        }
-    }
-    send_whatsapp_message(to_number, interactive_body, message_type="interactive")
-
+            accepted = pool.submit(event.get('recipient_id'), process_status, event, data, timeout=WEBHOOK_ENQUEUE_TIMEOUT_SECONDS)
+        if not accepted:
+            log.warning("Webhook queue full, rejecting %s %s", kind, event.get('id'))
+            # Events already queued will run; the retry only needs to bring the rest
+            for rejected in events[i:]:
+                deduplicator.forget(*rejected)
+            return False
+    return True
+
+# --- Background webhook workers (WEBHOOK_MODE=queued) ---
+_webhook_pool = None
+_webhook_pool_lock = threading.Lock()
+
+def get_webhook_pool():
+    global _webhook_pool
+    if _webhook_pool is None:
+        with _webhook_pool_lock:
+            if _webhook_pool is None:
+                _webhook_pool = KeyedWorkerPool(WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, name="webhook")
+                atexit.register(drain_webhook_pool)
+    return _webhook_pool
+
+def drain_webhook_pool():
+    global _webhook_pool
+    pool, _webhook_pool = _webhook_pool, None
+    if pool is not None:
+        log.info("Draining webhook queue (%d pending)", pool.queue_depth())
+        if not pool.shutdown(WEBHOOK_DRAIN_TIMEOUT_SECONDS):
+            log.warning("Webhook queue did not drain before the timeout")
 
 if __name__ == '__main__':
     # Load environment variables for local testing
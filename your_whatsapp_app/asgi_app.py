@@ -0,0 +1,178 @@
+# asgi_app.py
+# ASGI serving mode. The same webhook and conversation flow as app.py
+# (conversation.py), but over aiomysql (async_database.py) and aiohttp
+# (async_whatsapp_api.py), so one event loop per process keeps many
+# conversations in flight instead of one thread each:
+#   pip install -r requirements.txt  (aiomysql, aiohttp and uvicorn)
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 4
+# The Flask app (app.py) is still the default and isn't imported here.
+# Deduplication, conversation states, the service catalog, the availability
+# cache and the messages_log / delivery status writers are shared with it
+# through conversation.py. With their default in-process backends they don't
+# wait on I/O; the redis and sqlite backends do, on the event loop (startup
+# logs a warning, see loop_blocking_settings). Messages are processed within
+# the request, like WEBHOOK_MODE=inline.
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from config import (
+    VERIFY_TOKEN, WEBHOOK_DRAIN_TIMEOUT_SECONDS, DEDUP_BACKEND, STATE_STORE_BACKEND, AVAILABILITY_INVALIDATION_BACKEND
+)
+from async_database import (
+    resolve_customer, resolve_customers, get_available_time_slots, find_next_available_slots, book_appointment,
+    update_appointment_confirmation_id, update_appointment_status,
+    get_customer_appointments, get_customer_appointment, close_pool, get_pool_stats
+)
+from async_whatsapp_api import send_whatsapp_message, send_batch, close_session
+from service_catalog import get_service_catalog
+from conversation import ConversationBackend, ConversationFlow
+import metrics
+from metrics import timed
+from structured_log import configure_logging
+
+log = logging.getLogger("asgi_app")
+
+# Confirmation batches sent after the request returned; awaited on shutdown
+_background_tasks = set()
+
+
+def spawn(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+@metrics.register_collector
+def collect_async_stats():
+    values = {f"async_db_pool_{key}": value for key, value in get_pool_stats().items()}
+    values['asgi_background_tasks'] = len(_background_tasks)
+    return values
+
+
+# --- ASGI plumbing ---
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    method, path = scope['method'], scope['path']
+    content_type = 'text/plain; charset=utf-8'
+    if path == '/webhook' and method == 'GET':
+        status, body = verify_webhook(parse_qs(scope['query_string'].decode('latin-1')))
+    elif path == '/webhook' and method == 'POST':
+        status, body = await handle_webhook(await read_body(receive))
+    elif path == '/metrics' and method == 'GET':
+        status, body = 200, metrics.render()
+        content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    else:
+        status, body = 404, 'Not Found'
+    raw = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(raw)).encode('latin-1'))],
+    })
+    await send({'type': 'http.response.body', 'body': raw})
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await startup()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+def loop_blocking_settings():
+    # Settings under which shared code does synchronous I/O on the event loop
+    return [f"{name}={value}" for name, value, blocks in (
+        ("DEDUP_BACKEND", DEDUP_BACKEND, DEDUP_BACKEND == "redis"),
+        ("STATE_STORE_BACKEND", STATE_STORE_BACKEND, STATE_STORE_BACKEND == "sqlite"),
+        ("AVAILABILITY_INVALIDATION_BACKEND", AVAILABILITY_INVALIDATION_BACKEND, AVAILABILITY_INVALIDATION_BACKEND == "redis"),
+    ) if blocks]
+
+async def startup():
+    configure_logging()
+    blocking = loop_blocking_settings()
+    if blocking:
+        log.warning("%s do synchronous I/O on the event loop; every request waits on them", ", ".join(blocking))
+    # Load the service catalog up front so the first "Book Appointment" doesn't pay for it
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, get_service_catalog().reload)
+    except Exception as e:
+        log.warning("Could not preload service catalog, will load on first use (blocking the event loop): %s", e)
+
+async def shutdown():
+    await drain_background_tasks()
+    await close_session()
+    await close_pool()
+
+async def drain_background_tasks(timeout=WEBHOOK_DRAIN_TIMEOUT_SECONDS):
+    if _background_tasks:
+        log.info("Waiting for %d background sends", len(_background_tasks))
+        _, pending = await asyncio.wait(set(_background_tasks), timeout=timeout)
+        if pending:
+            log.warning("%d background sends did not finish before the timeout", len(pending))
+
+
+# --- Webhook ---
+def verify_webhook(params):
+    mode = params.get('hub.mode', [None])[0]
+    token = params.get('hub.verify_token', [None])[0]
+    challenge = params.get('hub.challenge', [''])[0]
+
+    if mode and token:
+        if mode == 'subscribe' and token == VERIFY_TOKEN:
+            log.info("Webhook verified")
+            return 200, challenge
+        return 403, 'Verification token mismatch'
+    return 400, 'Missing parameters'
+
+@timed("http")
+async def handle_webhook(body):
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return 400, 'Bad Request'
+    log.debug("Received webhook", extra={'event': 'webhook_received', 'payload': data})
+    if isinstance(data, dict) and data.get('object') == 'whatsapp_business_account':
+        try:
+            await flow.process_webhook(data)
+        except Exception:
+            log.exception("Error processing webhook")
+            return 500, 'Internal Server Error'
+    return 200, 'OK'
+
+# --- Conversation flow (conversation.py) over aiomysql and aiohttp ---
+async def send_confirmation(to_number, appointment_id, messages):
+    # After the response is sent; the confirmation id is stored once it's sent
+    spawn(store_confirmation(to_number, appointment_id, messages))
+
+async def store_confirmation(to_number, appointment_id, messages):
+    try:
+        sent_msg_id = (await send_batch(to_number, messages))[0]
+        if sent_msg_id:
+            await update_appointment_confirmation_id(appointment_id, sent_msg_id)
+    except Exception as e:
+        log.error("Error sending booking confirmation for %s: %s", appointment_id, e)
+
+flow = ConversationFlow(ConversationBackend(**{fn.__name__: fn for fn in (
+    resolve_customer, resolve_customers, get_available_time_slots, find_next_available_slots, book_appointment,
+    get_customer_appointments, get_customer_appointment, update_appointment_status,
+    send_whatsapp_message, send_confirmation,
+)}))
@@ -0,0 +1,273 @@
+# async_database.py
+# Coroutine versions of the database.py helpers the conversation handlers
+# call, for the ASGI mode (asgi_app.py). Connections come from an aiomysql
+# pool, so a request waiting on MySQL gives the event loop back instead of
+# holding a thread. SQL (the statements and builders database.py and
+# booking.py export), caches and invalidation are shared with database.py;
+# messages_log rows and delivery statuses still go through its background
+# writers, which never block the caller.
+import asyncio
+import datetime
+import logging
+import uuid
+from contextlib import asynccontextmanager
+
+try:
+    import aiomysql
+except ImportError: # only needed for the ASGI mode
+    aiomysql = None
+
+from config import (
+    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_POOL_TIMEOUT_SECONDS, DB_POOL_RECYCLE_SECONDS,
+    ASYNC_DB_POOL_SIZE, NEXT_AVAILABLE_HORIZON_DAYS
+)
+from availability import (
+    booked_intervals_query, day_range, capacity_for, compute_availability_from_bookings, next_available_from_bookings
+)
+from availability_cache import get_availability_cache
+from booking import reserve_slots_async, release_slots_async, error_code, SlotTaken, DEADLOCK
+# Shared with database.py, so a customer resolved in either mode is cached for both
+from database import _customer_id_cache, invalidate_availability
+from database import (
+    INSERT_APPOINTMENT, LOCK_APPOINTMENT, SET_APPOINTMENT_STATUS, SET_CONFIRMATION_MESSAGE_ID, CUSTOMER_APPOINTMENT,
+    customers_upsert_query, customer_ids_query, customer_appointments_query
+)
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = None
+
+
+async def get_pool():
+    global _pool, _pool_lock
+    if _pool is None:
+        if aiomysql is None:
+            raise RuntimeError("The aiomysql package is required for the ASGI mode")
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await aiomysql.create_pool(
+                    host=DB_HOST, user=DB_USER, password=DB_PASSWORD, db=DB_NAME,
+                    minsize=1, maxsize=ASYNC_DB_POOL_SIZE, pool_recycle=int(DB_POOL_RECYCLE_SECONDS),
+                    autocommit=False
+                )
+    return _pool
+
+async def close_pool():
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+def get_pool_stats():
+    if _pool is None:
+        return {}
+    return {'size': _pool.size, 'idle': _pool.freesize, 'max_size': _pool.maxsize}
+
+@asynccontextmanager
+async def connection():
+    # Usage: async with connection() as conn: ...
+    # With autocommit off even a read opens a transaction, and aiomysql
+    # closes a connection released with one open, so anything not committed
+    # is rolled back first and the connection stays in the pool.
+    pool = await get_pool()
+    conn = await asyncio.wait_for(pool.acquire(), DB_POOL_TIMEOUT_SECONDS)
+    try:
+        yield conn
+    finally:
+        try:
+            if conn.get_transaction_status():
+                await conn.rollback()
+        finally:
+            pool.release(conn)
+
+def _cursor(conn, dictionary=False):
+    return conn.cursor(aiomysql.DictCursor) if dictionary else conn.cursor()
+
+
+@timed("db")
+async def resolve_customer(phone_number, name):
+    # See database.resolve_customer
+    customer_id = _customer_id_cache.get(phone_number)
+    if customer_id:
+        return customer_id
+
+    async with connection() as conn:
+        async with _cursor(conn) as cursor:
+            try:
+                await cursor.execute(*customers_upsert_query([(str(uuid.uuid4()), phone_number, name)]))
+                await cursor.execute(*customer_ids_query([phone_number]))
+                row = await cursor.fetchone()
+                await conn.commit()
+            except Exception as e:
+                log.error("Error resolving customer %s: %s", phone_number, e)
+                await conn.rollback()
+                return None
+    customer_id = row[1] if row else None
+    if customer_id:
+        _customer_id_cache.set(phone_number, customer_id)
+    return customer_id
+
+@timed("db")
+async def resolve_customers(phone_numbers_and_names):
+    # See database.resolve_customers
+    resolved = {}
+    missing = {}
+    for phone_number, name in phone_numbers_and_names:
+        customer_id = _customer_id_cache.get(phone_number)
+        if customer_id:
+            resolved[phone_number] = customer_id
+        else:
+            missing[phone_number] = name
+    if not missing:
+        return resolved
+
+    async with connection() as conn:
+        async with _cursor(conn) as cursor:
+            try:
+                await cursor.execute(*customers_upsert_query(
+                    [(str(uuid.uuid4()), phone_number, name) for phone_number, name in missing.items()]))
+                await cursor.execute(*customer_ids_query(list(missing)))
+                for phone_number, customer_id in await cursor.fetchall():
+                    _customer_id_cache.set(phone_number, customer_id)
+                    resolved[phone_number] = customer_id
+                await conn.commit()
+            except Exception as e:
+                log.error("Error resolving customers: %s", e)
+                await conn.rollback()
+    return resolved
+
+async def fetch_booked_intervals(service_id, range_start, range_end):
+    async with connection() as conn:
+        async with _cursor(conn) as cursor:
+            await cursor.execute(*booked_intervals_query(service_id, range_start, range_end))
+            return [(row[0], row[1]) for row in await cursor.fetchall()]
+
+@timed("db")
+async def get_available_time_slots(service_duration_minutes, date, service_id=None):
+    # See database.get_available_time_slots; shares its availability cache
+    day = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+
+    async def compute():
+        bookings = await fetch_booked_intervals(service_id, *day_range(day, day))
+        return compute_availability_from_bookings(
+            bookings, service_duration_minutes, day, capacity=capacity_for(service_id))[day]
+
+    slots = await get_availability_cache().get_or_compute_async(service_id, date, service_duration_minutes, compute)
+    now = datetime.datetime.now()
+    return [slot.strftime("%H:%M") for slot in slots if slot >= now]
+
+@timed("db")
+async def find_next_available_slots(service_id, service_duration_minutes, start_date, limit, horizon_days=None):
+    # See database.find_next_available_slots
+    end_date = start_date + datetime.timedelta(days=(horizon_days or NEXT_AVAILABLE_HORIZON_DAYS) - 1)
+    bookings = await fetch_booked_intervals(service_id, *day_range(start_date, end_date))
+    return next_available_from_bookings(
+        bookings, service_duration_minutes, start_date, end_date, limit,
+        capacity=capacity_for(service_id), not_before=datetime.datetime.now()
+    )
+
+@timed("db")
+async def book_appointment(customer_id, service_id, start_time_str, duration_minutes, whatsapp_conversation_id, replaces=None):
+    # See database.book_appointment: appointment row and slot reservations in
+    # one transaction, a taken slot fails on its unique key, and a rescheduled
+    # appointment is cancelled in that same transaction
+    start_time = datetime.datetime.strptime(start_time_str, "%Y-%m-%d %H:%M")
+    end_time = start_time + datetime.timedelta(minutes=duration_minutes)
+
+    for attempt in range(2):
+        appointment_id = str(uuid.uuid4())
+        replaced = None
+        async with connection() as conn:
+            async with _cursor(conn) as cursor:
+                try:
+                    if replaces:
+                        await cursor.execute(LOCK_APPOINTMENT, (replaces,))
+                        replaced = await cursor.fetchone()
+                        if not replaced or replaced[3] not in ('pending', 'confirmed'):
+                            # Cancelled (or rescheduled) since the customer picked it; booking
+                            # anyway would leave them with an extra appointment
+                            await conn.rollback()
+                            log.info("Appointment %s is no longer active, not rescheduled", replaces)
+                            return None
+                        await cursor.execute(SET_APPOINTMENT_STATUS, ('cancelled', replaces))
+                        await release_slots_async(cursor, replaces)
+                    await cursor.execute(
+                        INSERT_APPOINTMENT,
+                        (appointment_id, customer_id, service_id, start_time, end_time, 'confirmed', whatsapp_conversation_id)
+                    )
+                    await reserve_slots_async(cursor, appointment_id, service_id, start_time, end_time)
+                    await conn.commit()
+                except SlotTaken:
+                    await conn.rollback()
+                    log.info("Slot already booked or overlaps")
+                    invalidate_availability(service_id, start_time, end_time)
+                    return None
+                except Exception as e:
+                    await conn.rollback()
+                    if error_code(e) == DEADLOCK and attempt == 0:
+                        continue
+                    log.exception("Error booking appointment: %s", e)
+                    return None
+        invalidate_availability(service_id, start_time, end_time)
+        if replaced:
+            invalidate_availability(replaced[0], replaced[1], replaced[2])
+        return appointment_id
+
+@timed("db")
+async def update_appointment_status(appointment_id, status):
+    async with connection() as conn:
+        async with _cursor(conn, dictionary=True) as cursor:
+            try:
+                await cursor.execute(LOCK_APPOINTMENT, (appointment_id,))
+                appointment = await cursor.fetchone()
+                if not appointment:
+                    return False
+                await cursor.execute(SET_APPOINTMENT_STATUS, (status, appointment_id))
+                if status not in ('pending', 'confirmed'):
+                    await release_slots_async(cursor, appointment_id)
+                elif appointment['status'] not in ('pending', 'confirmed'):
+                    await reserve_slots_async(
+                        cursor, appointment_id, appointment['service_id'], appointment['start_time'], appointment['end_time']
+                    )
+                await conn.commit()
+            except SlotTaken:
+                await conn.rollback()
+                log.info("Appointment %s not reactivated, its time has been booked since", appointment_id)
+                return False
+            except Exception as e:
+                log.error("Error updating appointment status: %s", e)
+                await conn.rollback()
+                return False
+    invalidate_availability(appointment['service_id'], appointment['start_time'], appointment['end_time'])
+    return True
+
+@timed("db")
+async def update_appointment_confirmation_id(appointment_id, message_id):
+    async with connection() as conn:
+        async with _cursor(conn) as cursor:
+            try:
+                await cursor.execute(SET_CONFIRMATION_MESSAGE_ID, (message_id, appointment_id))
+                await conn.commit()
+            except Exception as e:
+                log.error("Error updating confirmation message ID: %s", e)
+                await conn.rollback()
+
+@timed("db")
+async def get_customer_appointments(customer_id, after=None, limit=10):
+    # See database.get_customer_appointments (keyset pages)
+    async with connection() as conn:
+        async with _cursor(conn, dictionary=True) as cursor:
+            await cursor.execute(*customer_appointments_query(customer_id, datetime.datetime.now(), after, limit))
+            return list(await cursor.fetchall())
+
+@timed("db")
+async def get_customer_appointment(customer_id, appointment_id):
+    async with connection() as conn:
+        async with _cursor(conn, dictionary=True) as cursor:
+            await cursor.execute(CUSTOMER_APPOINTMENT, (appointment_id, customer_id))
+            return await cursor.fetchone()
@@ -0,0 +1,120 @@
+# async_whatsapp_api.py
+# Coroutine versions of the whatsapp_api.py senders for the ASGI mode
+# (asgi_app.py), on one pooled aiohttp session. Payload building, the rate
+# limit, retry policy and send statistics are shared with whatsapp_api.py.
+# (httpx was tried first: its connection pool rescans every connection per
+# request and used more CPU than the whole sync app at 100 conversations.)
+import asyncio
+import json
+import logging
+import time
+
+try:
+    import aiohttp
+except ImportError: # only needed for the ASGI mode
+    aiohttp = None
+
+from config import (
+    ACCESS_TOKEN, GRAPH_API_TIMEOUT_SECONDS, GRAPH_API_MAX_RETRIES, ASYNC_GRAPH_API_MAX_CONNECTIONS
+)
+from whatsapp_api import (
+    RETRYABLE_STATUS_CODES, build_message_payload, build_template_payload, messages_url,
+    message_sent, rate_limiter, record_send, retry_delay
+)
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+_session = None
+
+
+def get_session():
+    # Created on first use inside the running event loop, which it stays bound to
+    global _session
+    if _session is None:
+        if aiohttp is None:
+            raise RuntimeError("The aiohttp package is required for the ASGI mode")
+        _session = aiohttp.ClientSession(
+            headers={"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=GRAPH_API_TIMEOUT_SECONDS),
+            connector=aiohttp.TCPConnector(limit=ASYNC_GRAPH_API_MAX_CONNECTIONS),
+        )
+    return _session
+
+async def close_session():
+    global _session
+    session, _session = _session, None
+    if session is not None:
+        await session.close()
+
+async def acquire_rate_limit():
+    # The shared token bucket, polled without blocking the event loop
+    waited = 0.0
+    while not rate_limiter.try_acquire():
+        delay = 1.0 / rate_limiter.rate
+        await asyncio.sleep(delay)
+        waited += delay
+    return waited
+
+@timed("graph_api")
+async def post_message(payload, label="WhatsApp message"):
+    # See whatsapp_api.post_message: retries 429/5xx and connection errors,
+    # returns the WhatsApp message id or None
+    session = get_session()
+    started = time.monotonic()
+    rate_wait = 0.0
+    response = None
+    attempt = 0
+    while True:
+        rate_wait += await acquire_rate_limit()
+        body = None
+        try:
+            async with session.post(messages_url(), json=payload) as response:
+                body = await response.text()
+                if response.status not in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                    # A 2xx body that isn't JSON is a failed send, as response.json() makes it on the sync path
+                    response_data = json.loads(body)
+                    record_send(True, time.monotonic() - started, attempt, rate_wait)
+                    return message_sent(payload, response_data, label, attempt + 1)
+            error = f"HTTP {response.status}"
+        except (aiohttp.ClientResponseError, ValueError) as e:
+            log.error("Error sending %s: %s", label, e, extra={'to': payload.get('to'), 'response': body})
+            record_send(False, time.monotonic() - started, attempt, rate_wait)
+            return None
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            response = None
+            error = repr(e)
+
+        if attempt >= GRAPH_API_MAX_RETRIES:
+            log.error("Error sending %s: %s, giving up after %d attempts", label, error, attempt + 1, extra={
+                'to': payload.get('to'), 'response': body,
+            })
+            record_send(False, time.monotonic() - started, attempt, rate_wait)
+            return None
+        delay = retry_delay(response, attempt)
+        log.warning("Retrying %s in %.2fs (%s)", label, delay, error)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+@timed("graph_api")
+async def send_whatsapp_message(to_number, message_body, message_type="text"):
+    payload = build_message_payload(to_number, message_body, message_type)
+    return await post_message(payload, "WhatsApp message")
+
+@timed("graph_api")
+async def send_template_message(to_number, template_name, components=None, language_code="en_US"):
+    payload = build_template_payload(to_number, template_name, components, language_code)
+    return await post_message(payload, "Template message")
+
+async def send_batch(to_number, messages, stop_on_failure=True):
+    # See outbound.OutboundDispatcher.send_batch: sent in order, and the rest
+    # skipped once one fails. Returns the list of message ids.
+    ids = []
+    for message in messages:
+        payload = message if isinstance(message, dict) else build_message_payload(to_number, message[0], message[1])
+        if stop_on_failure and ids and ids[-1] is None:
+            ids.append(None)
+            continue
+        ids.append(await post_message(payload, f"{payload.get('type')} message to {to_number}"))
+    return ids
@@ -0,0 +1,189 @@
+# availability.py
+import datetime
+import heapq
+
+from config import (
+    SLOT_GRANULARITY_MINUTES, WORKING_HOURS, WORKING_DAYS,
+    DEFAULT_SERVICE_CAPACITY, SERVICE_CAPACITY, MAX_APPOINTMENT_MINUTES
+)
+
+ACTIVE_STATUSES = ('pending', 'confirmed')
+
+
+def parse_working_hours(spec=WORKING_HOURS):
+    opens, closes = spec.split("-")
+    return (
+        datetime.datetime.strptime(opens.strip(), "%H:%M").time(),
+        datetime.datetime.strptime(closes.strip(), "%H:%M").time(),
+    )
+
+def slot_grid_origin(day, working_hours=None):
+    # Candidate start times and the appointment_slots grid (booking.py) both
+    # step from the day's opening time
+    return datetime.datetime.combine(day, (working_hours or parse_working_hours())[0])
+
+def capacity_for(service_id):
+    if service_id is None:
+        return DEFAULT_SERVICE_CAPACITY
+    return SERVICE_CAPACITY.get(str(service_id), DEFAULT_SERVICE_CAPACITY)
+
+def booked_intervals_query(service_id, range_start, range_end):
+    # (sql, params) selecting every active booking overlapping
+    # [range_start, range_end), sorted by start. The lower bound on start_time
+    # (instead of DATE(start_time) = ...) keeps this a range scan on
+    # (service_id, start_time).
+    lower = range_start - datetime.timedelta(minutes=MAX_APPOINTMENT_MINUTES)
+    if service_id is None:
+        return """
+            SELECT start_time, end_time FROM appointments
+            WHERE start_time >= %s AND start_time < %s AND end_time > %s
+            AND status IN ('pending', 'confirmed')
+            ORDER BY start_time
+            """, (lower, range_end, range_start)
+    return """
+        SELECT start_time, end_time FROM appointments
+        WHERE service_id = %s AND start_time >= %s AND start_time < %s AND end_time > %s
+        AND status IN ('pending', 'confirmed')
+        ORDER BY start_time
+        """, (service_id, lower, range_end, range_start)
+
+def fetch_booked_intervals(cursor, service_id, range_start, range_end):
+    cursor.execute(*booked_intervals_query(service_id, range_start, range_end))
+    return [(row[0], row[1]) for row in cursor.fetchall()]
+
+def day_range(start_date, end_date):
+    # [midnight of start_date, midnight after end_date)
+    return (datetime.datetime.combine(start_date, datetime.time.min),
+            datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min))
+
+def blocked_intervals(bookings, capacity=1):
+    # Collapses start-sorted (start, end) bookings into the sorted, disjoint
+    # intervals during which `capacity` or more of them overlap.
+    blocked = []
+
+    def block(start, end):
+        if blocked and start <= blocked[-1][1]:
+            if end > blocked[-1][1]:
+                blocked[-1] = (blocked[-1][0], end)
+        else:
+            blocked.append((start, end))
+
+    if capacity <= 1:
+        for start, end in bookings:
+            block(start, end)
+        return blocked
+
+    active_ends = []
+    opened_at = None
+    for start, end in bookings:
+        while active_ends and active_ends[0] <= start:
+            ended = heapq.heappop(active_ends)
+            if opened_at is not None and len(active_ends) < capacity:
+                block(opened_at, ended)
+                opened_at = None
+        heapq.heappush(active_ends, end)
+        if opened_at is None and len(active_ends) >= capacity:
+            opened_at = start
+    while active_ends:
+        ended = heapq.heappop(active_ends)
+        if opened_at is not None and len(active_ends) < capacity:
+            block(opened_at, ended)
+            opened_at = None
+    return blocked
+
+def free_slots(day_open, day_close, duration, granularity, blocked, not_before=None):
+    # Walks candidate start times and the blocked intervals together; both only
+    # move forward, so a day costs O(slots + blocked).
+    slots = []
+    i = 0
+    t = day_open
+    while t + duration <= day_close:
+        if not_before is None or t >= not_before:
+            while i < len(blocked) and blocked[i][1] <= t:
+                i += 1
+            if i == len(blocked) or blocked[i][0] >= t + duration:
+                slots.append(t)
+        t += granularity
+    return slots
+
+def iter_available_days(blocked, duration, granularity, start_date, end_date, opens, closes,
+                        working_days=WORKING_DAYS, not_before=None):
+    # Yields (date, [datetime, ...]) for each date in [start_date, end_date],
+    # walking the sorted blocked intervals once across the whole range.
+    i = 0
+    day = start_date
+    while day <= end_date:
+        day_open = slot_grid_origin(day, (opens, closes))
+        day_close = datetime.datetime.combine(day, closes)
+        if day.weekday() not in working_days:
+            yield day, []
+        else:
+            # Blocked intervals are sorted, so each day resumes where the previous one stopped
+            while i < len(blocked) and blocked[i][1] <= day_open:
+                i += 1
+            j = i
+            while j < len(blocked) and blocked[j][0] < day_close:
+                j += 1
+            yield day, free_slots(day_open, day_close, duration, granularity, blocked[i:j], not_before)
+            i = j if j == i else j - 1
+        day += datetime.timedelta(days=1)
+
+def compute_availability_from_bookings(bookings, duration_minutes, start_date, end_date=None,
+                                       capacity=1, granularity_minutes=SLOT_GRANULARITY_MINUTES,
+                                       working_hours=None, working_days=WORKING_DAYS, not_before=None):
+    # Pure part of the engine: returns {date: [datetime, ...]} for every date in
+    # [start_date, end_date] given start-sorted bookings covering that range.
+    end_date = end_date or start_date
+    opens, closes = working_hours or parse_working_hours()
+    return dict(iter_available_days(
+        blocked_intervals(bookings, capacity),
+        datetime.timedelta(minutes=duration_minutes), datetime.timedelta(minutes=granularity_minutes),
+        start_date, end_date, opens, closes, working_days, not_before
+    ))
+
+def next_available_from_bookings(bookings, duration_minutes, start_date, end_date, limit,
+                                 capacity=1, granularity_minutes=SLOT_GRANULARITY_MINUTES,
+                                 working_hours=None, working_days=WORKING_DAYS, not_before=None):
+    # The earliest `limit` free start times in [start_date, end_date], in
+    # order. Stops at the day where the limit is reached.
+    opens, closes = working_hours or parse_working_hours()
+    found = []
+    for day, slots in iter_available_days(
+            blocked_intervals(bookings, capacity),
+            datetime.timedelta(minutes=duration_minutes), datetime.timedelta(minutes=granularity_minutes),
+            start_date, end_date, opens, closes, working_days, not_before):
+        found.extend(slots[:limit - len(found)])
+        if len(found) >= limit:
+            break
+    return found
+
+def compute_availability(cursor, duration_minutes, start_date, end_date=None, service_id=None,
+                         capacity=None, granularity_minutes=SLOT_GRANULARITY_MINUTES,
+                         working_hours=None, not_before=None):
+    # One range query for the whole date range, then a single merge pass.
+    end_date = end_date or start_date
+    range_start, range_end = day_range(start_date, end_date)
+    bookings = fetch_booked_intervals(cursor, service_id, range_start, range_end)
+    return compute_availability_from_bookings(
+        bookings, duration_minutes, start_date, end_date,
+        capacity=capacity if capacity is not None else capacity_for(service_id),
+        granularity_minutes=granularity_minutes,
+        working_hours=working_hours,
+        not_before=not_before
+    )
+
+def find_next_available(cursor, duration_minutes, start_date, horizon_days, limit, service_id=None,
+                        capacity=None, granularity_minutes=SLOT_GRANULARITY_MINUTES,
+                        working_hours=None, not_before=None):
+    # Earliest `limit` open slots over `horizon_days` days from start_date:
+    # one range query for the whole horizon instead of one per day tried.
+    end_date = start_date + datetime.timedelta(days=horizon_days - 1)
+    range_start, range_end = day_range(start_date, end_date)
+    bookings = fetch_booked_intervals(cursor, service_id, range_start, range_end)
+    return next_available_from_bookings(
+        bookings, duration_minutes, start_date, end_date, limit,
+        capacity=capacity if capacity is not None else capacity_for(service_id),
+        granularity_minutes=granularity_minutes,
+        working_hours=working_hours,
+        not_before=not_before
+    )
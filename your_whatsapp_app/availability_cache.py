@@ -0,0 +1,184 @@
+# availability_cache.py
+import logging
+import threading
+import time
+
+from cache import LRUCache
+from config import (
+    AVAILABILITY_CACHE_MAX_ENTRIES, AVAILABILITY_CACHE_TTL_SECONDS,
+    AVAILABILITY_INVALIDATION_BACKEND, REDIS_URL
+)
+
+try:
+    import redis
+except ImportError: # only needed for AVAILABILITY_INVALIDATION_BACKEND=redis
+    redis = None
+
+CHANNEL = "availability-invalidations"
+
+log = logging.getLogger(__name__)
+
+
+def _cache_key(service_id, date):
+    return (str(service_id) if service_id is not None else None, str(date))
+
+def _encode_key(service_id, date):
+    return f"{service_id if service_id is not None else ''}|{date}"
+
+def _decode_key(raw):
+    service_id, date = raw.split("|", 1)
+    return (service_id or None, date)
+
+
+class LocalInvalidationBus:
+    # In-process stand-in for the cross-process bus: every cache subscribed to
+    # the same bus object sees every invalidation. Good enough for one process
+    # and for tests that simulate several "processes" with several caches.
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def publish(self, service_id, date):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(service_id, date)
+
+
+class RedisInvalidationBus:
+    # Broadcasts invalidations to every app process over Redis pub/sub.
+    # If the subscription drops we can't know what we missed, so the local
+    # cache is cleared before listening again.
+
+    def __init__(self, url=REDIS_URL, channel=CHANNEL):
+        if redis is None:
+            raise RuntimeError("The redis package is required for AVAILABILITY_INVALIDATION_BACKEND=redis")
+        self._client = redis.Redis.from_url(url)
+        self._channel = channel
+        self._subscribers = []
+        self._thread = None
+
+    def subscribe(self, callback, on_reset=None):
+        self._subscribers.append((callback, on_reset))
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="availability-invalidations", daemon=True)
+            self._thread.start()
+
+    def publish(self, service_id, date):
+        self._client.publish(self._channel, _encode_key(service_id, date))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel)
+                for message in pubsub.listen():
+                    service_id, date = _decode_key(message['data'].decode("utf-8"))
+                    for callback, _ in self._subscribers:
+                        callback(service_id, date)
+            except Exception as e:
+                log.warning("Availability invalidation subscription lost: %s", e)
+                for _, on_reset in self._subscribers:
+                    if on_reset:
+                        on_reset()
+                time.sleep(1)
+
+
+class AvailabilityCache:
+    # Computed day availability keyed by (service_id, date). Entries are
+    # dropped on booking/status changes (here and, via the bus, in every other
+    # process) and otherwise expire after the TTL as a safety net.
+
+    def __init__(self, bus=None, max_entries=AVAILABILITY_CACHE_MAX_ENTRIES, ttl_seconds=AVAILABILITY_CACHE_TTL_SECONDS):
+        self._cache = LRUCache(max_entries, ttl_seconds)
+        self._inflight = {} # key -> token of the computation allowed to store its result
+        self._lock = threading.Lock()
+        self._bus = bus or LocalInvalidationBus()
+        if isinstance(self._bus, RedisInvalidationBus):
+            self._bus.subscribe(self._drop, on_reset=self._cache.clear)
+        else:
+            self._bus.subscribe(self._drop)
+
+    def get_or_compute(self, service_id, date, duration_minutes, compute):
+        key = _cache_key(service_id, date)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == duration_minutes:
+            return cached[1]
+
+        token = self._begin(key)
+        try:
+            slots = compute()
+        except Exception:
+            self._finish(key, token)
+            raise
+        self._finish(key, token, (duration_minutes, slots))
+        return slots
+
+    async def get_or_compute_async(self, service_id, date, duration_minutes, compute):
+        # Same, with `compute` a coroutine function (async_database.py)
+        key = _cache_key(service_id, date)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == duration_minutes:
+            return cached[1]
+
+        token = self._begin(key)
+        try:
+            slots = await compute()
+        except Exception:
+            self._finish(key, token)
+            raise
+        self._finish(key, token, (duration_minutes, slots))
+        return slots
+
+    def _begin(self, key):
+        token = object()
+        with self._lock:
+            self._inflight[key] = token
+        return token
+
+    def _finish(self, key, token, entry=None):
+        with self._lock:
+            # An invalidation that arrived while we were computing removed our
+            # token; the result may predate that booking, so don't cache it.
+            if self._inflight.get(key) is token:
+                del self._inflight[key]
+                if entry is not None:
+                    self._cache.set(key, entry)
+
+    def invalidate(self, service_id, date):
+        self._drop(service_id, date) # this process sees its own booking immediately
+        try:
+            self._bus.publish(service_id, str(date))
+        except Exception as e:
+            log.error("Error publishing availability invalidation: %s", e)
+
+    def _drop(self, service_id, date):
+        keys = [_cache_key(service_id, date)]
+        if service_id is not None:
+            # Service-agnostic lookups count every service's bookings
+            keys.append(_cache_key(None, date))
+        with self._lock:
+            for key in keys:
+                self._inflight.pop(key, None)
+                self._cache.pop(key)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+_availability_cache = None
+_availability_cache_lock = threading.Lock()
+
+def get_availability_cache():
+    global _availability_cache
+    if _availability_cache is None:
+        with _availability_cache_lock:
+            if _availability_cache is None:
+                bus = RedisInvalidationBus() if AVAILABILITY_INVALIDATION_BACKEND == "redis" else LocalInvalidationBus()
+                _availability_cache = AvailabilityCache(bus)
+    return _availability_cache
@@ -0,0 +1,153 @@
+# bench_availability.py
+# Compares the old per-slot scan with the availability engine on busy days,
+# and day-by-day retries with the single-query "next available" search when
+# the next opening is weeks out.
+#   python bench_availability.py --bookings 300 --days 14
+#   python bench_availability.py --horizon 180 --full-days 120 --round-trip-ms 1
+import argparse
+import datetime
+import random
+import time
+
+from availability import compute_availability_from_bookings, next_available_from_bookings, parse_working_hours
+
+
+def legacy_slots(bookings, duration_minutes, date, step_minutes=None):
+    # The original get_available_time_slots loop: every slot against every booking
+    step_minutes = step_minutes or duration_minutes
+    available_slots = []
+    start_of_day = datetime.datetime.combine(date, datetime.time(9, 0))
+    end_of_day = datetime.datetime.combine(date, datetime.time(17, 0))
+    current_time_slot = start_of_day
+    while current_time_slot + datetime.timedelta(minutes=duration_minutes) <= end_of_day:
+        is_booked = False
+        for start, end in bookings:
+            if not (current_time_slot >= end or current_time_slot + datetime.timedelta(minutes=duration_minutes) <= start):
+                is_booked = True
+                break
+        if not is_booked:
+            available_slots.append(current_time_slot.strftime("%H:%M"))
+        current_time_slot += datetime.timedelta(minutes=step_minutes)
+    return available_slots
+
+def generate_bookings(start_date, days, per_day, rng):
+    bookings = []
+    for d in range(days):
+        day = start_date + datetime.timedelta(days=d)
+        for _ in range(per_day):
+            minute = rng.randrange(9 * 60, 17 * 60 - 15, 5)
+            start = datetime.datetime.combine(day, datetime.time.min) + datetime.timedelta(minutes=minute)
+            bookings.append((start, start + datetime.timedelta(minutes=rng.choice((15, 30, 45, 60)))))
+    bookings.sort()
+    return bookings
+
+def generate_full_days(start_date, days):
+    # Back-to-back half-hour bookings through opening hours: nothing free
+    bookings = []
+    for d in range(days):
+        opens = datetime.datetime.combine(start_date + datetime.timedelta(days=d), datetime.time(9, 0))
+        bookings.extend((opens + datetime.timedelta(minutes=30 * i), opens + datetime.timedelta(minutes=30 * (i + 1))) for i in range(16))
+    return bookings
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bookings", type=int, default=300, help="bookings per day")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--duration", type=int, default=30)
+    parser.add_argument("--granularity", type=int, default=5)
+    parser.add_argument("--capacity", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--horizon", type=int, default=90, help="days the next-available search may look ahead")
+    parser.add_argument("--full-days", type=int, default=60, help="fully booked days before the first opening")
+    parser.add_argument("--next", type=int, default=10, help="open slots to find")
+    parser.add_argument("--round-trip-ms", type=float, default=1.0, help="simulated cost of one availability query")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    start_date = datetime.date(2025, 7, 21)
+    end_date = start_date + datetime.timedelta(days=args.days - 1)
+    bookings = generate_bookings(start_date, args.days, args.bookings, rng)
+    by_day = {}
+    for b in bookings:
+        by_day.setdefault(b[0].date(), []).append(b)
+    hours = parse_working_hours("09:00-17:00")
+
+    def run_legacy():
+        # Old code (one query + scan per day), stepping at the same granularity
+        return {day: legacy_slots(by_day.get(day, []), args.duration, day, args.granularity) for day in by_day}
+
+    def run_engine():
+        return compute_availability_from_bookings(
+            bookings, args.duration, start_date, end_date,
+            capacity=args.capacity, granularity_minutes=args.granularity,
+            working_hours=hours, working_days=range(7)
+        )
+
+    legacy_time, _ = timed(run_legacy, args.repeat)
+    engine_time, result = timed(run_engine, args.repeat)
+
+    # Sanity check: with capacity 1 both must agree
+    check = compute_availability_from_bookings(
+        bookings, args.duration, start_date, end_date, capacity=1,
+        granularity_minutes=args.granularity, working_hours=hours, working_days=range(7)
+    )
+    for day, slots in run_legacy().items():
+        assert slots == [s.strftime("%H:%M") for s in check[day]], f"mismatch on {day}"
+
+    candidates = args.days * ((8 * 60 - args.duration) // args.granularity + 1)
+    print(f"{args.days} days x {args.bookings} bookings/day, capacity {args.capacity}")
+    print(f"{candidates} candidate start times at {args.granularity}m granularity")
+    print(f"legacy scan (capacity 1): {legacy_time * 1000:8.2f} ms")
+    print(f"engine:                   {engine_time * 1000:8.2f} ms  ({legacy_time / engine_time:.1f}x)")
+    print(f"open slots found by engine: {sum(len(v) for v in result.values())}")
+
+    # Next available: the customer's date is full and so are the following weeks
+    search_start = start_date
+    horizon_end = search_start + datetime.timedelta(days=args.horizon - 1)
+    horizon_bookings = generate_full_days(search_start, args.full_days) + generate_bookings(
+        search_start + datetime.timedelta(days=args.full_days), args.horizon - args.full_days, args.bookings // 10, rng)
+    horizon_bookings.sort()
+    horizon_by_day = {}
+    for b in horizon_bookings:
+        horizon_by_day.setdefault(b[0].date(), []).append(b)
+
+    def run_day_by_day():
+        # What retrying date after date amounts to: one query and one day's scan per try
+        found = []
+        day = search_start
+        while len(found) < args.next and day <= horizon_end:
+            time.sleep(args.round_trip_ms / 1000.0)
+            slots = compute_availability_from_bookings(
+                horizon_by_day.get(day, []), args.duration, day, capacity=1,
+                granularity_minutes=args.granularity, working_hours=hours, working_days=range(7)
+            )[day]
+            found.extend(slots[:args.next - len(found)])
+            day += datetime.timedelta(days=1)
+        return found
+
+    def run_next_available():
+        time.sleep(args.round_trip_ms / 1000.0)
+        return next_available_from_bookings(
+            horizon_bookings, args.duration, search_start, horizon_end, args.next, capacity=1,
+            granularity_minutes=args.granularity, working_hours=hours, working_days=range(7)
+        )
+
+    retry_time, retry_result = timed(run_day_by_day, args.repeat)
+    search_time, search_result = timed(run_next_available, args.repeat)
+    assert retry_result == search_result, "next-available mismatch"
+
+    print(f"\nnext {args.next} slots over a {args.horizon}-day horizon, first {args.full_days} days full "
+          f"({len(horizon_bookings)} bookings, {args.round_trip_ms:g} ms per query)")
+    print(f"day-by-day retries (query/day): {retry_time * 1000:8.2f} ms")
+    print(f"single range search (1 query):  {search_time * 1000:8.2f} ms  ({retry_time / search_time:.1f}x)")
+    if search_result:
+        print(f"first open slot: {search_result[0]:%Y-%m-%d %H:%M}")
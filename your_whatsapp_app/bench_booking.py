@@ -0,0 +1,151 @@
+# bench_booking.py
+# Fires concurrent bookings at a handful of popular slots against the real
+# database and reports throughput, conflict rate, latency and double-bookings.
+#   python bench_booking.py --threads 32 --attempts 2000 --slots 5
+#   python bench_booking.py --legacy   # old check-then-insert path, for comparison
+# Uses an existing service and customer (first of each unless given) and
+# deletes the appointments it created when done.
+import argparse
+import datetime
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from database import get_db_connection, book_appointment
+
+
+def legacy_book_appointment(customer_id, service_id, start_time_str, duration_minutes, whatsapp_conversation_id):
+    # The previous implementation: SELECT COUNT(*) overlap check, then INSERT
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    appointment_id = str(uuid.uuid4())
+    try:
+        start_time = datetime.datetime.strptime(start_time_str, "%Y-%m-%d %H:%M")
+        end_time = start_time + datetime.timedelta(minutes=duration_minutes)
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM appointments
+            WHERE service_id = %s
+            AND ((start_time < %s AND end_time > %s) OR (start_time >= %s AND start_time < %s))
+            AND status IN ('pending', 'confirmed')
+            """,
+            (service_id, end_time, start_time, start_time, end_time)
+        )
+        if cursor.fetchone()[0] > 0:
+            return None
+        cursor.execute(
+            "INSERT INTO appointments (appointment_id, customer_id, service_id, start_time, end_time, status, whatsapp_conversation_id) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (appointment_id, customer_id, service_id, start_time, end_time, 'confirmed', whatsapp_conversation_id)
+        )
+        conn.commit()
+        return appointment_id
+    finally:
+        cursor.close()
+        conn.close()
+
+def first_id(query):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query)
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+        conn.close()
+
+def count_double_bookings(service_id, tag):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM appointments a JOIN appointments b
+              ON a.service_id = b.service_id AND a.appointment_id < b.appointment_id
+             AND a.start_time < b.end_time AND b.start_time < a.end_time
+            WHERE a.service_id = %s AND a.whatsapp_conversation_id = %s AND b.whatsapp_conversation_id = %s
+              AND a.status IN ('pending', 'confirmed') AND b.status IN ('pending', 'confirmed')
+            """,
+            (service_id, tag, tag)
+        )
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+        conn.close()
+
+def cleanup(tag):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # appointment_slots rows go with them (ON DELETE CASCADE)
+        cursor.execute("DELETE FROM appointments WHERE whatsapp_conversation_id = %s", (tag,))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(pct * len(sorted_values)))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--attempts", type=int, default=2000)
+    parser.add_argument("--slots", type=int, default=5, help="number of popular start times to fight over")
+    parser.add_argument("--duration", type=int, default=60)
+    parser.add_argument("--service-id")
+    parser.add_argument("--customer-id")
+    parser.add_argument("--days-ahead", type=int, default=400, help="book far in the future to stay clear of real data")
+    parser.add_argument("--legacy", action="store_true")
+    args = parser.parse_args()
+
+    service_id = args.service_id or first_id("SELECT service_id FROM services ORDER BY service_id LIMIT 1")
+    customer_id = args.customer_id or first_id("SELECT customer_id FROM customers ORDER BY customer_id LIMIT 1")
+    if not service_id or not customer_id:
+        raise SystemExit("Need at least one service and one customer in the database")
+
+    day = datetime.date.today() + datetime.timedelta(days=args.days_ahead)
+    # Overlapping popular times: every 30 minutes, so neighbours collide too
+    starts = [
+        (datetime.datetime.combine(day, datetime.time(10, 0)) + datetime.timedelta(minutes=30 * i)).strftime("%Y-%m-%d %H:%M")
+        for i in range(args.slots)
+    ]
+    tag = f"bench-{uuid.uuid4().hex[:12]}"
+    book = legacy_book_appointment if args.legacy else book_appointment
+
+    latencies = []
+    outcomes = {'booked': 0, 'conflict': 0}
+    lock = threading.Lock()
+
+    def attempt(i):
+        started = time.perf_counter()
+        appointment_id = book(customer_id, service_id, starts[i % len(starts)], args.duration, tag)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            outcomes['booked' if appointment_id else 'conflict'] += 1
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            list(executor.map(attempt, range(args.attempts)))
+        wall = time.perf_counter() - started
+        double_bookings = count_double_bookings(service_id, tag)
+    finally:
+        cleanup(tag)
+
+    latencies.sort()
+    print(f"path: {'legacy check-then-insert' if args.legacy else 'slot reservations'}")
+    print(f"{args.attempts} attempts on {args.slots} slots with {args.threads} threads in {wall:.2f}s")
+    print(f"throughput:      {args.attempts / wall:8.1f} bookings attempted/s")
+    print(f"booked:          {outcomes['booked']}")
+    print(f"conflict rate:   {outcomes['conflict'] / args.attempts:8.1%}")
+    print(f"latency p50:     {percentile(latencies, 0.50) * 1000:8.2f} ms")
+    print(f"latency p99:     {percentile(latencies, 0.99) * 1000:8.2f} ms")
+    print(f"double bookings: {double_bookings}")
+    print(f"pool: {database.get_pool_stats()}")
@@ -0,0 +1,105 @@
+# bench_payload_store.py
+# Replays a sample of webhook traffic through the messages_log writer and
+# compares the storage and write volume of the old scheme (the full JSON body
+# in raw_json_payload on every row) with the payload store (a 32-byte hash per
+# row, each distinct body compressed once in webhook_payloads). Uses the fake
+# database, then reads a sample of rows back through the streaming reader.
+#   python bench_payload_store.py --users 500 --redelivery-rate 0.05 --batched-rate 0.2
+import argparse
+import datetime
+import json
+import random
+import time
+
+from bench_webhook_replay import conversation, webhook, wamid
+
+HASH_BYTES = 32
+
+
+def replay_sample(users, redelivery_rate, batched_rate, rng):
+    # (message_id, direction, payload) rows as the webhook handler and
+    # post_message would log them: one row per inbound message carrying the
+    # whole webhook body, and one per outbound send carrying the API response.
+    # Some webhooks are delivered again (WhatsApp retries on a slow 200) and
+    # some carry several messages, as WhatsApp batches them under load.
+    services = [{'service_id': 'svc-haircut', 'name': 'Haircut'}, {'service_id': 'svc-colour', 'name': 'Colour'}]
+    booking_date = datetime.date.today() + datetime.timedelta(days=7)
+    rows = []
+    for n in range(users):
+        number = f"2771{n:07d}"
+        for _, payload in conversation(number, rng.choice(services), booking_date, rng):
+            value = payload["entry"][0]["changes"][0]["value"]
+            if rng.random() < batched_rate:
+                extra = dict(value["messages"][0], id=wamid())
+                payload = webhook(messages=value["messages"] + [extra], contacts=value["contacts"])
+                value = payload["entry"][0]["changes"][0]["value"]
+            deliveries = 2 if rng.random() < redelivery_rate else 1
+            for _ in range(deliveries):
+                # A redelivery is parsed again: equal content, a different object
+                body = json.loads(json.dumps(payload))
+                for message in body["entry"][0]["changes"][0]["value"]["messages"]:
+                    rows.append((message["id"], 'inbound', body))
+            response = {"messaging_product": "whatsapp", "contacts": [{"input": number, "wa_id": number}],
+                        "messages": [{"id": wamid()}]}
+            rows.append((response["messages"][0]["id"], 'outbound', response))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payload store storage / write volume benchmark")
+    parser.add_argument("--users", type=int, default=500, help="customers each running a booking conversation")
+    parser.add_argument("--redelivery-rate", type=float, default=0.05, help="share of webhooks delivered twice")
+    parser.add_argument("--batched-rate", type=float, default=0.2, help="share of webhooks carrying two messages")
+    parser.add_argument("--batch-size", type=int, default=200, help="rows per log writer flush")
+    parser.add_argument("--verify", type=int, default=200, help="rows read back and compared")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    import fake_mysql
+    import database
+    from payload_store import canonical_json, load_payload
+    fake_db = fake_mysql.install(fake_mysql.FakeDatabase())
+
+    rng = random.Random(args.seed)
+    sample = replay_sample(args.users, args.redelivery_rate, args.batched_rate, rng)
+
+    # Old scheme: json.dumps of the payload on every row
+    old_bytes = sum(len(json.dumps(payload).encode("utf-8")) for _, _, payload in sample)
+
+    now = datetime.datetime.now()
+    log_rows = [
+        (f"log-{i:08d}", message_id, direction, None, now + datetime.timedelta(microseconds=i), "{}", payload)
+        for i, (message_id, direction, payload) in enumerate(sample)
+    ]
+    started = time.perf_counter()
+    for i in range(0, len(log_rows), args.batch_size):
+        database.insert_message_logs(log_rows[i:i + args.batch_size])
+    elapsed = time.perf_counter() - started
+
+    stats = database.get_payload_store_stats()
+    stored_bytes = sum(row[2] for row in fake_db.webhook_payloads.values())
+    new_bytes = HASH_BYTES * len(log_rows) + stored_bytes + HASH_BYTES * len(fake_db.webhook_payloads)
+    # Write volume: the hash on every log row plus the payload rows actually sent
+    written_bytes = HASH_BYTES * len(log_rows) + stats['stored_bytes'] + HASH_BYTES * stats['stored']
+
+    print(f"{len(sample)} log rows ({args.users} conversations), written in {elapsed:.2f}s")
+    print(f"distinct payloads: {len(fake_db.webhook_payloads)}, "
+          f"repeats resolved in batch {stats['payloads'] - stats['unique_in_batch']}, "
+          f"compression {stats['compression_ratio']:.2f}x")
+    print(f"\n  {'':28} {'old':>12} {'payload store':>14} {'saving':>8}")
+    for label, old, new in (("payload storage (bytes)", old_bytes, new_bytes),
+                            ("payload bytes written", old_bytes, written_bytes)):
+        print(f"  {label:28} {old:12d} {new:14d} {1 - new / old:8.1%}")
+    statements = {k: v for k, v in fake_db.calls.items() if k.startswith("INSERT")}
+    print(f"\n  statements: {statements}")
+
+    checked = 0
+    for row, stored in zip(log_rows[:args.verify], fake_db.messages_log[:args.verify]):
+        original = row[6]
+        assert load_payload(stored[6]) == json.loads(canonical_json(original)), f"payload of {row[0]} differs"
+        checked += 1
+    print(f"  {checked} rows read back through the streaming reader, all equal to the original JSON")
+
+
+if __name__ == '__main__':
+    main()
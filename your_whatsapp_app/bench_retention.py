@@ -0,0 +1,139 @@
+# bench_retention.py
+# Seeds the fake database with months of messages_log traffic (growing month
+# on month) and appointments with their slots and reminder checkpoints, runs
+# retention.py over it, and shows the hot tables shrinking to the retention
+# window while the archiver's peak memory stays flat however big the month
+# is (the peak includes the fake's own scan of the table per statement).
+# Then restores the oldest month and checks it matches what was there.
+#   python bench_retention.py --months 15 --messages-per-month 2000 --growth 0.5
+import argparse
+import datetime
+import random
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from bench_payload_store import replay_sample
+
+
+def seed(fake_db, months, messages_per_month, appointments_per_month, growth, rng):
+    # -> [(month, messages, appointments)]
+    import database
+    from booking import slot_starts
+    from retention import add_months, month_start
+    first = add_months(month_start(datetime.datetime.now()), -(months - 1))
+    services = list(fake_db.services.values())
+    seeded = []
+    for i in range(months):
+        month = add_months(first, i)
+        seconds = (add_months(month, 1) - month).total_seconds()
+        scale = 1 + growth * i
+        messages = int(messages_per_month * scale)
+        sample = replay_sample(messages // 10 + 1, 0.05, 0.2, rng)[:messages]
+        rows = []
+        for message_id, direction, payload in sorted(sample, key=lambda _: rng.random()):
+            timestamp = month + datetime.timedelta(seconds=rng.uniform(0, seconds))
+            rows.append((str(uuid.uuid4()), message_id, direction, None, timestamp, "{}", payload))
+            if direction == 'outbound' and rng.random() < 0.8:
+                fake_db.delivery_statuses[message_id] = ('read', 3, timestamp + datetime.timedelta(minutes=2))
+        for j in range(0, len(rows), 200):
+            database.insert_message_logs(rows[j:j + 200])
+
+        appointments = int(appointments_per_month * scale)
+        for _ in range(appointments):
+            service = rng.choice(services)
+            start = (month + datetime.timedelta(days=rng.randrange(int(seconds // 86400)), hours=9)
+                     + datetime.timedelta(minutes=15 * rng.randrange(32)))
+            end = start + datetime.timedelta(minutes=service['duration_minutes'])
+            appointment_id = str(uuid.uuid4())
+            status = rng.choice(('confirmed', 'confirmed', 'confirmed', 'cancelled'))
+            fake_db.appointments[appointment_id] = {
+                'appointment_id': appointment_id, 'customer_id': str(uuid.uuid4()), 'service_id': service['service_id'],
+                'start_time': start, 'end_time': end, 'status': status,
+                'whatsapp_conversation_id': None, 'confirmation_message_id': f"wamid.{uuid.uuid4().hex}",
+            }
+            if status == 'confirmed':
+                for slot in slot_starts(start, end):
+                    seat = 0
+                    while (service['service_id'], slot, seat) in fake_db.slots:
+                        seat += 1
+                    fake_db.slots[(service['service_id'], slot, seat)] = appointment_id
+                fake_db.reminder_sends[(f"reminder:{start:%Y-%m-%d}", appointment_id)] = {
+                    'status': 'sent', 'whatsapp_message_id': f"wamid.{uuid.uuid4().hex}", 'attempts': 1,
+                    'claimed_at': start - datetime.timedelta(days=1), 'finished_at': start - datetime.timedelta(days=1),
+                }
+        seeded.append((month, messages, appointments))
+    return seeded
+
+def snapshot(fake_db, month, end):
+    # What the month looks like in the hot tables, payloads decoded
+    from payload_store import load_payload
+    messages = {
+        row[0]: (row[:6], load_payload(row[6]), fake_db.delivery_statuses.get(row[1]) if row[2] == 'outbound' else None)
+        for row in fake_db.messages_log if month <= row[4] < end
+    }
+    appointments = {aid: dict(a) for aid, a in fake_db.appointments.items() if month <= a['start_time'] < end}
+    reminders = {key: dict(row) for key, row in fake_db.reminder_sends.items() if key[1] in appointments}
+    return messages, appointments, reminders
+
+def table_sizes(fake_db):
+    return {'messages_log': len(fake_db.messages_log), 'webhook_payloads': len(fake_db.webhook_payloads),
+            'appointments': len(fake_db.appointments), 'appointment_slots': len(fake_db.slots),
+            'reminder_sends': len(fake_db.reminder_sends)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retention archive / restore benchmark")
+    parser.add_argument("--months", type=int, default=15, help="months of history, ending with the current one")
+    parser.add_argument("--messages-per-month", type=int, default=2000)
+    parser.add_argument("--appointments-per-month", type=int, default=400)
+    parser.add_argument("--growth", type=float, default=0.5, help="each month is this much bigger than the first, cumulatively")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    import fake_mysql
+    import retention
+    fake_db = fake_mysql.install(fake_mysql.FakeDatabase())
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    seeded = seed(fake_db, args.months, args.messages_per_month, args.appointments_per_month, args.growth, rng)
+    print(f"seeded {args.months} months in {time.perf_counter() - started:.1f}s: {table_sizes(fake_db)}")
+
+    oldest = seeded[0][0]
+    original = snapshot(fake_db, oldest, retention.add_months(oldest, 1))
+    root = tempfile.mkdtemp(prefix="retention-bench-")
+
+    print(f"\n  {'table':13} {'month':7} {'rows':>7} {'archive KiB':>12} {'bytes/row':>10} {'seconds':>8} {'peak KiB':>9}")
+    started = time.perf_counter()
+    for table in retention.TABLES.values():
+        for month in retention.due_months(table):
+            tracemalloc.start()
+            stats = retention.archive_month(table, month, root, args.chunk_size, pause=0)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            size = stats.get('archive_bytes', 0)
+            print(f"  {table.name:13} {stats['month']:7} {stats['archived']:7d} {size / 1024:12.1f} "
+                  f"{size / max(stats['archived'], 1):10.1f} {stats['seconds']:8.2f} {peak / 1024:9.0f}")
+    print(f"archived in {time.perf_counter() - started:.1f}s")
+    print(f"\nhot tables after: {table_sizes(fake_db)}")
+    for name, report in retention.status(root).items():
+        print(f"  {name}: {report['rows']} rows from {report['oldest']:%Y-%m}, "
+              f"{len(report['archived'])} months archived, keeps {report['retention_months']} + current")
+
+    started = time.perf_counter()
+    for table in retention.TABLES.values():
+        if retention.archive_parts(table, oldest, root):
+            print(f"\nrestore {table.name} {oldest:%Y-%m}: {retention.restore_month(table, oldest, root, args.chunk_size)}")
+    restored = snapshot(fake_db, oldest, retention.add_months(oldest, 1))
+    for label, before, after in zip(("messages_log", "appointments", "reminder_sends"), original, restored):
+        assert before == after, f"restored {label} differ"
+        print(f"  {len(after)} {label} rows restored, equal to the originals")
+    print(f"restored in {time.perf_counter() - started:.2f}s; "
+          f"archive statements: { {k: v for k, v in fake_db.calls.items() if k.startswith('DELETE')} }")
+    print(f"archives left in {root}")
+
+
+if __name__ == '__main__':
+    main()
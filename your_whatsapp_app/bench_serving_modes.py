@@ -0,0 +1,187 @@
+# bench_serving_modes.py
+# Compares the Flask app (a thread per in-flight webhook) with the ASGI mode
+# (asgi_app.py, coroutines on one event loop) on the same booking
+# conversations, at rising numbers of conversations in flight. The database is
+# the in-process fake with a simulated round trip; the Graph API stub runs in
+# its own process so its CPU isn't counted. Requests are handed to each app
+# directly (Flask test client / ASGI callable), leaving the HTTP server out.
+#   python bench_serving_modes.py --concurrency 50,200,800 --db-latency-ms 2 --api-latency-ms 80
+# "per core" = conversations completed per CPU-second, i.e. how many
+# conversations one fully busy core would carry through each second.
+# "db conns" = connections the pools opened during the run (connecting costs
+# a few simulated round trips), so a pool that throws connections away shows.
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_webhook_replay import PHONE_NUMBER_ID, conversation, percentile
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_stub(latency_ms):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_graph_api.py"),
+         "--port", str(port), "--latency-ms", str(latency_ms)],
+        stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}/v19.0"
+
+def make_conversations(count, services, rng):
+    # Fresh numbers every run so conversation state and dedup never carry over
+    conversations = []
+    for _ in range(count):
+        number = f"2779{rng.randrange(10 ** 7):07d}"
+        booking_date = datetime.date.today() + datetime.timedelta(days=rng.randrange(1, 60))
+        conversations.append(conversation(number, rng.choice(services), booking_date, rng))
+    return conversations
+
+
+def run_sync(conversations, samples, errors):
+    import app as app_module
+    import outbound
+    lock = threading.Lock()
+    local = threading.local()
+
+    def run(steps):
+        if not hasattr(local, "client"):
+            local.client = app_module.app.test_client()
+        for _, payload in steps:
+            started = time.perf_counter()
+            response = local.client.post("/webhook", data=json.dumps(payload), content_type="application/json")
+            with lock:
+                samples.append(time.perf_counter() - started)
+                errors[0] += response.status_code >= 400
+
+    # One thread per conversation in flight, as a threaded server would need
+    with ThreadPoolExecutor(max_workers=len(conversations)) as executor:
+        list(executor.map(run, conversations))
+    outbound.shutdown_dispatcher() # waits for the confirmation batches
+
+async def asgi_post(app, body):
+    status = []
+    delivered = False
+
+    async def receive():
+        nonlocal delivered
+        if delivered:
+            await asyncio.Event().wait() # the client never disconnects
+        delivered = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    scope = {'type': 'http', 'method': 'POST', 'path': '/webhook', 'query_string': b'',
+             'headers': [(b'content-type', b'application/json')]}
+    await app(scope, receive, send)
+    return status[0]
+
+def run_async(conversations, samples, errors, fake_db, pool_size):
+    import asgi_app
+    import async_whatsapp_api
+    import fake_mysql
+
+    async def run(steps):
+        for _, payload in steps:
+            started = time.perf_counter()
+            status = await asgi_post(asgi_app.app, json.dumps(payload).encode("utf-8"))
+            samples.append(time.perf_counter() - started)
+            errors[0] += status >= 400
+
+    async def main():
+        fake_mysql.install_async(fake_db, pool_size) # the pool belongs to this event loop
+        await asyncio.gather(*(run(steps) for steps in conversations))
+        await asgi_app.drain_background_tasks()
+        await async_whatsapp_api.close_session()
+
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flask vs ASGI serving mode benchmark")
+    parser.add_argument("--concurrency", default="25,100,400", help="conversations in flight, comma separated")
+    parser.add_argument("--modes", default="sync,asgi")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="fake database round-trip time")
+    parser.add_argument("--api-latency-ms", type=float, default=80.0, help="stub Graph API response time")
+    parser.add_argument("--db-pool-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    stub, stub_url = start_stub(args.api_latency_ms)
+    # config.py reads the environment at import time, so set it up first
+    os.environ.update({
+        "WHATSAPP_API_URL": stub_url,
+        "WHATSAPP_PHONE_NUMBER_ID": PHONE_NUMBER_ID,
+        "WHATSAPP_ACCESS_TOKEN": "bench-token",
+        "WEBHOOK_MODE": "inline",
+        "GRAPH_API_RATE_LIMIT_PER_SECOND": "100000",
+        "GRAPH_API_POOL_SIZE": "1000",
+        "ASYNC_GRAPH_API_MAX_CONNECTIONS": "100",
+        "OUTBOUND_WORKERS": "32",
+        "STATE_STORE_BACKEND": "memory",
+        "LOG_OUTBOUND_MESSAGES": "false",
+        "LOG_LEVEL": "WARNING",
+    })
+    import fake_mysql
+    fake_db = fake_mysql.FakeDatabase(latency_ms=args.db_latency_ms)
+    fake_mysql.install(fake_db, args.db_pool_size)
+    services = list(fake_db.services.values())
+    import app # noqa: F401  (loads the catalog and shared state before timing)
+    if "asgi" in args.modes:
+        import asgi_app # noqa: F401
+
+    rng = random.Random(args.seed)
+    results = []
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            for mode in args.modes.split(","):
+                conversations = make_conversations(concurrency, services, rng)
+                samples, errors = [], [0]
+                threads_before = threading.active_count()
+                opened_before = fake_db.connections_opened
+                wall_started, cpu_started = time.perf_counter(), time.process_time()
+                if mode == "sync":
+                    run_sync(conversations, samples, errors)
+                else:
+                    run_async(conversations, samples, errors, fake_db, args.db_pool_size)
+                wall = time.perf_counter() - wall_started
+                cpu = time.process_time() - cpu_started
+                samples.sort()
+                results.append((mode, concurrency, wall, cpu, samples, errors[0], threads_before,
+                                fake_db.connections_opened - opened_before))
+                print(f"  {mode} x{concurrency}: {wall:.2f}s", flush=True)
+    finally:
+        stub.terminate()
+
+    print(f"\n{'mode':5} {'in flight':>9} {'wall s':>7} {'cpu s':>7} {'cores':>6} {'conv/s':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'errors':>6} {'per core':>9} {'db conns':>9}")
+    for mode, concurrency, wall, cpu, samples, errors, _, opened in results:
+        cores = cpu / wall if wall else 0.0
+        print(f"{mode:5} {concurrency:9d} {wall:7.2f} {cpu:7.2f} {cores:6.2f} {concurrency / wall:7.1f} "
+              f"{percentile(samples, .5) * 1000:8.1f} {percentile(samples, .95) * 1000:8.1f} {errors:6d} "
+              f"{concurrency / cpu if cpu else 0:9.0f} {opened:9d}")
+    print(f"\nappointments booked: {len(fake_db.appointments)}, database statements: {fake_db.total_calls()}")
+
+
+if __name__ == '__main__':
+    main()
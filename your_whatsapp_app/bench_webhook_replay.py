@@ -0,0 +1,242 @@
+# bench_webhook_replay.py
+# Replays realistic WhatsApp webhook traffic against /webhook and reports
+# latency per endpoint and per conversation step, throughput and how many
+# database statements / Graph API calls the traffic caused.
+#
+# By default the app runs in-process with a fake database (fake_mysql.py) and
+# a local Graph API stub (stub_graph_api.py), so nothing external is needed:
+#   python bench_webhook_replay.py --users 200 --concurrency 32 --status-storms 100
+#   python bench_webhook_replay.py --webhook-mode queued --db-latency-ms 2 --api-latency-ms 80
+# To hit a running deployment instead (only latencies are reported):
+#   python bench_webhook_replay.py --target http://127.0.0.1:5000
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BUSINESS_NUMBER = "15550001234"
+PHONE_NUMBER_ID = "100000000000001"
+
+
+# --- Payload generation ---
+def wamid():
+    return f"wamid.bench.{uuid.uuid4().hex}"
+
+def webhook(messages=(), statuses=(), contacts=()):
+    value = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": BUSINESS_NUMBER, "phone_number_id": PHONE_NUMBER_ID},
+    }
+    if contacts:
+        value["contacts"] = list(contacts)
+    if messages:
+        value["messages"] = list(messages)
+    if statuses:
+        value["statuses"] = list(statuses)
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "200000000000001", "changes": [{"field": "messages", "value": value}]}],
+    }
+
+def _message(from_number, message_type, body):
+    message = {"from": from_number, "id": wamid(), "timestamp": str(int(time.time())), "type": message_type}
+    message[message_type] = body
+    contact = {"profile": {"name": f"Bench {from_number[-4:]}"}, "wa_id": from_number}
+    return webhook(messages=[message], contacts=[contact])
+
+def text_message(from_number, text):
+    return _message(from_number, "text", {"body": text})
+
+def button_reply(from_number, button_id, title):
+    return _message(from_number, "interactive", {"type": "button_reply", "button_reply": {"id": button_id, "title": title}})
+
+def list_reply(from_number, row_id, title):
+    return _message(from_number, "interactive", {"type": "list_reply", "list_reply": {"id": row_id, "title": title}})
+
+def status_storm(recipients, size, rng, message_ids=None):
+    # One webhook carrying `size` sent/delivered/read callbacks, like WhatsApp
+    # batches them when a broadcast goes out. With `message_ids` (what the
+    # stub handed out so far) the callbacks refer to messages we really sent.
+    statuses = []
+    now = int(time.time())
+    for _ in range(size):
+        message_id = rng.choice(message_ids) if message_ids else wamid()
+        recipient = rng.choice(recipients)
+        for status in ("sent", "delivered", "read")[:rng.randint(1, 3)]:
+            statuses.append({
+                "id": message_id, "status": status, "timestamp": str(now), "recipient_id": recipient,
+                "conversation": {"id": uuid.uuid4().hex, "origin": {"type": "service"}},
+                "pricing": {"billable": True, "pricing_model": "CBP", "category": "service"},
+            })
+            if len(statuses) >= size:
+                break
+        if len(statuses) >= size:
+            break
+    return webhook(statuses=statuses)
+
+def conversation(from_number, service, booking_date, rng):
+    # (step, payload) for one customer booking an appointment end to end
+    slot = datetime.time(9 + rng.randrange(0, 8), rng.choice((0, 30)))
+    return [
+        ('greeting', text_message(from_number, "Hi")),
+        ('service_list', button_reply(from_number, "book_appointment", "Book Appointment")),
+        ('select_service', list_reply(from_number, service['service_id'], service['name'])),
+        ('date_entry', text_message(from_number, booking_date.strftime("%Y-%m-%d"))),
+        ('slot_selection', list_reply(from_number, f"book_slot_{booking_date:%Y-%m-%d} {slot:%H:%M}", f"{slot:%H:%M}")),
+    ]
+
+
+# --- Reporting ---
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(pct * len(sorted_values)))]
+
+def print_latency_table(title, samples):
+    print(f"\n{title}")
+    print(f"  {'':22} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for label in sorted(samples):
+        values = sorted(samples[label])
+        print(f"  {label:22} {len(values):7d} {percentile(values, .5) * 1000:9.2f} {percentile(values, .95) * 1000:9.2f}"
+              f" {percentile(values, .99) * 1000:9.2f} {values[-1] * 1000:9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook replay load test")
+    parser.add_argument("--users", type=int, default=100, help="customers each running a full booking conversation")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--status-storms", type=int, default=50, help="status-only webhooks to mix in")
+    parser.add_argument("--storm-size", type=int, default=20, help="statuses per storm webhook")
+    parser.add_argument("--verify-requests", type=int, default=20, help="GET /webhook verification calls")
+    parser.add_argument("--webhook-mode", choices=("inline", "queued"), default="inline")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="fake database round-trip time")
+    parser.add_argument("--api-latency-ms", type=float, default=50.0, help="stub Graph API response time")
+    parser.add_argument("--target", help="base URL of a running app; skips the in-process app and fakes")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fake_db = stub = None
+    verify_token = os.getenv("WHATSAPP_VERIFY_TOKEN", "bench-verify-token")
+
+    if args.target:
+        base_url = args.target.rstrip("/")
+        services = [{'service_id': 'svc-haircut', 'name': 'Haircut'}]
+    else:
+        from stub_graph_api import StubGraphAPI
+        stub = StubGraphAPI(latency_ms=args.api_latency_ms).start()
+        # config.py reads the environment at import time, so set it up first
+        os.environ.update({
+            "WHATSAPP_API_URL": stub.url,
+            "WHATSAPP_PHONE_NUMBER_ID": PHONE_NUMBER_ID,
+            "WHATSAPP_ACCESS_TOKEN": "bench-token",
+            "WHATSAPP_VERIFY_TOKEN": verify_token,
+            "WEBHOOK_MODE": args.webhook_mode,
+            "GRAPH_API_RATE_LIMIT_PER_SECOND": "100000",
+            "STATE_STORE_BACKEND": "memory",
+        })
+        import fake_mysql
+        fake_db = fake_mysql.install(fake_mysql.FakeDatabase(latency_ms=args.db_latency_ms))
+        services = list(fake_db.services.values())
+
+        import app as app_module
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.ERROR) # no access log per request
+        server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+    booking_date = datetime.date.today() + datetime.timedelta(days=7)
+    numbers = [f"2771{n:07d}" for n in rng.sample(range(10 ** 7), args.users)]
+    tasks = [('conversation', conversation(number, rng.choice(services), booking_date, rng)) for number in numbers]
+    # Storms are built when they run (see run()) so they can refer to messages already sent
+    tasks += [('storm', [('status_storm', None)]) for _ in range(args.status_storms)]
+    tasks += [('verify', None) for _ in range(args.verify_requests)]
+    rng.shuffle(tasks)
+
+    by_step = defaultdict(list)
+    by_endpoint = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def timed(endpoint, step, fn):
+        started = time.perf_counter()
+        try:
+            response = fn()
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            by_endpoint[endpoint].append(elapsed)
+            if step:
+                by_step[step].append(elapsed)
+            if not ok:
+                errors[step or endpoint] += 1
+
+    def run(task):
+        kind, steps = task
+        if kind == 'verify':
+            params = {"hub.mode": "subscribe", "hub.verify_token": verify_token, "hub.challenge": "12345"}
+            return timed("GET /webhook", None, lambda: session().get(f"{base_url}/webhook", params=params))
+        for step, payload in steps:
+            if payload is None:
+                with lock:
+                    payload = status_storm(numbers, args.storm_size, rng, list(stub.message_ids) if stub else None)
+            body = json.dumps(payload)
+            timed("POST /webhook", step, lambda: session().post(
+                f"{base_url}/webhook", data=body, headers={"Content-Type": "application/json"}))
+
+    db_calls_before = fake_db.total_calls() if fake_db else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run, tasks))
+    wall = time.perf_counter() - started
+
+    if fake_db:
+        # Let queued work and buffered log rows land before counting
+        import app as app_module
+        import database
+        app_module.drain_webhook_pool()
+        database.get_log_writer().flush()
+        database.get_delivery_status_tracker().flush()
+        drained = time.perf_counter() - started
+
+    total_requests = sum(len(v) for v in by_endpoint.values())
+    print(f"{total_requests} requests in {wall:.2f}s with concurrency {args.concurrency} "
+          f"({args.webhook_mode if not args.target else args.target})")
+    print(f"throughput: {total_requests / wall:.1f} requests/s")
+    if errors:
+        print(f"errors: {dict(errors)}")
+    print_latency_table("Latency per endpoint", by_endpoint)
+    print_latency_table("Latency per conversation step", by_step)
+
+    if fake_db:
+        print(f"\nall work finished after {drained:.2f}s")
+        print(f"\nDatabase: {fake_db.total_calls() - db_calls_before} statements, "
+              f"{fake_db.connections_opened} connections opened")
+        for statement, count in fake_db.calls.most_common():
+            print(f"  {statement:32} {count:7d}")
+        print(f"  appointments booked: {len(fake_db.appointments)}, messages_log rows: {len(fake_db.messages_log)}")
+        print(f"  delivery statuses: {database.get_delivery_status_stats()}")
+    if stub:
+        print(f"\nGraph API: {sum(stub.counts.values())} calls {stub.counts}")
+
+
+if __name__ == '__main__':
+    main()
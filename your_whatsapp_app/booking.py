@@ -0,0 +1,156 @@
+# booking.py
+# Slot reservations: every appointment claims one row per SLOT_GRANULARITY_MINUTES
+# slot it covers in appointment_slots, whose primary key is
+# (service_id, slot_start, seat). Two overlapping bookings collide on that key
+# inside their own transactions, so the database rejects the second one without
+# a table lock or a check-then-insert race. Services with capacity N get seats
+# 0..N-1 per slot. See migrations/002_appointment_slots.sql.
+import datetime
+import logging
+
+import mysql.connector
+
+from availability import capacity_for, slot_grid_origin
+from config import SLOT_GRANULARITY_MINUTES
+
+DUPLICATE_KEY = 1062
+DEADLOCK = 1213
+
+log = logging.getLogger(__name__)
+
+
+# Shared by the sync and async variants below
+INSERT_SLOT_SEAT = "INSERT INTO appointment_slots (service_id, slot_start, seat, appointment_id) VALUES (%s, %s, %s, %s)"
+RELEASE_SLOTS = "DELETE FROM appointment_slots WHERE appointment_id = %s"
+
+
+class SlotTaken(Exception):
+    pass
+
+
+def error_code(err):
+    # MySQL error number: mysql.connector errors carry .errno, PyMySQL's
+    # (under aiomysql) put it first in args
+    code = getattr(err, 'errno', None)
+    if code is None and err.args and isinstance(err.args[0], int):
+        code = err.args[0]
+    return code
+
+
+def slot_starts(start_time, end_time, granularity_minutes=SLOT_GRANULARITY_MINUTES, working_hours=None):
+    # Grid slots touched by [start_time, end_time). The grid is anchored at the
+    # day's opening time, like the availability engine's candidate starts, so
+    # an offered slot maps onto exactly the rows it checks. Partially covered
+    # slots count as taken, which errs on the safe side.
+    step = datetime.timedelta(minutes=granularity_minutes)
+    origin = slot_grid_origin(start_time.date(), working_hours)
+    slot = origin + step * ((start_time - origin) // step)
+    slots = []
+    while slot < end_time:
+        slots.append(slot)
+        slot += step
+    return slots
+
+def slot_range_query(appointment_id, service_id, slots):
+    # Seat 0 of every slot in one statement (capacity 1)
+    return (
+        "INSERT INTO appointment_slots (service_id, slot_start, seat, appointment_id) VALUES "
+        + ", ".join(["(%s, %s, 0, %s)"] * len(slots)),
+        [value for slot in slots for value in (service_id, slot, appointment_id)]
+    )
+
+def reserve_slots(cursor, appointment_id, service_id, start_time, end_time, capacity=None):
+    # Must run inside the transaction that inserts the appointment.
+    # Raises SlotTaken if any slot is already at capacity.
+    capacity = capacity if capacity is not None else capacity_for(service_id)
+    slots = slot_starts(start_time, end_time)
+    if capacity <= 1:
+        # One multi-row insert claims the whole range or fails on the first taken slot
+        try:
+            cursor.execute(*slot_range_query(appointment_id, service_id, slots))
+        except mysql.connector.Error as err:
+            if err.errno == DUPLICATE_KEY:
+                raise SlotTaken(f"{service_id} is booked at {start_time}")
+            raise
+        return
+
+    for slot in slots:
+        for seat in range(capacity):
+            try:
+                cursor.execute(INSERT_SLOT_SEAT, (service_id, slot, seat, appointment_id))
+                break
+            except mysql.connector.Error as err:
+                if err.errno != DUPLICATE_KEY:
+                    raise
+        else:
+            raise SlotTaken(f"{service_id} is fully booked at {slot}")
+
+async def reserve_slots_async(cursor, appointment_id, service_id, start_time, end_time, capacity=None):
+    # reserve_slots for an aiomysql cursor (async_database.py)
+    capacity = capacity if capacity is not None else capacity_for(service_id)
+    slots = slot_starts(start_time, end_time)
+    if capacity <= 1:
+        try:
+            await cursor.execute(*slot_range_query(appointment_id, service_id, slots))
+        except Exception as err:
+            if error_code(err) == DUPLICATE_KEY:
+                raise SlotTaken(f"{service_id} is booked at {start_time}")
+            raise
+        return
+
+    for slot in slots:
+        for seat in range(capacity):
+            try:
+                await cursor.execute(INSERT_SLOT_SEAT, (service_id, slot, seat, appointment_id))
+                break
+            except Exception as err:
+                if error_code(err) != DUPLICATE_KEY:
+                    raise
+        else:
+            raise SlotTaken(f"{service_id} is fully booked at {slot}")
+
+def release_slots(cursor, appointment_id):
+    cursor.execute(RELEASE_SLOTS, (appointment_id,))
+
+async def release_slots_async(cursor, appointment_id):
+    await cursor.execute(RELEASE_SLOTS, (appointment_id,))
+
+def backfill_slots():
+    # One-off after applying migration 002: reserve slots for upcoming active
+    # appointments that were booked before reservations existed. Also re-run
+    # it after changing WORKING_HOURS or SLOT_GRANULARITY_MINUTES, which move
+    # the grid.
+    from database import get_db_connection
+    reserved = conflicts = 0
+    with get_db_connection() as conn:
+        read_cursor = conn.cursor()
+        write_cursor = conn.cursor()
+        try:
+            read_cursor.execute(
+                """
+                SELECT appointment_id, service_id, start_time, end_time FROM appointments
+                WHERE end_time > NOW() AND status IN ('pending', 'confirmed')
+                ORDER BY start_time
+                """
+            )
+            for appointment_id, service_id, start_time, end_time in read_cursor.fetchall():
+                release_slots(write_cursor, appointment_id)
+                try:
+                    reserve_slots(write_cursor, appointment_id, service_id, start_time, end_time)
+                    reserved += 1
+                except SlotTaken:
+                    # Existing double-booking from before; leave it for staff to sort out
+                    conflicts += 1
+                    log.warning("Appointment %s overlaps an earlier booking, not reserved", appointment_id)
+            conn.commit()
+        finally:
+            read_cursor.close()
+            write_cursor.close()
+    log.info("Reserved slots for %d appointments, %d conflicts", reserved, conflicts)
+
+
+if __name__ == '__main__':
+    from structured_log import configure_logging
+    configure_logging()
+
+    backfill_slots()
@@ -0,0 +1,155 @@
+# config.py
+import os
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+# --- WhatsApp Cloud API ---
+WHATSAPP_API_URL = os.getenv("WHATSAPP_API_URL", "https://graph.facebook.com/v19.0")
+PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "")
+ACCESS_TOKEN = os.getenv("WHATSAPP_ACCESS_TOKEN", "")
+VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN", "")
+
+# --- MySQL ---
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_USER = os.getenv("DB_USER", "")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+DB_NAME = os.getenv("DB_NAME", "whatsapp_booking")
+
+# Connection pool shared by every helper in database.py
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "5"))
+DB_POOL_RECYCLE_SECONDS = float(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+# Connections idle for less than this are handed out without a ping
+DB_POOL_PING_AFTER_SECONDS = float(os.getenv("DB_POOL_PING_AFTER_SECONDS", "30"))
+
+# --- Webhook ingestion ---
+# "inline" processes messages inside the request, "queued" acks immediately and
+# hands each message to a worker pool (ordered per sender)
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "inline")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "500"))
+# How long a request may block waiting for queue space before we answer 503
+WEBHOOK_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT_SECONDS", "1"))
+WEBHOOK_DRAIN_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT_SECONDS", "30"))
+
+# --- Outbound Graph API calls ---
+GRAPH_API_POOL_SIZE = int(os.getenv("GRAPH_API_POOL_SIZE", "20"))
+GRAPH_API_TIMEOUT_SECONDS = float(os.getenv("GRAPH_API_TIMEOUT_SECONDS", "10"))
+GRAPH_API_MAX_RETRIES = int(os.getenv("GRAPH_API_MAX_RETRIES", "3"))
+GRAPH_API_BACKOFF_SECONDS = float(os.getenv("GRAPH_API_BACKOFF_SECONDS", "0.5"))
+# Messages per second allowed for our business phone number
+GRAPH_API_RATE_LIMIT_PER_SECOND = float(os.getenv("GRAPH_API_RATE_LIMIT_PER_SECOND", "80"))
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "1000"))
+# Log every message the Graph API accepts to messages_log (delivery statuses
+# are applied to those rows). Load tests against a stub switch it off.
+LOG_OUTBOUND_MESSAGES = os.getenv("LOG_OUTBOUND_MESSAGES", "true").lower() in ("1", "true", "yes")
+
+# --- ASGI mode (asgi_app.py: aiomysql + aiohttp instead of the thread-per-request stack) ---
+# Connections in the aiomysql pool; one event loop multiplexes every conversation over them
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "20"))
+# Concurrent Graph API connections of the aiohttp session
+ASYNC_GRAPH_API_MAX_CONNECTIONS = int(os.getenv("ASYNC_GRAPH_API_MAX_CONNECTIONS", "100"))
+
+# --- Availability ---
+SLOT_GRANULARITY_MINUTES = int(os.getenv("SLOT_GRANULARITY_MINUTES", "30"))
+# Opening hours as "HH:MM-HH:MM", applied on WORKING_DAYS (0 = Monday)
+WORKING_HOURS = os.getenv("WORKING_HOURS", "09:00-17:00")
+WORKING_DAYS = [int(d) for d in os.getenv("WORKING_DAYS", "0,1,2,3,4,5,6").split(",") if d.strip()]
+# How many appointments of one service may overlap, e.g. "svc-1:2,svc-2:3"
+DEFAULT_SERVICE_CAPACITY = int(os.getenv("DEFAULT_SERVICE_CAPACITY", "1"))
+SERVICE_CAPACITY = {
+    k.strip(): int(v) for k, v in
+    (item.split(":", 1) for item in os.getenv("SERVICE_CAPACITY", "").split(",") if ":" in item)
+}
+# Upper bound on any appointment's length; lets overlap queries use a plain start_time range
+MAX_APPOINTMENT_MINUTES = int(os.getenv("MAX_APPOINTMENT_MINUTES", "480"))
+# How far ahead "next available" looks when the requested date is full
+NEXT_AVAILABLE_HORIZON_DAYS = int(os.getenv("NEXT_AVAILABLE_HORIZON_DAYS", "60"))
+
+# --- Availability cache ---
+AVAILABILITY_CACHE_MAX_ENTRIES = int(os.getenv("AVAILABILITY_CACHE_MAX_ENTRIES", "2000"))
+AVAILABILITY_CACHE_TTL_SECONDS = float(os.getenv("AVAILABILITY_CACHE_TTL_SECONDS", "60"))
+# "local" only invalidates this process; "redis" broadcasts to every app process
+AVAILABILITY_INVALIDATION_BACKEND = os.getenv("AVAILABILITY_INVALIDATION_BACKEND", "local")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# --- Service catalog ---
+SERVICE_CATALOG_TTL_SECONDS = float(os.getenv("SERVICE_CATALOG_TTL_SECONDS", "300"))
+
+# --- Customer lookup cache (phone number -> customer_id) ---
+CUSTOMER_CACHE_MAX_ENTRIES = int(os.getenv("CUSTOMER_CACHE_MAX_ENTRIES", "10000"))
+CUSTOMER_CACHE_TTL_SECONDS = float(os.getenv("CUSTOMER_CACHE_TTL_SECONDS", "3600"))
+
+# --- messages_log writer ---
+# When disabled, log_message() inserts synchronously like it used to
+LOG_WRITER_ENABLED = os.getenv("LOG_WRITER_ENABLED", "true").lower() in ("1", "true", "yes")
+LOG_WRITER_BATCH_SIZE = int(os.getenv("LOG_WRITER_BATCH_SIZE", "200"))
+LOG_WRITER_FLUSH_INTERVAL_SECONDS = float(os.getenv("LOG_WRITER_FLUSH_INTERVAL_SECONDS", "0.5"))
+LOG_WRITER_MAX_QUEUE = int(os.getenv("LOG_WRITER_MAX_QUEUE", "20000"))
+# drop_oldest | drop_newest | block
+LOG_WRITER_OVERFLOW_POLICY = os.getenv("LOG_WRITER_OVERFLOW_POLICY", "drop_oldest")
+
+# --- Webhook payload store (raw bodies kept once per content hash, see payload_store.py) ---
+PAYLOAD_STORE_COMPRESSION_LEVEL = int(os.getenv("PAYLOAD_STORE_COMPRESSION_LEVEL", "6"))
+
+# --- Retention (retention.py: old months archived to gzipped JSON lines, then deleted) ---
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR", "data/archive")
+# Whole calendar months kept in the hot tables besides the current one
+RETENTION_MESSAGES_LOG_MONTHS = int(os.getenv("RETENTION_MESSAGES_LOG_MONTHS", "3"))
+RETENTION_APPOINTMENTS_MONTHS = int(os.getenv("RETENTION_APPOINTMENTS_MONTHS", "12"))
+# Rows per read / delete / restore statement, each in its own short transaction
+RETENTION_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", "1000"))
+# Pause between delete chunks, so a purge doesn't crowd out the app's writes
+RETENTION_CHUNK_PAUSE_SECONDS = float(os.getenv("RETENTION_CHUNK_PAUSE_SECONDS", "0.05"))
+
+# --- Delivery status tracking (sent/delivered/read/failed on outbound messages_log rows) ---
+# Statuses for the same message within one window collapse into a single update
+DELIVERY_STATUS_FLUSH_INTERVAL_SECONDS = float(os.getenv("DELIVERY_STATUS_FLUSH_INTERVAL_SECONDS", "1.0"))
+DELIVERY_STATUS_MAX_PENDING = int(os.getenv("DELIVERY_STATUS_MAX_PENDING", "50000"))
+# Windows a status waits for its outbound row to be written before it is dropped
+DELIVERY_STATUS_MAX_ATTEMPTS = int(os.getenv("DELIVERY_STATUS_MAX_ATTEMPTS", "5"))
+
+# --- Conversation state ---
+# "memory" is per process; "sqlite" is shared by all worker processes on the host
+STATE_STORE_BACKEND = os.getenv("STATE_STORE_BACKEND", "memory")
+STATE_STORE_PATH = os.getenv("STATE_STORE_PATH", "data/conversation_states.sqlite3")
+STATE_STORE_TTL_SECONDS = float(os.getenv("STATE_STORE_TTL_SECONDS", "1800"))
+STATE_STORE_MAX_ENTRIES = int(os.getenv("STATE_STORE_MAX_ENTRIES", "50000"))
+
+# --- Webhook deduplication ---
+# "memory" is per process; "redis" also catches redeliveries to other processes
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "memory")
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "3600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+
+# --- Metrics / profiling ---
+# Required (as ?token=) to switch the sampling profiler on /debug/profiler; empty disables the route
+METRICS_ADMIN_TOKEN = os.getenv("METRICS_ADMIN_TOKEN", "")
+PROFILER_INTERVAL_SECONDS = float(os.getenv("PROFILER_INTERVAL_SECONDS", "0.01"))
+
+# --- Logging ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Per-logger overrides, e.g. "database=DEBUG,werkzeug=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "werkzeug=WARNING")
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Records waiting for the background writer; beyond this they are dropped, never blocking a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of high-volume events kept, e.g. "status_update=0.05,webhook_received=0.1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "status_update=0.05")
+LOG_REDACT_PHONE_NUMBERS = os.getenv("LOG_REDACT_PHONE_NUMBERS", "true").lower() in ("1", "true", "yes")
+
+# --- Reminder campaigns (reminders.py) ---
+REMINDER_TEMPLATE_NAME = os.getenv("REMINDER_TEMPLATE_NAME", "appointment_reminder")
+REMINDER_TEMPLATE_LANGUAGE = os.getenv("REMINDER_TEMPLATE_LANGUAGE", "en_US")
+# Share of the phone number's send rate the campaign may use; keep headroom for live conversations
+REMINDER_RATE_PER_SECOND = float(os.getenv("REMINDER_RATE_PER_SECOND", "40"))
+REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", "16"))
+# Sends submitted but not yet answered; bounds memory whatever the campaign size
+REMINDER_MAX_IN_FLIGHT = int(os.getenv("REMINDER_MAX_IN_FLIGHT", "200"))
+REMINDER_PAGE_SIZE = int(os.getenv("REMINDER_PAGE_SIZE", "500"))
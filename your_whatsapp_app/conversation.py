@@ -0,0 +1,517 @@
+# conversation.py
+# The booking conversation, written once for both serving modes. The flow
+# (text, button and list handling, booking, view / cancel / reschedule) is a
+# set of coroutines over a ConversationBackend holding the storage and Graph
+# API calls it makes:
+#   app.py      - database.py / whatsapp_api.py functions wrapped with
+#                 blocking() and driven with run_sync() on the request or
+#                 webhook worker thread; nothing ever suspends
+#   asgi_app.py - async_database.py / async_whatsapp_api.py, awaited on the
+#                 event loop
+# Everything both modes share lives here too: conversation states, webhook
+# deduplication, event parsing and the message builders. These are called
+# directly, not through the backend, so in the ASGI mode they run on the
+# event loop. With the default in-process backends they only touch memory,
+# but some settings make them do synchronous I/O (see
+# asgi_app.loop_blocking_settings):
+#   DEDUP_BACKEND=redis                     - a redis round trip per event
+#   STATE_STORE_BACKEND=sqlite              - file I/O per state read / write
+#   AVAILABILITY_INVALIDATION_BACKEND=redis - a redis publish per booking,
+#                                             cancellation or reschedule
+# The service catalog also loads synchronously on its first use if loading
+# it at startup failed.
+import datetime
+import functools
+import json
+import logging
+
+from config import LOG_OUTBOUND_MESSAGES
+from database import (
+    log_message, log_outbound_message, record_delivery_status, get_customer_cache_stats, get_log_writer_stats,
+    get_payload_store_stats, get_delivery_status_stats
+)
+from availability_cache import get_availability_cache
+from dedup import create_deduplicator
+from service_catalog import get_service_catalog
+from state_store import create_state_store
+from whatsapp_api import on_message_sent, get_send_stats
+from structured_log import get_logging_stats
+import metrics
+from metrics import timed, set_step
+
+log = logging.getLogger(__name__)
+
+WHATSAPP_LIST_MAX_ROWS = 10
+WHATSAPP_LIST_TITLE_MAX = 24
+WHATSAPP_LIST_DESCRIPTION_MAX = 72
+
+conversation_states = create_state_store() # see state_store.py; memory or shared SQLite backend
+deduplicator = create_deduplicator()
+
+if LOG_OUTBOUND_MESSAGES:
+    # Every accepted message gets its messages_log row; delivery statuses land on it
+    on_message_sent(log_outbound_message)
+
+
+def _prefixed(prefix, stats):
+    return {f"{prefix}_{key}": value for key, value in stats.items()}
+
+@metrics.register_collector
+def collect_shared_stats():
+    values = {}
+    values.update(_prefixed("customer_cache", get_customer_cache_stats()))
+    values.update(_prefixed("availability_cache", get_availability_cache().stats()))
+    values.update(_prefixed("messages_log_writer", get_log_writer_stats()))
+    values.update(_prefixed("payload_store", get_payload_store_stats()))
+    values.update(_prefixed("delivery_status", get_delivery_status_stats()))
+    values.update(_prefixed("webhook_dedup", deduplicator.stats()))
+    values.update(_prefixed("conversation_states", conversation_states.stats()))
+    values.update(_prefixed("graph_api", get_send_stats()))
+    values.update(_prefixed("logging", get_logging_stats()))
+    return values
+
+
+# --- Backends ---
+class ConversationBackend:
+    # The storage and Graph API calls the flow makes, each a coroutine
+    # function, passed by keyword. send_confirmation(to_number, appointment_id,
+    # messages) sends the booking confirmation batch after the webhook is
+    # answered and stores the confirmation message id.
+    CALLS = (
+        'resolve_customer', 'resolve_customers', 'get_available_time_slots', 'find_next_available_slots',
+        'book_appointment', 'get_customer_appointments', 'get_customer_appointment', 'update_appointment_status',
+        'send_whatsapp_message', 'send_confirmation',
+    )
+
+    def __init__(self, **calls):
+        missing = [name for name in self.CALLS if name not in calls]
+        unknown = [name for name in calls if name not in self.CALLS]
+        if missing or unknown:
+            raise TypeError(f"ConversationBackend missing {missing}, unknown {unknown}")
+        for name, call in calls.items():
+            setattr(self, name, call)
+
+def blocking(fn):
+    # A plain function as a coroutine function that returns without ever
+    # suspending, so run_sync can drive the flow on a thread
+    @functools.wraps(fn)
+    async def call(*args, **kwargs):
+        return fn(*args, **kwargs)
+    return call
+
+def run_sync(coro):
+    # Runs a flow coroutine over a blocking() backend to completion on the
+    # calling thread, without an event loop
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    coro.close()
+    raise RuntimeError("Conversation flow suspended; run_sync needs a backend made with blocking()")
+
+
+# --- Webhook events ---
+def iter_webhook_events(data):
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            if change.get('field') == 'messages':
+                value = change.get('value', {})
+                for message in value.get('messages', []):
+                    yield 'message', message
+                for status in value.get('statuses', []):
+                    yield 'status', status
+
+def default_customer_name(from_number):
+    return f"User_{from_number[-4:]}" # Generic name for now
+
+def new_webhook_events(data):
+    # WhatsApp redelivers webhooks we were slow to acknowledge; drop what we've seen
+    return [(kind, event) for kind, event in iter_webhook_events(data) if deduplicator.first_delivery(kind, event)]
+
+@timed("handler")
+def process_status(status, data):
+    set_step('status_update')
+    # Handle message status updates (e.g., delivered, read)
+    log.info("Message status update", extra={
+        'event': 'status_update', 'status': status.get('status'),
+        'message_id': status.get('id'), 'recipient_id': status.get('recipient_id'),
+    })
+    if status.get('status') == 'failed':
+        log.warning("Message %s failed: %s", status.get('id'), status.get('errors'))
+    # Coalesced into the delivery_status column of the outbound messages_log row
+    # (see delivery_status.py) instead of a new row per callback
+    record_delivery_status(status.get('id'), status.get('status'), datetime.datetime.fromtimestamp(int(status.get('timestamp'))))
+
+
+# --- Conversation flow ---
+class ConversationFlow:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def process_webhook(self, data):
+        events = new_webhook_events(data)
+        senders = {event.get('from') for kind, event in events if kind == 'message'}
+        if len(senders) > 1:
+            # Resolve every sender in one round trip; process_message then hits the cache
+            await self.backend.resolve_customers([(number, default_customer_name(number)) for number in senders])
+        for i, (kind, event) in enumerate(events):
+            try:
+                if kind == 'message':
+                    await self.process_message(event, data)
+                else:
+                    # Only buffers the status in memory, nothing to await
+                    process_status(event, data)
+            except Exception:
+                # The webhook is answered with an error and WhatsApp retries; don't drop the retry as a duplicate
+                for unprocessed in events[i:]:
+                    deduplicator.forget(*unprocessed)
+                raise
+
+    @timed("handler")
+    async def process_message(self, message, data):
+        set_step(None) # until the handler has looked at the conversation state
+        from_number = message.get('from')
+        message_type = message.get('type')
+        message_id = message.get('id')
+        timestamp = datetime.datetime.fromtimestamp(int(message.get('timestamp')))
+
+        # Looks the number up (from cache when we can) and adds new customers automatically.
+        # You might want to ask for their name here via WhatsApp first
+        customer_id = await self.backend.resolve_customer(from_number, default_customer_name(from_number))
+
+        # Log the incoming message
+        log_message(message_id, 'inbound', customer_id, timestamp, json.dumps(message), data)
+
+        if message_type == 'text':
+            text_body = message['text']['body'].lower()
+            await self.handle_text_message(from_number, customer_id, text_body)
+        elif message_type == 'interactive':
+            # Handle interactive replies (e.g., button clicks, list selections)
+            interactive_data = message['interactive']
+            await self.handle_interactive_message(from_number, customer_id, interactive_data)
+        else:
+            await self.send(from_number, "I can only process text messages and interactive selections for now. How can I help you book an appointment?")
+
+    @timed("handler")
+    async def handle_text_message(self, from_number, customer_id, text_body):
+        current_state = conversation_states.get(from_number, {'step': 'start'})
+        set_step(current_state['step'])
+
+        if "hello" in text_body or "hi" in text_body or "start" in text_body:
+            await self.send(from_number, "Hello! Welcome to our appointment booking service. How can I help you?")
+            # Offer options like "Book Appointment", "View My Appointments", "Services"
+            # Using interactive buttons is much better here
+            await self.send_main_menu(from_number)
+            conversation_states.set(from_number, {'step': 'main_menu'})
+        elif current_state['step'] == 'select_service_text_input':
+            # User is typing service name (less ideal than interactive lists)
+            matched_service = get_service_catalog().find_by_name(text_body)
+            if matched_service:
+                conversation_states.set(from_number, {
+                    'step': 'select_date',
+                    'service_id': matched_service['service_id'],
+                    'service_name': matched_service['name'],
+                    'duration': matched_service['duration_minutes']
+                })
+                await self.send(from_number, f"Great! You selected {matched_service['name']}. Please provide the date you'd like to book (YYYY-MM-DD):")
+            else:
+                await self.send(from_number, "Sorry, I couldn't find that service. Please try again or type 'services' to see the list.")
+        elif current_state['step'] == 'select_date':
+            try:
+                selected_date = datetime.datetime.strptime(text_body, "%Y-%m-%d").date()
+                if selected_date < datetime.date.today():
+                    await self.send(from_number, "You cannot book an appointment in the past. Please provide a future date (YYYY-MM-DD):")
+                    return
+
+                # Fetch and display available time slots
+                service_duration = current_state['duration']
+                available_slots = await self.backend.get_available_time_slots(
+                    service_duration, selected_date.strftime("%Y-%m-%d"), current_state['service_id'])
+
+                if available_slots:
+                    await self.send(from_number, f"Available slots for {current_state['service_name']} on {selected_date.strftime('%Y-%m-%d')}:")
+                    # WhatsApp lists hold at most 10 rows
+                    slot_options = [{"id": f"book_slot_{selected_date.strftime('%Y-%m-%d')} {slot}", "title": slot} for slot in available_slots[:WHATSAPP_LIST_MAX_ROWS]]
+                    await self.send_list(from_number, "Choose a time slot:", "Available Times", slot_options)
+
+                    current_state['step'] = 'select_time'
+                    current_state['selected_date'] = selected_date.strftime("%Y-%m-%d")
+                    conversation_states.set(from_number, current_state)
+                else:
+                    # Offer the earliest openings after that date instead of making them guess again
+                    next_slots = await self.backend.find_next_available_slots(
+                        current_state['service_id'], service_duration, selected_date + datetime.timedelta(days=1), WHATSAPP_LIST_MAX_ROWS)
+                    if next_slots:
+                        await self.send(from_number, f"{current_state['service_name']} is fully booked on {selected_date.strftime('%Y-%m-%d')}. These are the next available times:")
+                        slot_options = [{"id": f"book_slot_{slot.strftime('%Y-%m-%d %H:%M')}", "title": slot.strftime("%a %d %b %H:%M")} for slot in next_slots]
+                        await self.send_list(from_number, "Choose a time slot:", "Next Available", slot_options)
+                        current_state['step'] = 'select_time'
+                        conversation_states.set(from_number, current_state)
+                    else:
+                        await self.send(from_number, "No slots available for that date. Please try another date or type 'cancel' to start over.")
+            except ValueError:
+                await self.send(from_number, "Invalid date format. Please use YYYY-MM-DD.")
+        elif "cancel" in text_body:
+            await self.send(from_number, "Okay, booking cancelled. How else can I help you?")
+            conversation_states.delete(from_number) # Clear state
+            await self.send_main_menu(from_number) # Go back to main menu
+        else:
+            await self.send(from_number, "I'm not sure how to respond to that. Please type 'hi' to start over or 'cancel' to stop.")
+            await self.send_main_menu(from_number)
+            conversation_states.delete(from_number) # Clear state if unknown input
+
+    @timed("handler")
+    async def handle_interactive_message(self, from_number, customer_id, interactive_data):
+        current_state = conversation_states.get(from_number, {'step': 'start'})
+        set_step(current_state['step'])
+        message_type = interactive_data.get('type')
+
+        # The Cloud API sends 'button_reply'/'list_reply'; older payloads used 'button'/'list'
+        if message_type in ('button', 'button_reply'):
+            button_id = interactive_data['button_reply']['id']
+            await self.handle_button_click(from_number, customer_id, button_id, current_state)
+        elif message_type in ('list', 'list_reply'):
+            list_id = interactive_data['list_reply']['id']
+            await self.handle_list_selection(from_number, customer_id, list_id, current_state)
+
+    @timed("handler")
+    async def handle_button_click(self, from_number, customer_id, button_id, current_state):
+        if button_id == 'book_appointment':
+            services = get_service_catalog().all()
+            if services:
+                # Prepare interactive list message for services
+                service_options = [{"id": s['service_id'], "title": s['name']} for s in services]
+                await self.send_list(from_number, "Please select a service:", "Our Services", service_options)
+                conversation_states.set(from_number, {'step': 'select_service'})
+            else:
+                await self.send(from_number, "Sorry, no services are currently available.")
+        elif button_id == 'view_appointments':
+            await self.send_appointments_page(from_number, customer_id)
+        elif button_id.startswith('cancel_appt_'):
+            await self.cancel_customer_appointment(from_number, customer_id, button_id.replace('cancel_appt_', '', 1))
+        elif button_id.startswith('reschedule_appt_'):
+            await self.start_reschedule(from_number, customer_id, button_id.replace('reschedule_appt_', '', 1))
+        elif button_id == 'main_menu':
+            await self.send_main_menu(from_number)
+            conversation_states.delete(from_number)
+        elif button_id == 'get_help':
+            await self.send(from_number, "Please type your question or call us at [Your Phone Number].")
+            await self.send_main_menu(from_number)
+            conversation_states.delete(from_number)
+
+    @timed("handler")
+    async def handle_list_selection(self, from_number, customer_id, list_id, current_state):
+        if current_state['step'] == 'select_service':
+            service_id = list_id
+            service = get_service_catalog().get(service_id)
+            if service:
+                conversation_states.set(from_number, {
+                    'step': 'select_date',
+                    'service_id': service['service_id'],
+                    'service_name': service['name'],
+                    'duration': service['duration_minutes']
+                })
+                await self.send(from_number, f"You've selected {service['name']}. Now, please enter the desired date for your appointment in YYYY-MM-DD format (e.g., 2025-07-20).")
+            else:
+                await self.send(from_number, "Invalid service selected. Please try again.")
+                await self.send_main_menu(from_number) # Reset
+                conversation_states.delete(from_number)
+
+        elif current_state['step'] == 'view_appointments':
+            # list_id is "appt_<appointment_id>" or "appt_more_<start>_<appointment_id>"
+            if list_id.startswith('appt_more_'):
+                after_start, after_id = list_id.replace('appt_more_', '', 1).split('_', 1)
+                await self.send_appointments_page(from_number, customer_id, (datetime.datetime.fromisoformat(after_start), after_id))
+            else:
+                await self.send_appointment_actions(from_number, customer_id, list_id.replace('appt_', '', 1))
+
+        elif current_state['step'] == 'select_time':
+            # list_id will contain something like "book_slot_2025-07-20 09:00"
+            try:
+                await self.book_selected_slot(from_number, customer_id, list_id.replace("book_slot_", ""), current_state)
+            except Exception as e:
+                log.exception("Error processing time slot selection: %s", e)
+                await self.send(from_number, "There was an error processing your request. Please try again or type 'cancel'.")
+                await self.send_main_menu(from_number)
+                conversation_states.delete(from_number)
+
+    async def book_selected_slot(self, from_number, customer_id, full_datetime_str, current_state):
+        # Ensure the service details are in the state
+        if 'service_id' not in current_state or 'duration' not in current_state:
+            await self.send(from_number, "Oops, something went wrong with the service selection. Please start over.")
+            await self.send_main_menu(from_number)
+            conversation_states.delete(from_number)
+            return
+
+        # A reschedule cancels the old appointment in the booking's own
+        # transaction, so the new time may overlap the old one
+        appointment_id = await self.backend.book_appointment(
+            customer_id,
+            current_state['service_id'],
+            full_datetime_str,
+            current_state['duration'],
+            from_number, # Using from_number as conversation_id for simplicity here
+            replaces=current_state.get('reschedule_appointment_id')
+        )
+        if not appointment_id:
+            await self.send(from_number, "Sorry, that time slot is no longer available or there was an issue booking. Please try another time or date.")
+            # Re-offer slots or main menu
+            await self.send_main_menu(from_number)
+            conversation_states.delete(from_number)
+            return
+
+        if current_state.get('reschedule_appointment_id'):
+            confirmation_msg = f"Your {current_state['service_name']} appointment has been moved to {full_datetime_str} (SAST). See you then!"
+        else:
+            confirmation_msg = f"Your {current_state['service_name']} appointment is confirmed for {full_datetime_str} (SAST). We look forward to seeing you!"
+        # Confirmation, follow-up and main menu go out as one ordered batch
+        # after the webhook is answered
+        await self.backend.send_confirmation(from_number, appointment_id, [
+            (confirmation_msg, "text"),
+            ("Is there anything else I can assist you with?", "text"),
+            (build_main_menu(), "interactive"), # Go back to main menu
+        ])
+        conversation_states.delete(from_number) # Clear state
+
+    # --- View / cancel / reschedule appointments ---
+    async def send_appointments_page(self, to_number, customer_id, after=None):
+        appointments = await self.backend.get_customer_appointments(customer_id, after, limit=WHATSAPP_LIST_MAX_ROWS + 1)
+        if not appointments:
+            await self.send(to_number, "You have no more upcoming appointments." if after else "You have no upcoming appointments.")
+            await self.send_main_menu(to_number)
+            conversation_states.delete(to_number)
+            return
+        await self.send_list(to_number, "Your upcoming appointments", "Appointments", appointments_page_rows(appointments))
+        conversation_states.set(to_number, {'step': 'view_appointments'})
+
+    async def send_appointment_actions(self, to_number, customer_id, appointment_id):
+        appointment = await self.backend.get_customer_appointment(customer_id, appointment_id)
+        if not appointment or appointment['status'] not in ('pending', 'confirmed'):
+            await self.send(to_number, "Sorry, I couldn't find that appointment.")
+            await self.send_main_menu(to_number)
+            conversation_states.delete(to_number)
+            return
+        await self.send(to_number, build_appointment_actions(appointment), message_type="interactive")
+        conversation_states.set(to_number, {'step': 'manage_appointment', 'appointment_id': appointment_id})
+
+    async def cancel_customer_appointment(self, to_number, customer_id, appointment_id):
+        appointment = await self.backend.get_customer_appointment(customer_id, appointment_id)
+        # update_appointment_status releases the slots and invalidates cached availability
+        if (appointment and appointment['status'] in ('pending', 'confirmed')
+                and await self.backend.update_appointment_status(appointment_id, 'cancelled')):
+            await self.send(to_number, f"Your {appointment['service_name']} appointment on {appointment['start_time'].strftime('%Y-%m-%d %H:%M')} has been cancelled.")
+        else:
+            await self.send(to_number, "Sorry, that appointment could not be cancelled. It may already have been cancelled.")
+        await self.send_main_menu(to_number)
+        conversation_states.delete(to_number)
+
+    async def start_reschedule(self, to_number, customer_id, appointment_id):
+        # Same date -> time flow as a new booking; the old appointment is
+        # cancelled by the transaction that books the new one
+        appointment = await self.backend.get_customer_appointment(customer_id, appointment_id)
+        if not appointment or appointment['status'] not in ('pending', 'confirmed'):
+            await self.send(to_number, "Sorry, that appointment can no longer be rescheduled.")
+            await self.send_main_menu(to_number)
+            conversation_states.delete(to_number)
+            return
+        conversation_states.set(to_number, reschedule_state(appointment))
+        await self.send(to_number, f"Let's move your {appointment['service_name']} appointment. Please enter the new date in YYYY-MM-DD format:")
+
+    # --- Sending ---
+    async def send(self, to_number, message_body, message_type="text"):
+        return await self.backend.send_whatsapp_message(to_number, message_body, message_type=message_type)
+
+    async def send_main_menu(self, to_number):
+        await self.send(to_number, build_main_menu(), message_type="interactive")
+
+    async def send_list(self, to_number, header_text, button_text, sections_data):
+        await self.send(to_number, build_list_message(header_text, button_text, sections_data), message_type="interactive")
+
+
+# --- Message builders ---
+def appointments_page_rows(appointments):
+    # Up to 10 rows per list: all of them if that's everything left, otherwise
+    # 9 appointments and a "More" row carrying the keyset position of the 9th
+    if len(appointments) > WHATSAPP_LIST_MAX_ROWS:
+        appointments = appointments[:WHATSAPP_LIST_MAX_ROWS - 1]
+        last = appointments[-1]
+        more = {
+            "id": f"appt_more_{last['start_time'].isoformat()}_{last['appointment_id']}",
+            "title": "More appointments",
+            "description": "Show the next page",
+        }
+    else:
+        more = None
+    rows = [
+        {
+            "id": f"appt_{a['appointment_id']}",
+            "title": a['start_time'].strftime("%a %d %b %H:%M"),
+            "description": f"{a['service_name']} ({a['status']})",
+        }
+        for a in appointments
+    ]
+    if more:
+        rows.append(more)
+    return rows
+
+def build_appointment_actions(appointment):
+    appointment_id = appointment['appointment_id']
+    buttons = [
+        {"type": "reply", "reply": {"id": f"cancel_appt_{appointment_id}", "title": "Cancel it"}},
+        {"type": "reply", "reply": {"id": f"reschedule_appt_{appointment_id}", "title": "Reschedule"}},
+        {"type": "reply", "reply": {"id": "main_menu", "title": "Main Menu"}}
+    ]
+    return {
+        "type": "button",
+        "body": {"text": f"{appointment['service_name']} on {appointment['start_time'].strftime('%Y-%m-%d %H:%M')} (SAST). What would you like to do?"},
+        "action": {"buttons": buttons}
+    }
+
+def reschedule_state(appointment):
+    service = get_service_catalog().get(appointment['service_id'])
+    duration = service['duration_minutes'] if service else int((appointment['end_time'] - appointment['start_time']).total_seconds() // 60)
+    return {
+        'step': 'select_date',
+        'service_id': appointment['service_id'],
+        'service_name': appointment['service_name'],
+        'duration': duration,
+        'reschedule_appointment_id': appointment['appointment_id']
+    }
+
+def build_main_menu():
+    buttons = [
+        {"type": "reply", "reply": {"id": "book_appointment", "title": "Book Appointment"}},
+        {"type": "reply", "reply": {"id": "view_appointments", "title": "View My Appointments"}},
+        {"type": "reply", "reply": {"id": "get_help", "title": "Get Help"}}
+    ]
+    return {
+        "type": "button",
+        "body": {"text": "How can I help you today?"},
+        "action": {"buttons": buttons}
+    }
+
+def build_list_message(header_text, button_text, sections_data):
+    # sections_data is a list of {"id": "...", "title": "..."} for list items.
+    # WhatsApp rejects the whole message if a list breaks its limits, so clip
+    # to 10 rows, 24-character titles and 72-character descriptions.
+    rows = []
+    for row in sections_data[:WHATSAPP_LIST_MAX_ROWS]:
+        row = dict(row, title=str(row['title'])[:WHATSAPP_LIST_TITLE_MAX])
+        if 'description' in row:
+            row['description'] = str(row['description'])[:WHATSAPP_LIST_DESCRIPTION_MAX]
+        rows.append(row)
+    list_sections = [
+        {
+            "rows": rows
+        }
+    ]
+    interactive_body = {
+        "type": "list",
+        "header": {"type": "text", "text": header_text},
+        "body": {"text": "Please choose from the following:"},
+        "action": {
+            "button": button_text,
+            "sections": list_sections
+        }
+    }
+    return interactive_body
@@ -1,189 +1,598 @@
 # database.py
 import mysql.connector
+import atexit
+import json
+import logging
+import threading
 import uuid
-from config import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+from contextlib import contextmanager
+from config import (
+    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME,
+    DB_POOL_SIZE, DB_POOL_TIMEOUT_SECONDS, DB_POOL_RECYCLE_SECONDS, DB_POOL_PING_AFTER_SECONDS,
+    CUSTOMER_CACHE_MAX_ENTRIES, CUSTOMER_CACHE_TTL_SECONDS,
+    LOG_WRITER_ENABLED, LOG_WRITER_BATCH_SIZE, LOG_WRITER_FLUSH_INTERVAL_SECONDS,
+    LOG_WRITER_MAX_QUEUE, LOG_WRITER_OVERFLOW_POLICY,
+    DELIVERY_STATUS_FLUSH_INTERVAL_SECONDS, DELIVERY_STATUS_MAX_PENDING, DELIVERY_STATUS_MAX_ATTEMPTS
+)
+from db_pool import create_mysql_pool, CONNECTION_ERRORS
+from availability_cache import get_availability_cache
+from cache import LRUCache
+from log_writer import BufferedLogWriter
+from delivery_status import DeliveryStatusTracker
+from payload_store import get_payload_store
+from metrics import timed
 
-def get_db_connection():
-    return mysql.connector.connect(
-        host=DB_HOST,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        database=DB_NAME
+log = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Customers are never re-keyed, so an entry only goes stale if the row is deleted
+_customer_id_cache = LRUCache(CUSTOMER_CACHE_MAX_ENTRIES, CUSTOMER_CACHE_TTL_SECONDS)
+
+# --- SQL shared with async_database.py ---
+# Both backends execute these, so the sync and ASGI modes can't drift apart.
+INSERT_APPOINTMENT = (
+    "INSERT INTO appointments (appointment_id, customer_id, service_id, start_time, end_time, status, whatsapp_conversation_id)"
+    " VALUES (%s, %s, %s, %s, %s, %s, %s)"
+)
+# Row lock on the appointment whose status is about to change
+LOCK_APPOINTMENT = "SELECT service_id, start_time, end_time, status FROM appointments WHERE appointment_id = %s FOR UPDATE"
+SET_APPOINTMENT_STATUS = "UPDATE appointments SET status = %s WHERE appointment_id = %s"
+SET_CONFIRMATION_MESSAGE_ID = "UPDATE appointments SET confirmation_message_id = %s WHERE appointment_id = %s"
+CUSTOMER_APPOINTMENT = """
+    SELECT a.appointment_id, a.service_id, s.name AS service_name, a.start_time, a.end_time, a.status
+    FROM appointments a JOIN services s ON s.service_id = a.service_id
+    WHERE a.appointment_id = %s AND a.customer_id = %s
+    """
+
+def customers_upsert_query(rows):
+    # rows: [(new customer_id, phone_number, name), ...]; a customer that
+    # already exists keeps its id
+    return (
+        "INSERT INTO customers (customer_id, whatsapp_phone_number, name) VALUES "
+        + ", ".join(["(%s, %s, %s)"] * len(rows))
+        + " ON DUPLICATE KEY UPDATE customer_id = customer_id",
+        [value for row in rows for value in row]
+    )
+
+def customer_ids_query(phone_numbers):
+    # Rows of (phone_number, customer_id)
+    return (
+        "SELECT whatsapp_phone_number, customer_id FROM customers WHERE whatsapp_phone_number IN ("
+        + ", ".join(["%s"] * len(phone_numbers)) + ")",
+        list(phone_numbers)
     )
 
+def customer_appointments_query(customer_id, now, after, limit):
+    # Keyset page of upcoming active appointments, see get_customer_appointments
+    after_start, after_id = after if after else (now, '')
+    return """
+        SELECT a.appointment_id, a.service_id, s.name AS service_name, a.start_time, a.end_time, a.status
+        FROM appointments a JOIN services s ON s.service_id = a.service_id
+        WHERE a.customer_id = %s AND a.start_time >= %s
+        AND (a.start_time > %s OR (a.start_time = %s AND a.appointment_id > %s))
+        AND a.status IN ('pending', 'confirmed')
+        ORDER BY a.start_time, a.appointment_id
+        LIMIT %s
+        """, (customer_id, now, after_start, after_start, after_id, limit)
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = create_mysql_pool(
+                    DB_HOST, DB_USER, DB_PASSWORD, DB_NAME,
+                    size=DB_POOL_SIZE,
+                    timeout=DB_POOL_TIMEOUT_SECONDS,
+                    recycle=DB_POOL_RECYCLE_SECONDS,
+                    ping_after=DB_POOL_PING_AFTER_SECONDS
+                )
+    return _pool
+
+def get_db_connection():
+    # Checked out from the shared pool; use as `with get_db_connection() as conn:`
+    # so it goes back (or is dropped, if it broke) however the block ends
+    return get_pool().connection()
+
+@contextmanager
+def transaction(dictionary=False):
+    # Usage: with transaction() as cursor: cursor.execute(...)
+    # Commits on success, rolls back on any exception.
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            yield cursor
+            conn.commit()
+        except CONNECTION_ERRORS:
+            # The connection itself is suspect; leaving the with block drops it
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+def get_pool_stats():
+    return get_pool().stats()
+
+def get_customer_cache_stats():
+    return _customer_id_cache.stats()
+
+@timed("db")
 def add_customer(phone_number, name):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    customer_id = str(uuid.uuid4()) # Generate UUID for new customer
-    try:
-        cursor.execute(
-            "INSERT INTO customers (customer_id, whatsapp_phone_number, name) VALUES (%s, %s, %s)",
-            (customer_id, phone_number, name)
-        )
-        conn.commit()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        customer_id = str(uuid.uuid4()) # Generate UUID for new customer
+        try:
+            cursor.execute(
+                "INSERT INTO customers (customer_id, whatsapp_phone_number, name) VALUES (%s, %s, %s)",
+                (customer_id, phone_number, name)
+            )
+            conn.commit()
+            return customer_id
+        except mysql.connector.Error as err:
+            if err.errno == 1062: # Duplicate entry for unique phone number
+                log.info("Customer with phone number %s already exists", phone_number)
+                # Retrieve existing customer_id
+                cursor.execute("SELECT customer_id FROM customers WHERE whatsapp_phone_number = %s", (phone_number,))
+                customer_id = cursor.fetchone()[0]
+                return customer_id
+            else:
+                log.error("Error adding customer: %s", err)
+                conn.rollback()
+                return None
+        finally:
+            cursor.close()
+
+@timed("db")
+def get_customer_by_phone(phone_number):
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True) # Return rows as dictionaries
+        try:
+            cursor.execute("SELECT * FROM customers WHERE whatsapp_phone_number = %s", (phone_number,))
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+@timed("db")
+def resolve_customer(phone_number, name):
+    # phone number -> customer_id, creating the customer if needed. Repeat
+    # senders are answered from memory; otherwise one upsert (no duplicate-key
+    # error path, safe against concurrent first messages) plus a read of the
+    # winning id, on a single pooled connection.
+    customer_id = _customer_id_cache.get(phone_number)
+    if customer_id:
         return customer_id
-    except mysql.connector.Error as err:
-        if err.errno == 1062: # Duplicate entry for unique phone number
-            print(f"Customer with phone number {phone_number} already exists.")
-            # Retrieve existing customer_id
-            cursor.execute("SELECT customer_id FROM customers WHERE whatsapp_phone_number = %s", (phone_number,))
-            customer_id = cursor.fetchone()[0]
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(*customers_upsert_query([(str(uuid.uuid4()), phone_number, name)]))
+            cursor.execute(*customer_ids_query([phone_number]))
+            row = cursor.fetchone()
+            conn.commit()
+            customer_id = row[1] if row else None
+            if customer_id:
+                _customer_id_cache.set(phone_number, customer_id)
             return customer_id
-        else:
-            print(f"Error: {err}")
+        except Exception as e:
+            log.error("Error resolving customer %s: %s", phone_number, e)
             conn.rollback()
             return None
-    finally:
-        cursor.close()
-        conn.close()
+        finally:
+            cursor.close()
 
-def get_customer_by_phone(phone_number):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True) # Return rows as dictionaries
-    try:
-        cursor.execute("SELECT * FROM customers WHERE whatsapp_phone_number = %s", (phone_number,))
-        return cursor.fetchone()
-    finally:
-        cursor.close()
-        conn.close()
+@timed("db")
+def resolve_customers(phone_numbers_and_names):
+    # Batch variant for webhooks carrying many messages: takes
+    # [(phone_number, name), ...] and returns {phone_number: customer_id}
+    # using one multi-row upsert and one SELECT for all cache misses.
+    resolved = {}
+    missing = {}
+    for phone_number, name in phone_numbers_and_names:
+        customer_id = _customer_id_cache.get(phone_number)
+        if customer_id:
+            resolved[phone_number] = customer_id
+        else:
+            missing[phone_number] = name
+    if not missing:
+        return resolved
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(*customers_upsert_query(
+                [(str(uuid.uuid4()), phone_number, name) for phone_number, name in missing.items()]))
+            cursor.execute(*customer_ids_query(list(missing)))
+            for phone_number, customer_id in cursor.fetchall():
+                _customer_id_cache.set(phone_number, customer_id)
+                resolved[phone_number] = customer_id
+            conn.commit()
+            return resolved
+        except Exception as e:
+            log.error("Error resolving customers: %s", e)
+            conn.rollback()
+            return resolved
+        finally:
+            cursor.close()
 
+@timed("db")
 def get_available_services():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT service_id, name, duration_minutes, price FROM services ORDER BY name")
-        return cursor.fetchall()
-    finally:
-        cursor.close()
-        conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT service_id, name, duration_minutes, price FROM services ORDER BY name")
+            return cursor.fetchall()
+        finally:
+            cursor.close()
 
+@timed("db")
 def get_service_by_id(service_id):
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        cursor.execute("SELECT service_id, name, duration_minutes FROM services WHERE service_id = %s", (service_id,))
-        return cursor.fetchone()
-    finally:
-        cursor.close()
-        conn.close()
-
-def get_available_time_slots(service_duration_minutes, date):
-    # This is a simplified example. Real-world availability is complex.
-    # It should check staff availability, existing appointments, working hours etc.
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    try:
-        # Example: Find existing appointments for the given date
-        # You'd then subtract these from your total available slots
-        cursor.execute(
-            """
-            SELECT start_time, end_time FROM appointments
-            WHERE DATE(start_time) = %s AND status IN ('pending', 'confirmed')
-            """, (date,)
-        )
-        booked_slots = cursor.fetchall()
-
-        # For a beta, let's just generate some dummy slots
-        # In production, you'd have proper logic for availability based on staff, capacity, etc.
-        available_slots = []
-        import datetime
-        start_of_day = datetime.datetime.strptime(f"{date} 09:00:00", "%Y-%m-%d %H:%M:%S")
-        end_of_day = datetime.datetime.strptime(f"{date} 17:00:00", "%Y-%m-%d %H:%M:%S")
-        
-        current_time_slot = start_of_day
-        while current_time_slot + datetime.timedelta(minutes=service_duration_minutes) <= end_of_day:
-            is_booked = False
-            for booked in booked_slots:
-                # Simple overlap check - needs more robust logic for real app
-                if not (current_time_slot >= booked['end_time'] or current_time_slot + datetime.timedelta(minutes=service_duration_minutes) <= booked['start_time']):
-                    is_booked = True
-                    break
-            
-            if not is_booked:
-                available_slots.append(current_time_slot.strftime("%H:%M"))
-            
-            current_time_slot += datetime.timedelta(minutes=service_duration_minutes) # Move to next possible slot
-            # Or
-            # current_time_slot += datetime.timedelta(minutes=15) # Example: check every 15 min
-
-        return available_slots
-    finally:
-        cursor.close()
-        conn.close()
-
-def book_appointment(customer_id, service_id, start_time_str, duration_minutes, whatsapp_conversation_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    appointment_id = str(uuid.uuid4())
-    try:
-        import datetime
-        start_time = datetime.datetime.strptime(start_time_str, "%Y-%m-%d %H:%M")
-        end_time = start_time + datetime.timedelta(minutes=duration_minutes)
-
-        # Basic check for overlapping appointments for the same service/staff if applicable
-        # This needs to be more robust for production! (e.g., ACID transactions, proper locking)
-        cursor.execute(
-            """
-            SELECT COUNT(*) FROM appointments
-            WHERE service_id = %s
-            AND (
-                (start_time < %s AND end_time > %s) OR
-                (start_time >= %s AND start_time < %s)
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT service_id, name, duration_minutes FROM services WHERE service_id = %s", (service_id,))
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+@timed("db")
+def get_available_time_slots(service_duration_minutes, date, service_id=None):
+    # Free start times ("HH:MM") for one day; see availability.py for the engine.
+    # Without a service_id every service's bookings block the day (old behaviour).
+    import datetime
+    from availability import compute_availability
+    day = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+
+    def compute():
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                return compute_availability(cursor, service_duration_minutes, day, service_id=service_id)[day]
+            finally:
+                cursor.close()
+
+    # The whole day is cached; times that have already passed are dropped per request
+    slots = get_availability_cache().get_or_compute(service_id, date, service_duration_minutes, compute)
+    now = datetime.datetime.now()
+    return [slot.strftime("%H:%M") for slot in slots if slot >= now]
+
+@timed("db")
+def get_availability_for_range(service_id, service_duration_minutes, start_date, end_date):
+    # {date: [datetime, ...]} for every day in the range, from a single query
+    import datetime
+    from availability import compute_availability
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            return compute_availability(
+                cursor, service_duration_minutes, start_date, end_date, service_id=service_id,
+                not_before=datetime.datetime.now()
             )
-            AND status IN ('pending', 'confirmed')
-            """,
-            (service_id, end_time, start_time, start_time, end_time)
-        )
-        if cursor.fetchone()[0] > 0:
-            print("Slot already booked or overlaps.")
-            return None # Indicate booking failed due to overlap
-
-        cursor.execute(
-            "INSERT INTO appointments (appointment_id, customer_id, service_id, start_time, end_time, status, whatsapp_conversation_id) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-            (appointment_id, customer_id, service_id, start_time, end_time, 'confirmed', whatsapp_conversation_id)
-        )
-        conn.commit()
-        return appointment_id
-    except Exception as e:
-        print(f"Error booking appointment: {e}")
-        conn.rollback()
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+        finally:
+            cursor.close()
 
+@timed("db")
+def find_next_available_slots(service_id, service_duration_minutes, start_date, limit, horizon_days=None):
+    # Earliest `limit` open start times (datetimes) from start_date onwards,
+    # from one range query over the whole horizon
+    import datetime
+    from availability import find_next_available
+    from config import NEXT_AVAILABLE_HORIZON_DAYS
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            return find_next_available(
+                cursor, service_duration_minutes, start_date, horizon_days or NEXT_AVAILABLE_HORIZON_DAYS, limit,
+                service_id=service_id, not_before=datetime.datetime.now()
+            )
+        finally:
+            cursor.close()
+
+@timed("db")
+def book_appointment(customer_id, service_id, start_time_str, duration_minutes, whatsapp_conversation_id, replaces=None):
+    # Appointment row and slot reservations go in one transaction; a taken slot
+    # fails the reservation insert on its unique key (see booking.py), so two
+    # customers racing for the same time can't both win. `replaces` is the
+    # appointment being rescheduled: it is cancelled and its slots released in
+    # the same transaction, so the new time may overlap the old one and a
+    # failed booking leaves the old appointment as it was. Rescheduling an
+    # appointment that no longer exists or is no longer active fails.
+    import datetime
+    from booking import reserve_slots, release_slots, SlotTaken, DEADLOCK
+    start_time = datetime.datetime.strptime(start_time_str, "%Y-%m-%d %H:%M")
+    end_time = start_time + datetime.timedelta(minutes=duration_minutes)
+
+    for attempt in range(2):
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            appointment_id = str(uuid.uuid4())
+            try:
+                replaced = None
+                if replaces:
+                    cursor.execute(LOCK_APPOINTMENT, (replaces,))
+                    replaced = cursor.fetchone()
+                    if not replaced or replaced[3] not in ('pending', 'confirmed'):
+                        # Cancelled (or rescheduled) since the customer picked it; booking
+                        # anyway would leave them with an extra appointment
+                        conn.rollback()
+                        log.info("Appointment %s is no longer active, not rescheduled", replaces)
+                        return None
+                    cursor.execute(SET_APPOINTMENT_STATUS, ('cancelled', replaces))
+                    release_slots(cursor, replaces)
+                cursor.execute(
+                    INSERT_APPOINTMENT,
+                    (appointment_id, customer_id, service_id, start_time, end_time, 'confirmed', whatsapp_conversation_id)
+                )
+                reserve_slots(cursor, appointment_id, service_id, start_time, end_time)
+                conn.commit()
+                invalidate_availability(service_id, start_time, end_time)
+                if replaced:
+                    invalidate_availability(replaced[0], replaced[1], replaced[2])
+                return appointment_id
+            except SlotTaken:
+                conn.rollback()
+                log.info("Slot already booked or overlaps")
+                # Whoever showed this slot as free had a stale view; refresh it
+                invalidate_availability(service_id, start_time, end_time)
+                return None # Indicate booking failed due to overlap
+            except mysql.connector.Error as err:
+                conn.rollback()
+                if err.errno == DEADLOCK and attempt == 0:
+                    continue # InnoDB picked us as the victim; one retry is enough
+                log.error("Error booking appointment: %s", err)
+                return None
+            except Exception as e:
+                log.exception("Error booking appointment: %s", e)
+                conn.rollback()
+                return None
+            finally:
+                cursor.close()
+
+@timed("db")
 def log_message(whatsapp_message_id, direction, customer_id, timestamp, message_content, raw_json_payload):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    message_log_id = str(uuid.uuid4())
-    try:
-        cursor.execute(
-            """
-            INSERT INTO messages_log (message_log_id, whatsapp_message_id, direction, customer_id, timestamp, message_content, raw_json_payload)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """,
-            (message_log_id, whatsapp_message_id, direction, customer_id, timestamp, message_content, raw_json_payload)
-        )
-        conn.commit()
-    except Exception as e:
-        print(f"Error logging message: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
+    # Non-blocking: the row is buffered and written in bulk by the log writer.
+    # raw_json_payload is kept as passed (usually the webhook dict, shared by
+    # all its messages); hashing and compressing it happen on the writer thread.
+    row = (str(uuid.uuid4()), whatsapp_message_id, direction, customer_id, timestamp, message_content, raw_json_payload)
+    if LOG_WRITER_ENABLED:
+        get_log_writer().write(row)
+    else:
+        try:
+            insert_message_logs([row])
+        except Exception as e:
+            log.error("Error logging message: %s", e)
+
+def log_outbound_message(whatsapp_message_id, payload, response):
+    # Called once the Graph API accepted a message; delivery statuses are later
+    # applied to this row
+    import datetime
+    customer_id = _customer_id_cache.get(payload.get('to'))
+    log_message(whatsapp_message_id, 'outbound', customer_id, datetime.datetime.now(), json.dumps(payload), response)
+
+@timed("db")
+def insert_message_logs(rows):
+    # One multi-row INSERT per batch. A redelivered inbound message that slipped
+    # past the in-memory dedup hits the unique key on whatsapp_message_id
+    # (migrations/003) and is skipped instead of failing the whole batch.
+    # Payloads go to webhook_payloads once per content hash in the batch, in
+    # the same transaction, and the log rows reference them (migrations/007).
+    store = get_payload_store()
+    hashes, payload_rows = store.prepare([row[6] for row in rows])
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if payload_rows:
+                cursor.execute(
+                    "INSERT INTO webhook_payloads (payload_hash, compressed_payload, original_bytes, stored_bytes) VALUES "
+                    + ", ".join(["(%s, %s, %s, %s)"] * len(payload_rows))
+                    + " ON DUPLICATE KEY UPDATE payload_hash = payload_hash",
+                    [value for row in payload_rows for value in row]
+                )
+            cursor.execute(
+                "INSERT INTO messages_log (message_log_id, whatsapp_message_id, direction, customer_id, timestamp, message_content, payload_hash) VALUES "
+                + ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(rows))
+                + " ON DUPLICATE KEY UPDATE message_log_id = message_log_id",
+                [value for row, digest in zip(rows, hashes) for value in row[:6] + (digest,)]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+    store.mark_stored(payload_rows)
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer():
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = BufferedLogWriter(
+                    insert_message_logs,
+                    batch_size=LOG_WRITER_BATCH_SIZE,
+                    flush_interval=LOG_WRITER_FLUSH_INTERVAL_SECONDS,
+                    max_queue=LOG_WRITER_MAX_QUEUE,
+                    overflow_policy=LOG_WRITER_OVERFLOW_POLICY,
+                    name="messages-log-writer"
+                )
+    return _log_writer
+
+def close_log_writer():
+    # Flushes buffered rows; registered at import so it runs after the webhook
+    # queue has drained (atexit is LIFO)
+    global _log_writer
+    writer, _log_writer = _log_writer, None
+    if writer is not None:
+        writer.close()
+
+atexit.register(close_log_writer)
+
+def get_log_writer_stats():
+    return get_log_writer().stats()
+
+def get_payload_store_stats():
+    return get_payload_store().stats()
+
+@timed("db")
+def apply_delivery_statuses(statuses):
+    # statuses: {whatsapp_message_id: (rank, status, timestamp)}, already the
+    # newest per message. One SELECT finds which outbound rows exist, then one
+    # UPDATE per status value. The rank guard keeps the column monotonic even
+    # when another process applies a newer status first. Returns the ids that
+    # have no outbound row (yet).
+    missing = set()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            ids = list(statuses)
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                cursor.execute(
+                    "SELECT whatsapp_message_id FROM messages_log WHERE direction = 'outbound' AND whatsapp_message_id IN ("
+                    + ", ".join(["%s"] * len(chunk)) + ")",
+                    chunk
+                )
+                found = {row[0] for row in cursor.fetchall()}
+                missing.update(message_id for message_id in chunk if message_id not in found)
 
+                by_status = {}
+                for message_id in found:
+                    by_status.setdefault(statuses[message_id][:2], []).append(message_id)
+                for (rank, status), message_ids in by_status.items():
+                    cursor.execute(
+                        "UPDATE messages_log SET delivery_status = %s, delivery_status_rank = %s, delivery_status_at = CASE whatsapp_message_id "
+                        + " ".join(["WHEN %s THEN %s"] * len(message_ids))
+                        + " END WHERE direction = 'outbound' AND whatsapp_message_id IN (" + ", ".join(["%s"] * len(message_ids)) + ")"
+                        + " AND delivery_status_rank < %s",
+                        [status, rank]
+                        + [value for message_id in message_ids for value in (message_id, statuses[message_id][2])]
+                        + message_ids + [rank]
+                    )
+            conn.commit()
+            return missing
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+_delivery_status_tracker = None
+_delivery_status_tracker_lock = threading.Lock()
+
+def get_delivery_status_tracker():
+    global _delivery_status_tracker
+    if _delivery_status_tracker is None:
+        with _delivery_status_tracker_lock:
+            if _delivery_status_tracker is None:
+                _delivery_status_tracker = DeliveryStatusTracker(
+                    apply_delivery_statuses,
+                    flush_interval=DELIVERY_STATUS_FLUSH_INTERVAL_SECONDS,
+                    max_pending=DELIVERY_STATUS_MAX_PENDING,
+                    max_attempts=DELIVERY_STATUS_MAX_ATTEMPTS
+                )
+    return _delivery_status_tracker
+
+def record_delivery_status(whatsapp_message_id, status, timestamp):
+    # Non-blocking; applied to the outbound messages_log row on the next flush
+    return get_delivery_status_tracker().record(whatsapp_message_id, status, timestamp)
+
+def close_delivery_status_tracker():
+    # Runs before close_log_writer (registered later, atexit is LIFO), so write
+    # the outbound rows still buffered first or their statuses would be lost
+    global _delivery_status_tracker
+    tracker, _delivery_status_tracker = _delivery_status_tracker, None
+    if tracker is not None:
+        if _log_writer is not None:
+            _log_writer.flush()
+        tracker.close()
+
+atexit.register(close_delivery_status_tracker)
+
+def get_delivery_status_stats():
+    return get_delivery_status_tracker().stats()
+
+@timed("db")
 def update_appointment_confirmation_id(appointment_id, message_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "UPDATE appointments SET confirmation_message_id = %s WHERE appointment_id = %s",
-            (message_id, appointment_id)
-        )
-        conn.commit()
-    except Exception as e:
-        print(f"Error updating confirmation message ID: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
\ No newline at end of file
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SET_CONFIRMATION_MESSAGE_ID, (message_id, appointment_id))
+            conn.commit()
+        except Exception as e:
+            log.error("Error updating confirmation message ID: %s", e)
+            conn.rollback()
+        finally:
+            cursor.close()
+
+@timed("db")
+def get_customer_appointments(customer_id, after=None, limit=10):
+    # Upcoming active appointments of one customer, soonest first. `after` is
+    # the (start_time, appointment_id) of the last row already shown; the next
+    # page continues from there (keyset pagination on
+    # idx_appointments_customer_start, migrations/005), so a long history
+    # never makes a page slower.
+    import datetime
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(*customer_appointments_query(customer_id, datetime.datetime.now(), after, limit))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+@timed("db")
+def get_customer_appointment(customer_id, appointment_id):
+    # None unless the appointment exists and belongs to this customer
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(CUSTOMER_APPOINTMENT, (appointment_id, customer_id))
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+def invalidate_availability(service_id, start_time, end_time):
+    # Drop cached availability for every day the appointment touches
+    import datetime
+    day = start_time.date()
+    while day <= end_time.date():
+        get_availability_cache().invalidate(service_id, day.strftime("%Y-%m-%d"))
+        day += datetime.timedelta(days=1)
+
+@timed("db")
+def update_appointment_status(appointment_id, status):
+    # Cancelled/completed appointments give their slots back; moving one back
+    # to pending/confirmed reserves them again, and fails (False) if the time
+    # has been booked by someone else since.
+    from booking import reserve_slots, release_slots, SlotTaken
+    with get_db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(LOCK_APPOINTMENT, (appointment_id,))
+            appointment = cursor.fetchone()
+            if not appointment:
+                return False
+            cursor.execute(SET_APPOINTMENT_STATUS, (status, appointment_id))
+            if status not in ('pending', 'confirmed'):
+                release_slots(cursor, appointment_id)
+            elif appointment['status'] not in ('pending', 'confirmed'):
+                reserve_slots(cursor, appointment_id, appointment['service_id'], appointment['start_time'], appointment['end_time'])
+            conn.commit()
+            invalidate_availability(appointment['service_id'], appointment['start_time'], appointment['end_time'])
+            return True
+        except SlotTaken:
+            conn.rollback()
+            log.info("Appointment %s not reactivated, its time has been booked since", appointment_id)
+            return False
+        except Exception as e:
+            log.error("Error updating appointment status: %s", e)
+            conn.rollback()
+            return False
+        finally:
+            cursor.close()
\ No newline at end of file
@@ -0,0 +1,224 @@
+# db_pool.py
+import threading
+import time
+import weakref
+from collections import deque
+
+import mysql.connector
+from mysql.connector.errors import PoolError, InterfaceError, OperationalError
+
+# Errors that mean the connection itself is gone (server restart, network
+# blip); a connection that raised one is dropped instead of reused
+CONNECTION_ERRORS = (InterfaceError, OperationalError)
+
+
+class PoolTimeoutError(PoolError):
+    pass
+
+
+class PooledConnection:
+    # Thin proxy around a mysql connection: close() hands it back to the pool
+    # instead of tearing down the socket, so existing helpers keep working.
+    # As a context manager it is closed however the block ends, and dropped
+    # if the block raised one of CONNECTION_ERRORS.
+
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self._closed = False
+        # A checkout nobody closes still gives its slot back once the proxy is
+        # garbage collected; the connection's state is unknown, so it's dropped
+        self._finalizer = weakref.finalize(self, pool._discard, conn)
+        self._finalizer.atexit = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, CONNECTION_ERRORS):
+            self.invalidate()
+        else:
+            self.close()
+
+    def cursor(self, *args, **kwargs):
+        # mysql-connector checks the connection here, so this is where a dead
+        # one usually shows up
+        try:
+            return self._conn.cursor(*args, **kwargs)
+        except CONNECTION_ERRORS:
+            self.invalidate()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._finalizer.detach()
+        self._pool._release(self._conn, self._created_at)
+
+    def invalidate(self):
+        # Drop the underlying connection instead of returning it (e.g. after a
+        # lost connection error) so the next checkout gets a fresh one.
+        if self._closed:
+            return
+        self._closed = True
+        self._finalizer.detach()
+        self._pool._discard(self._conn)
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=10, timeout=5.0, recycle=1800.0, ping_after=30.0):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+
+        self._idle = deque()  # (conn, created_at, released_at)
+        self._open = 0  # connections currently owned by the pool (idle + checked out)
+        self._cond = threading.Condition()
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'failed_health_checks': 0,
+            'discarded': 0,
+        }
+
+    def connection(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        waited_since = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, created_at, released_at = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    # Reserve the slot now, connect outside the lock
+                    self._open += 1
+                    conn = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"Timed out after {timeout}s waiting for a database connection "
+                        f"({self.size} in use)"
+                    )
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._stats['waits'] += 1
+                self._cond.wait(remaining)
+
+            if waited_since is not None:
+                self._stats['wait_seconds'] += time.monotonic() - waited_since
+            self._stats['checkouts'] += 1
+
+        if conn is not None:
+            conn, created_at = self._check(conn, created_at, released_at)
+        else:
+            conn, created_at = self._new_connection()
+        return PooledConnection(self, conn, created_at)
+
+    def _new_connection(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            self._forget()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return conn, time.monotonic()
+
+    def _check(self, conn, created_at, released_at):
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            with self._cond:
+                self._stats['recycled'] += 1
+            self._close_quietly(conn)
+            return self._new_connection()
+
+        if now - released_at >= self.ping_after:
+            try:
+                healthy = conn.is_connected()
+            except Exception:
+                healthy = False
+            if not healthy:
+                with self._cond:
+                    self._stats['failed_health_checks'] += 1
+                self._close_quietly(conn)
+                return self._new_connection()
+
+        return conn, created_at
+
+    def _release(self, conn, created_at):
+        try:
+            # Never hand the next caller somebody else's half-finished transaction
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self._cond:
+            self._stats['discarded'] += 1
+        self._forget()
+
+    def _forget(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self.size
+            stats['open'] = self._open
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._open - len(self._idle)
+        return stats
+
+    def close(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+
+def create_mysql_pool(host, user, password, database, size, timeout, recycle, ping_after):
+    def connect():
+        return mysql.connector.connect(
+            host=host,
+            user=user,
+            password=password,
+            database=database,
+        )
+    return ConnectionPool(connect, size=size, timeout=timeout, recycle=recycle, ping_after=ping_after)
@@ -0,0 +1,114 @@
+# dedup.py
+import logging
+import threading
+
+from cache import LRUCache
+from config import DEDUP_BACKEND, DEDUP_WINDOW_SECONDS, DEDUP_MAX_ENTRIES, REDIS_URL
+
+try:
+    import redis
+except ImportError: # only needed for DEDUP_BACKEND=redis
+    redis = None
+
+log = logging.getLogger(__name__)
+
+
+def event_key(kind, event):
+    # Statuses reuse the outbound message id, so the status itself is part of the key
+    if kind == 'message':
+        return f"m:{event.get('id')}"
+    return f"s:{event.get('id')}:{event.get('status')}"
+
+
+class LocalSeenIds:
+    # Stand-in for the shared backend: one store that several deduplicators
+    # (simulated processes) can share in tests.
+
+    def __init__(self, max_entries=DEDUP_MAX_ENTRIES, window_seconds=DEDUP_WINDOW_SECONDS):
+        self._seen = LRUCache(max_entries, window_seconds)
+
+    def claim(self, key):
+        return self._seen.add(key)
+
+    def release(self, key):
+        self._seen.pop(key)
+
+
+class RedisSeenIds:
+    # SET NX EX: the first process to claim an id wins, the key expires with the window
+
+    def __init__(self, url=REDIS_URL, window_seconds=DEDUP_WINDOW_SECONDS, prefix="webhook-seen:"):
+        if redis is None:
+            raise RuntimeError("The redis package is required for DEDUP_BACKEND=redis")
+        self._client = redis.Redis.from_url(url)
+        self._window = int(window_seconds)
+        self._prefix = prefix
+
+    def claim(self, key):
+        return bool(self._client.set(self._prefix + key, 1, nx=True, ex=self._window))
+
+    def release(self, key):
+        self._client.delete(self._prefix + key)
+
+
+class WebhookDeduplicator:
+    # Decides whether a webhook message/status is a first delivery. The local
+    # time-windowed set answers redeliveries to this process without any I/O;
+    # the shared backend (if configured) catches redeliveries that land on
+    # another process. A redelivery older than the window (or evicted from
+    # it), or one that lands on another process without a shared backend, is
+    # processed again and its replies are sent again; the unique key on
+    # messages_log (migrations/003) only keeps its log row from being
+    # written twice.
+
+    def __init__(self, shared=None, max_entries=DEDUP_MAX_ENTRIES, window_seconds=DEDUP_WINDOW_SECONDS):
+        self._local = LRUCache(max_entries, window_seconds)
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._stats = {'checked': 0, 'duplicates_dropped': 0, 'shared_errors': 0}
+
+    def first_delivery(self, kind, event):
+        key = event_key(kind, event)
+        self._count('checked')
+        if not self._local.add(key):
+            self._count('duplicates_dropped')
+            return False
+        if self._shared is not None:
+            try:
+                if not self._shared.claim(key):
+                    self._count('duplicates_dropped')
+                    return False
+            except Exception as e:
+                # Fail open: processing twice beats dropping a real message
+                self._count('shared_errors')
+                log.warning("Dedup backend unavailable: %s", e)
+        return True
+
+    def forget(self, kind, event):
+        # Called when we could not take the event after all (queue full, crash)
+        # so WhatsApp's retry isn't mistaken for a duplicate
+        key = event_key(kind, event)
+        self._local.pop(key)
+        if self._shared is not None:
+            try:
+                self._shared.release(key)
+            except Exception as e:
+                log.warning("Dedup backend unavailable: %s", e)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['tracked_ids'] = len(self._local)
+        return stats
+
+
+def create_deduplicator(backend=DEDUP_BACKEND):
+    if backend == "memory":
+        return WebhookDeduplicator()
+    if backend == "redis":
+        return WebhookDeduplicator(shared=RedisSeenIds())
+    raise ValueError(f"Unknown DEDUP_BACKEND: {backend}")
@@ -0,0 +1,119 @@
+# delivery_status.py
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# Statuses only ever move forward: a late "delivered" must not overwrite "read".
+# "failed" is terminal.
+STATUS_RANKS = {'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+
+
+def status_rank(status):
+    return STATUS_RANKS.get(status, 0)
+
+
+class DeliveryStatusTracker:
+    # Keeps the newest status per outbound message id in memory and hands the
+    # whole window to `apply_fn({message_id: (rank, status, timestamp)})` from a
+    # background thread every `flush_interval` seconds. A storm of
+    # sent/delivered/read callbacks for one message becomes a single update.
+    #
+    # apply_fn returns the ids it found no outbound row for. Those usually
+    # arrived before the messages_log row was written, so they are retried in
+    # the next windows, `max_attempts` times in total, then dropped.
+
+    def __init__(self, apply_fn, flush_interval=1.0, max_pending=50000, max_attempts=5, name="delivery-status"):
+        self._apply_fn = apply_fn
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+
+        self._pending = {} # message_id -> (rank, status, timestamp, attempts)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._stats = {
+            'recorded': 0, 'coalesced': 0, 'stale_ignored': 0, 'dropped_full': 0,
+            'applied': 0, 'retried': 0, 'dropped_unknown': 0, 'failed_flushes': 0, 'flushes': 0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def record(self, message_id, status, timestamp):
+        # Never touches the database
+        rank = status_rank(status)
+        with self._cond:
+            self._stats['recorded'] += 1
+            current = self._pending.get(message_id)
+            if current is None:
+                if len(self._pending) >= self.max_pending or self._stopping:
+                    self._stats['dropped_full'] += 1
+                    return False
+                self._pending[message_id] = (rank, status, timestamp, 0)
+            elif rank > current[0]:
+                self._pending[message_id] = (rank, status, timestamp, current[3])
+                self._stats['coalesced'] += 1
+            else:
+                self._stats['stale_ignored'] += 1
+        return True
+
+    def _merge_back(self, batch, message_ids, count_attempt=True):
+        # Ids go back into the window unless a newer status came in meanwhile
+        with self._cond:
+            for message_id in message_ids:
+                rank, status, timestamp, attempts = batch[message_id]
+                attempts += 1 if count_attempt else 0
+                if attempts >= self.max_attempts:
+                    self._stats['dropped_unknown'] += 1
+                    continue
+                current = self._pending.get(message_id)
+                if current is None:
+                    self._pending[message_id] = (rank, status, timestamp, attempts)
+                elif current[0] < rank:
+                    self._pending[message_id] = (rank, status, timestamp, max(current[3], attempts))
+                self._stats['retried'] += 1
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                missing = set(self._apply_fn({k: v[:3] for k, v in batch.items()}))
+            except Exception as e:
+                log.error("Error applying %d delivery statuses: %s", len(batch), e)
+                with self._cond:
+                    self._stats['failed_flushes'] += 1
+                # Nothing was applied; keep the whole window for the next tick
+                self._merge_back(batch, batch.keys(), count_attempt=False)
+                return
+            with self._cond:
+                self._stats['flushes'] += 1
+                self._stats['applied'] += len(batch) - len(missing)
+            self._merge_back(batch, missing)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        return stats
+
+    def close(self, timeout=10.0):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self.flush()
@@ -0,0 +1,560 @@
+# fake_mysql.py
+# In-memory stand-in for the MySQL server, for load tests and dry runs that
+# have no database. It understands the statements database.py and friends
+# issue (matched on their SQL text), counts every call and can add latency
+# per statement to mimic a network round trip. Not a SQL engine: anything it
+# doesn't recognise returns no rows.
+import asyncio
+import re
+import threading
+import time
+from collections import Counter
+
+import mysql.connector
+
+from db_pool import ConnectionPool
+
+
+CONNECT_ROUND_TRIPS = 3
+
+
+class FakeDatabase:
+    def __init__(self, services=None, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.lock = threading.RLock()
+        self.calls = Counter() # "SELECT customers" -> n
+        self.connections_opened = 0
+        self.services = {
+            str(s['service_id']): dict(s) for s in (services or [
+                {'service_id': 'svc-haircut', 'name': 'Haircut', 'duration_minutes': 30, 'price': 150},
+                {'service_id': 'svc-colour', 'name': 'Colour', 'duration_minutes': 90, 'price': 650},
+                {'service_id': 'svc-beard', 'name': 'Beard Trim', 'duration_minutes': 15, 'price': 80},
+                {'service_id': 'svc-massage', 'name': 'Massage', 'duration_minutes': 60, 'price': 400},
+            ])
+        }
+        self.customers = {} # phone -> customer_id
+        self.customer_names = {} # customer_id -> name
+        self.appointments = {} # appointment_id -> row dict
+        self.slots = {} # (service_id, slot_start, seat) -> appointment_id
+        self.messages_log = [] # row tuples
+        self.webhook_payloads = {} # payload_hash -> (compressed_payload, original_bytes, stored_bytes)
+        self.delivery_statuses = {} # outbound whatsapp_message_id -> (status, rank, at)
+        self.reminder_sends = {} # (campaign, appointment_id) -> row dict
+
+    def connect(self):
+        with self.lock:
+            self.connections_opened += 1
+        if self.latency_ms:
+            # TCP, handshake and auth: a few round trips
+            time.sleep(CONNECT_ROUND_TRIPS * self.latency_ms / 1000.0)
+        return FakeConnection(self)
+
+    def pool(self, size=10):
+        return ConnectionPool(self.connect, size=size, timeout=30.0, recycle=0, ping_after=3600)
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self._undo = []
+        self.closed = False
+
+    @property
+    def in_transaction(self):
+        return bool(self._undo)
+
+    def cursor(self, dictionary=False, buffered=None):
+        return FakeCursor(self, dictionary)
+
+    def commit(self):
+        self._undo = []
+
+    def rollback(self):
+        with self.db.lock:
+            for undo in reversed(self._undo):
+                undo()
+        self._undo = []
+
+    def start_transaction(self):
+        pass
+
+    def is_connected(self):
+        return not self.closed
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def _table(sql):
+    match = re.search(r"\b(?:FROM|INTO|UPDATE)\s+`?(\w+)", sql, re.I)
+    return match.group(1) if match else "?"
+
+def _columns(sql):
+    # Column list of an INSERT
+    return re.search(r"\(([^)]*)\) VALUES", sql).group(1).split(", ")
+
+def _rows(columns, params):
+    return [dict(zip(columns, params[i:i + len(columns)])) for i in range(0, len(params), len(columns))]
+
+MESSAGES_LOG_COLUMNS = ['message_log_id', 'whatsapp_message_id', 'direction', 'customer_id', 'timestamp', 'message_content', 'payload_hash']
+
+
+class FakeCursor:
+    def __init__(self, conn, dictionary):
+        self.conn = conn
+        self.db = conn.db
+        self.dictionary = dictionary
+        self._rows = []
+        self._columns = []
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        sql, params = self._count(sql, params)
+        if self.db.latency_ms:
+            time.sleep(self.db.latency_ms / 1000.0)
+        with self.db.lock:
+            self._dispatch(sql, params)
+
+    def _count(self, sql, params):
+        sql = " ".join(sql.split())
+        verb = sql.split(" ", 1)[0].upper()
+        with self.db.lock:
+            self.db.calls[f"{verb} {_table(sql)}"] += 1
+        return sql, list(params or ())
+
+    def executemany(self, sql, seq_params):
+        for params in seq_params:
+            self.execute(sql, params)
+
+    def _result(self, columns, rows):
+        self._columns = columns
+        self._rows = [dict(zip(columns, r)) if self.dictionary else tuple(r) for r in rows]
+        self.rowcount = len(self._rows)
+
+    def _dispatch(self, sql, p):
+        db = self.db
+        undo = self.conn._undo
+        self._result([], [])
+
+        if sql.startswith("SELECT service_id, name, duration_minutes, price FROM services"):
+            rows = sorted(db.services.values(), key=lambda s: s['name'])
+            return self._result(['service_id', 'name', 'duration_minutes', 'price'],
+                                [(s['service_id'], s['name'], s['duration_minutes'], s['price']) for s in rows])
+        if sql.startswith("SELECT service_id, name, duration_minutes FROM services WHERE service_id"):
+            s = db.services.get(str(p[0]))
+            return self._result(['service_id', 'name', 'duration_minutes'],
+                                [(s['service_id'], s['name'], s['duration_minutes'])] if s else [])
+
+        if sql.startswith("INSERT INTO customers"):
+            inserted = 0
+            for i in range(0, len(p), 3):
+                if p[i + 1] not in db.customers:
+                    db.customers[p[i + 1]] = p[i]
+                    inserted += 1
+                    undo.append(lambda phone=p[i + 1]: db.customers.pop(phone, None))
+            self.rowcount = inserted
+            return
+        if sql.startswith("SELECT customer_id FROM customers WHERE whatsapp_phone_number ="):
+            cid = db.customers.get(p[0])
+            return self._result(['customer_id'], [(cid,)] if cid else [])
+        if sql.startswith("SELECT whatsapp_phone_number, customer_id FROM customers WHERE whatsapp_phone_number IN"):
+            return self._result(['whatsapp_phone_number', 'customer_id'],
+                                [(phone, db.customers[phone]) for phone in p if phone in db.customers])
+        if sql.startswith("SELECT * FROM customers WHERE whatsapp_phone_number"):
+            cid = db.customers.get(p[0])
+            return self._result(['customer_id', 'whatsapp_phone_number', 'name'], [(cid, p[0], None)] if cid else [])
+
+        if sql.startswith("SELECT start_time, end_time FROM appointments WHERE"):
+            if "service_id = %s" in sql:
+                service_id, lower, range_end, range_start = p
+            else:
+                service_id = None
+                lower, range_end, range_start = p
+            rows = sorted(
+                (a['start_time'], a['end_time']) for a in db.appointments.values()
+                if a['status'] in ('pending', 'confirmed')
+                and (service_id is None or str(a['service_id']) == str(service_id))
+                and lower <= a['start_time'] < range_end and a['end_time'] > range_start
+            )
+            return self._result(['start_time', 'end_time'], rows)
+        if sql.startswith("INSERT INTO appointments"):
+            inserted = 0
+            for row in _rows(_columns(sql), p):
+                if row['appointment_id'] in db.appointments:
+                    continue
+                row.setdefault('confirmation_message_id', None)
+                db.appointments[row['appointment_id']] = row
+                undo.append(lambda aid=row['appointment_id']: db.appointments.pop(aid, None))
+                inserted += 1
+            self.rowcount = inserted
+            return
+        if sql.startswith("SELECT COUNT(*), MIN(start_time) FROM appointments"):
+            return self._result(['COUNT(*)', 'MIN(start_time)'],
+                                [(len(db.appointments), min((a['start_time'] for a in db.appointments.values()), default=None))])
+        if sql.startswith("SELECT appointment_id, customer_id, service_id, start_time, end_time, status, whatsapp_conversation_id, confirmation_message_id FROM appointments"):
+            columns = ['appointment_id', 'customer_id', 'service_id', 'start_time', 'end_time', 'status', 'whatsapp_conversation_id', 'confirmation_message_id']
+            start, end, after_start, _, after_id, limit = p
+            rows = sorted(
+                (a for a in db.appointments.values()
+                 if start <= a['start_time'] < end and (a['start_time'], a['appointment_id']) > (after_start, after_id)),
+                key=lambda a: (a['start_time'], a['appointment_id'])
+            )
+            return self._result(columns, [tuple(a[c] for c in columns) for a in rows[:limit]])
+        if sql.startswith("DELETE FROM appointments WHERE appointment_id IN"):
+            removed = [db.appointments.pop(aid) for aid in p if aid in db.appointments]
+            for a in removed:
+                undo.append(lambda a=a: db.appointments.__setitem__(a['appointment_id'], a))
+            self.rowcount = len(removed)
+            return
+        if sql.startswith("SELECT a.appointment_id, a.service_id, s.name AS service_name, a.start_time, a.end_time, a.status FROM appointments a"):
+            columns = ['appointment_id', 'service_id', 'service_name', 'start_time', 'end_time', 'status']
+            def row(a):
+                return (a['appointment_id'], a['service_id'], db.services[str(a['service_id'])]['name'],
+                        a['start_time'], a['end_time'], a['status'])
+            if "a.appointment_id = %s AND a.customer_id = %s" in sql:
+                a = db.appointments.get(p[0])
+                return self._result(columns, [row(a)] if a and a['customer_id'] == p[1] else [])
+            customer_id, now, after_start, _, after_id, limit = p
+            rows = sorted(
+                (a for a in db.appointments.values()
+                 if a['customer_id'] == customer_id and a['start_time'] >= now
+                 and (a['start_time'], a['appointment_id']) > (after_start, after_id)
+                 and a['status'] in ('pending', 'confirmed')),
+                key=lambda a: (a['start_time'], a['appointment_id'])
+            )
+            return self._result(columns, [row(a) for a in rows[:limit]])
+        if sql.startswith("SELECT service_id, start_time, end_time, status FROM appointments WHERE appointment_id"):
+            a = db.appointments.get(p[0])
+            return self._result(['service_id', 'start_time', 'end_time', 'status'],
+                                [(a['service_id'], a['start_time'], a['end_time'], a['status'])] if a else [])
+        if sql.startswith("UPDATE appointments SET"):
+            a = db.appointments.get(p[-1])
+            column = sql.split("SET ", 1)[1].split(" ", 1)[0]
+            if a:
+                old = a.get(column)
+                a[column] = p[0]
+                undo.append(lambda a=a, column=column, old=old: a.__setitem__(column, old))
+            self.rowcount = 1 if a else 0
+            return
+
+        if sql.startswith("INSERT INTO appointment_slots"):
+            if "0, %s)" in sql:
+                keys = [(str(p[i]), p[i + 1], 0, p[i + 2]) for i in range(0, len(p), 3)]
+            else:
+                keys = [(str(p[0]), p[1], p[2], p[3])]
+            if any(k[:3] in db.slots for k in keys):
+                raise mysql.connector.Error(msg="Duplicate entry", errno=1062)
+            for k in keys:
+                db.slots[k[:3]] = k[3]
+                undo.append(lambda key=k[:3]: db.slots.pop(key, None))
+            self.rowcount = len(keys)
+            return
+        if sql.startswith("DELETE FROM appointment_slots WHERE appointment_id"):
+            ids = set(p)
+            removed = [k for k, aid in db.slots.items() if aid in ids]
+            for k in removed:
+                aid = db.slots.pop(k)
+                undo.append(lambda k=k, aid=aid: db.slots.__setitem__(k, aid))
+            self.rowcount = len(removed)
+            return
+
+        if sql.startswith("SELECT a.appointment_id, a.start_time, c.whatsapp_phone_number, c.name, s.name FROM appointments a"):
+            campaign, range_start, range_end, after_start, _, after_id = p[:6]
+            retry_statuses, limit = p[6:-1], p[-1]
+            phones = {cid: phone for phone, cid in db.customers.items()}
+            rows = sorted(
+                (a['appointment_id'], a['start_time'], phones.get(a['customer_id']),
+                 db.customer_names.get(a['customer_id']), db.services[str(a['service_id'])]['name'])
+                for a in db.appointments.values()
+                if range_start <= a['start_time'] < range_end
+                and (a['start_time'], a['appointment_id']) > (after_start, after_id)
+                and a['status'] in ('pending', 'confirmed')
+                and db.reminder_sends.get((campaign, a['appointment_id']), {}).get('status', retry_statuses[0]) in retry_statuses
+            )
+            rows.sort(key=lambda r: (r[1], r[0]))
+            return self._result(['appointment_id', 'start_time', 'whatsapp_phone_number', 'c.name', 's.name'], rows[:limit])
+        if sql.startswith("INSERT INTO reminder_sends (campaign, appointment_id, status, whatsapp_message_id"):
+            inserted = 0
+            for row in _rows(_columns(sql), p):
+                key = (row['campaign'], row['appointment_id'])
+                if key not in db.reminder_sends:
+                    db.reminder_sends[key] = {c: v for c, v in row.items() if c not in ('campaign', 'appointment_id')}
+                    undo.append(lambda key=key: db.reminder_sends.pop(key, None))
+                    inserted += 1
+            self.rowcount = inserted
+            return
+        if sql.startswith("SELECT campaign, appointment_id, status, whatsapp_message_id, attempts, claimed_at, finished_at FROM reminder_sends"):
+            ids = set(p)
+            return self._result(
+                ['campaign', 'appointment_id', 'status', 'whatsapp_message_id', 'attempts', 'claimed_at', 'finished_at'],
+                [(campaign, aid, r['status'], r.get('whatsapp_message_id'), r['attempts'], r['claimed_at'], r.get('finished_at'))
+                 for (campaign, aid), r in db.reminder_sends.items() if aid in ids])
+        if sql.startswith("DELETE FROM reminder_sends WHERE appointment_id IN"):
+            ids = set(p)
+            removed = [(key, db.reminder_sends.pop(key)) for key in list(db.reminder_sends) if key[1] in ids]
+            for key, row in removed:
+                undo.append(lambda key=key, row=row: db.reminder_sends.__setitem__(key, row))
+            self.rowcount = len(removed)
+            return
+        if sql.startswith("INSERT INTO reminder_sends"):
+            key = (p[0], p[1])
+            claimable = re.search(r"IF\(status IN \(([^)]*)\)", sql).group(1).replace("'", "").split(", ")
+            row = db.reminder_sends.get(key)
+            if row is None:
+                db.reminder_sends[key] = {'status': 'claimed', 'attempts': 1, 'claimed_at': p[2], 'whatsapp_message_id': None}
+                undo.append(lambda: db.reminder_sends.pop(key, None))
+                self.rowcount = 1
+            elif row['status'] in claimable:
+                old = dict(row)
+                row.update(status='claimed', attempts=row['attempts'] + 1, claimed_at=p[2])
+                undo.append(lambda: row.update(old))
+                self.rowcount = 2
+            else:
+                self.rowcount = 0
+            return
+        if sql.startswith("UPDATE reminder_sends SET"):
+            row = db.reminder_sends.get((p[3], p[4]))
+            if row:
+                old = dict(row)
+                row.update(status=p[0], whatsapp_message_id=p[1], finished_at=p[2])
+                undo.append(lambda: row.update(old))
+            self.rowcount = 1 if row else 0
+            return
+
+        if sql.startswith("SELECT whatsapp_message_id FROM messages_log WHERE direction = 'outbound'"):
+            wanted = set(p)
+            return self._result(['whatsapp_message_id'],
+                                [(row[1],) for row in db.messages_log if row[2] == 'outbound' and row[1] in wanted])
+        if sql.startswith("UPDATE messages_log SET delivery_status"):
+            status, rank = p[0], p[1]
+            n = (len(p) - 3) // 3
+            at = dict(zip(p[2:2 + 2 * n:2], p[3:3 + 2 * n:2]))
+            outbound = {row[1] for row in db.messages_log if row[2] == 'outbound'}
+            updated = 0
+            for message_id in p[2 + 2 * n:2 + 3 * n]:
+                old = db.delivery_statuses.get(message_id)
+                if message_id in outbound and (old is None or old[1] < rank):
+                    db.delivery_statuses[message_id] = (status, rank, at[message_id])
+                    undo.append(lambda message_id=message_id, old=old: db.delivery_statuses.__setitem__(message_id, old) if old else db.delivery_statuses.pop(message_id, None))
+                    updated += 1
+            self.rowcount = updated
+            return
+
+        if sql.startswith("INSERT INTO webhook_payloads"):
+            rows = [tuple(p[i:i + 4]) for i in range(0, len(p), 4)]
+            inserted = 0
+            for payload_hash, *rest in rows:
+                if payload_hash not in db.webhook_payloads:
+                    db.webhook_payloads[payload_hash] = tuple(rest)
+                    inserted += 1
+            self.rowcount = inserted
+            return
+        if sql.startswith("SELECT compressed_payload FROM webhook_payloads"):
+            row = db.webhook_payloads.get(p[0])
+            return self._result(['compressed_payload'], [(row[0],)] if row else [])
+        if sql.startswith("SELECT m.message_log_id, m.whatsapp_message_id, m.direction, m.timestamp, p.compressed_payload"):
+            since, until, after_timestamp, _, after_id, limit = p
+            rows = sorted(
+                (row[4], row[0], row) for row in db.messages_log
+                if row[6] in db.webhook_payloads and since <= row[4] < until and (row[4], row[0]) > (after_timestamp, after_id))
+            return self._result(['message_log_id', 'whatsapp_message_id', 'direction', 'timestamp', 'compressed_payload'],
+                                [(row[0], row[1], row[2], row[4], db.webhook_payloads[row[6]][0]) for _, _, row in rows[:limit]])
+        if sql.startswith("INSERT INTO messages_log"):
+            columns = _columns(sql)
+            if len(columns) == len(MESSAGES_LOG_COLUMNS):
+                rows = [tuple(p[i:i + len(columns)]) for i in range(0, len(p), len(columns))]
+            else:
+                # Restored rows (retention.py) carry every column and may already be there
+                existing = {row[0] for row in db.messages_log}
+                rows = []
+                for row in _rows(columns, p):
+                    if row['message_log_id'] in existing:
+                        continue
+                    rows.append(tuple(row[c] for c in MESSAGES_LOG_COLUMNS))
+                    if row.get('delivery_status'):
+                        db.delivery_statuses[row['whatsapp_message_id']] = (
+                            row['delivery_status'], row['delivery_status_rank'], row['delivery_status_at'])
+            db.messages_log.extend(rows)
+            self.rowcount = len(rows)
+            return
+        if sql.startswith("SELECT COUNT(*), MIN(timestamp) FROM messages_log"):
+            return self._result(['COUNT(*)', 'MIN(timestamp)'],
+                                [(len(db.messages_log), min((row[4] for row in db.messages_log), default=None))])
+        if sql.startswith("SELECT m.message_log_id, m.whatsapp_message_id, m.direction, m.customer_id"):
+            start, end, after_timestamp, _, after_id, limit = p
+            rows = sorted(
+                (row for row in db.messages_log
+                 if start <= row[4] < end and (row[4], row[0]) > (after_timestamp, after_id)),
+                key=lambda row: (row[4], row[0])
+            )
+            def full(row):
+                status, rank, at = db.delivery_statuses.get(row[1], (None, 0, None)) if row[2] == 'outbound' else (None, 0, None)
+                payload = db.webhook_payloads.get(row[6])
+                return row[:6] + (None, row[6], status, rank, at, payload[0] if payload else None)
+            return self._result(
+                ['message_log_id', 'whatsapp_message_id', 'direction', 'customer_id', 'timestamp', 'message_content',
+                 'raw_json_payload', 'payload_hash', 'delivery_status', 'delivery_status_rank', 'delivery_status_at',
+                 'compressed_payload'],
+                [full(row) for row in rows[:limit]])
+        if sql.startswith("DELETE FROM messages_log WHERE message_log_id IN"):
+            ids = set(p)
+            kept, removed = [], []
+            for row in db.messages_log:
+                (removed if row[0] in ids else kept).append(row)
+            db.messages_log[:] = kept
+            for row in removed:
+                if row[2] == 'outbound':
+                    db.delivery_statuses.pop(row[1], None)
+            undo.append(lambda removed=removed: db.messages_log.extend(removed))
+            self.rowcount = len(removed)
+            return
+        if sql.startswith("DELETE FROM webhook_payloads WHERE payload_hash IN"):
+            referenced = {row[6] for row in db.messages_log}
+            removed = [(h, db.webhook_payloads.pop(h)) for h in set(p) if h in db.webhook_payloads and h not in referenced]
+            for h, row in removed:
+                undo.append(lambda h=h, row=row: db.webhook_payloads.__setitem__(h, row))
+            self.rowcount = len(removed)
+            return
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def __iter__(self):
+        while self._rows:
+            yield self._rows.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeAsyncPool:
+    # aiomysql-shaped pool over the same fake database, for async_database.py.
+    # The simulated round trip is awaited, so it doesn't hold the event loop.
+    # Like aiomysql, connections are only opened when the idle ones run out,
+    # and one released with a transaction still open is closed, not reused.
+
+    def __init__(self, db, maxsize=20):
+        self.db = db
+        self.maxsize = maxsize
+        self._in_use = 0
+        self._idle = []
+        self._available = None
+        self.closed_in_transaction = 0
+
+    @property
+    def size(self):
+        return self._in_use + len(self._idle)
+
+    @property
+    def freesize(self):
+        return len(self._idle)
+
+    async def acquire(self):
+        if self._available is None:
+            self._available = asyncio.Semaphore(self.maxsize)
+        await self._available.acquire()
+        self._in_use += 1
+        if self._idle:
+            return self._idle.pop()
+        with self.db.lock:
+            self.db.connections_opened += 1
+        if self.db.latency_ms:
+            await asyncio.sleep(CONNECT_ROUND_TRIPS * self.db.latency_ms / 1000.0)
+        return FakeAsyncConnection(self.db)
+
+    def release(self, conn):
+        self._in_use -= 1
+        if conn.get_transaction_status():
+            self.closed_in_transaction += 1
+        else:
+            self._idle.append(conn)
+        self._available.release()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+class FakeAsyncConnection:
+    # autocommit=False: any statement, reads included, opens a transaction
+    def __init__(self, db):
+        self._conn = FakeConnection(db)
+        self._in_transaction = False
+
+    def cursor(self, cursor_class=None):
+        # Any cursor class means aiomysql.DictCursor here
+        return FakeAsyncCursor(self, FakeCursor(self._conn, cursor_class is not None))
+
+    def get_transaction_status(self):
+        return self._in_transaction
+
+    async def commit(self):
+        self._conn.commit()
+        self._in_transaction = False
+
+    async def rollback(self):
+        self._conn.rollback()
+        self._in_transaction = False
+
+
+class FakeAsyncCursor:
+    def __init__(self, conn, cursor):
+        self._conn = conn
+        self._cursor = cursor
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=()):
+        cursor = self._cursor
+        sql, params = cursor._count(sql, params)
+        self._conn._in_transaction = True
+        if cursor.db.latency_ms:
+            await asyncio.sleep(cursor.db.latency_ms / 1000.0)
+        with cursor.db.lock:
+            cursor._dispatch(sql, params)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+
+def install(fake_db, pool_size=10):
+    # Points database.py at the fake: every helper checks out from a pool of
+    # fake connections instead of connecting to MySQL.
+    import database
+    database._pool = fake_db.pool(pool_size)
+    return fake_db
+
+def install_async(fake_db, pool_size=20):
+    # Same for async_database.py (ASGI mode)
+    import async_database
+    async_database._pool = FakeAsyncPool(fake_db, pool_size)
+    return fake_db
@@ -0,0 +1,127 @@
+# log_writer.py
+import logging
+import threading
+import time
+from collections import deque
+
+OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+log = logging.getLogger(__name__)
+
+
+class BufferedLogWriter:
+    # Collects rows in memory and hands them to `flush_fn(rows)` from a
+    # background thread, either when `batch_size` rows are waiting or every
+    # `flush_interval` seconds. write() never touches the database.
+    #
+    # The buffer holds at most `max_queue` rows. When it is full:
+    #   drop_oldest - discard the oldest buffered row (default; keep fresh data)
+    #   drop_newest - discard the row being written
+    #   block       - wait up to `block_timeout` seconds for space, then drop it
+
+    def __init__(self, flush_fn, batch_size=200, flush_interval=0.5, max_queue=10000,
+                 overflow_policy='drop_oldest', block_timeout=1.0, name="log-writer"):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {OVERFLOW_POLICIES}")
+        self._flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+
+        self._rows = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._stats = {
+            'written': 0, 'dropped': 0, 'failed': 0, 'flushes': 0,
+            'last_flush_seconds': 0.0, 'max_flush_seconds': 0.0, 'total_flush_seconds': 0.0,
+        }
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        with self._cond:
+            if self._stopping:
+                self._stats['dropped'] += 1
+                return False
+            if len(self._rows) >= self.max_queue:
+                if self.overflow_policy == 'drop_newest':
+                    self._stats['dropped'] += 1
+                    return False
+                if self.overflow_policy == 'drop_oldest':
+                    self._rows.popleft()
+                    self._stats['dropped'] += 1
+                else:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._rows) >= self.max_queue:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats['dropped'] += 1
+                            return False
+                        self._cond.wait(remaining)
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _take_batch(self):
+        with self._cond:
+            batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+            self._cond.notify_all() # wake writers blocked on a full buffer
+            return batch
+
+    def flush(self):
+        # Writes everything buffered so far; safe to call from any thread
+        with self._flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    return
+                started = time.monotonic()
+                try:
+                    self._flush_fn(batch)
+                    ok = True
+                except Exception as e:
+                    log.error("Error flushing %d log rows: %s", len(batch), e)
+                    ok = False
+                elapsed = time.monotonic() - started
+                with self._cond:
+                    self._stats['flushes'] += 1
+                    self._stats['written' if ok else 'failed'] += len(batch)
+                    self._stats['last_flush_seconds'] = elapsed
+                    self._stats['max_flush_seconds'] = max(self._stats['max_flush_seconds'], elapsed)
+                    self._stats['total_flush_seconds'] += elapsed
+                if not ok:
+                    # Leave the rest for the next tick rather than hammering a failing database
+                    return
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._rows) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def queue_depth(self):
+        return len(self._rows)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._rows)
+        stats['avg_flush_seconds'] = stats['total_flush_seconds'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+
+    def close(self, timeout=10.0):
+        # Stop accepting rows and flush what is left
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self.flush()
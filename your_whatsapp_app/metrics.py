@@ -0,0 +1,226 @@
+# metrics.py
+# Latency histograms and counters for the hot paths, rendered in the
+# Prometheus text format by the /metrics route. Recording a sample is a dict
+# lookup, a bisect and a few additions under a per-series lock, so it stays on
+# in production.
+import bisect
+import contextvars
+import functools
+import inspect
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Conversation step of the message being handled, used as a label so we can
+# tell e.g. "book_appointment during select_time" from other calls. A context
+# variable, so it follows each request's thread or asyncio task.
+_current_step = contextvars.ContextVar("conversation_step", default="none")
+
+
+def set_step(step):
+    _current_step.set(step or "none")
+
+def current_step():
+    return _current_step.get()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {} # label tuple -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in items)
+        return lines
+
+
+DURATION = Histogram("whatsapp_app_duration_seconds", "Time spent per instrumented function")
+CALLS = CounterMetric("whatsapp_app_calls_total", "Calls per instrumented function and outcome")
+
+_collectors = []
+
+
+def register_collector(fn):
+    # fn() -> {name: value} of gauges read at scrape time (pool stats, queue
+    # depths, cache hit counts, ...). Names are prefixed with whatsapp_app_.
+    _collectors.append(fn)
+    return fn
+
+
+def timed(component, name=None):
+    # Decorator recording latency and outcome, labelled with the component
+    # (db, graph_api, handler, http), the function and the conversation step.
+    # Works on coroutine functions too, timing until the coroutine finishes.
+    def decorator(fn):
+        function = name or fn.__name__
+
+        def record(started, outcome):
+            step = _current_step.get()
+            DURATION.observe(time.perf_counter() - started, component=component, function=function, step=step)
+            CALLS.inc(component=component, function=function, step=step, outcome=outcome)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                outcome = "ok"
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    outcome = "error"
+                    raise
+                finally:
+                    record(started, outcome)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                record(started, outcome)
+        return wrapper
+    return decorator
+
+
+def render():
+    lines = DURATION.render() + CALLS.render()
+    for collector in _collectors:
+        try:
+            values = collector()
+        except Exception as e:
+            lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {_escape(e)}")
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            metric = f"whatsapp_app_{key}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    # Samples every thread's stack at `interval` seconds and counts collapsed
+    # stacks ("a;b;c 42"), the input format for flamegraph tools. Off by default;
+    # switched on and off at runtime through /debug/profiler.
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = threading.Event()
+        self.samples = 0
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def start(self, interval=None):
+        if interval:
+            self.interval = interval
+        if self.running:
+            return False
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while self._running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                    frame = frame.f_back
+                with self._lock:
+                    self._stacks[";".join(reversed(stack))] += 1
+            with self._lock:
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        with self._lock:
+            items = self._stacks.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in items) + "\n"
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,4 @@
+-- Availability and overlap checks filter appointments by service and a
+-- start_time range. This index serves them without touching the table rows.
+CREATE INDEX idx_appointments_service_start
+    ON appointments (service_id, start_time, end_time, status);
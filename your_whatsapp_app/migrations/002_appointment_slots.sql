@@ -0,0 +1,17 @@
+-- Slot reservations used by book_appointment (see booking.py). One row per
+-- booked slot and seat; the primary key is what prevents double-booking.
+-- Column types follow appointments.service_id / appointments.appointment_id.
+CREATE TABLE appointment_slots (
+    service_id      VARCHAR(36) NOT NULL,
+    slot_start      DATETIME    NOT NULL,
+    seat            SMALLINT    NOT NULL DEFAULT 0,
+    appointment_id  VARCHAR(36) NOT NULL,
+    PRIMARY KEY (service_id, slot_start, seat),
+    KEY idx_appointment_slots_appointment (appointment_id),
+    CONSTRAINT fk_appointment_slots_appointment
+        FOREIGN KEY (appointment_id) REFERENCES appointments (appointment_id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- Then reserve slots for upcoming appointments booked before this table existed:
+--   python booking.py
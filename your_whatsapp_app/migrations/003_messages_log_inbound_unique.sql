@@ -0,0 +1,8 @@
+-- Last line of defence against redelivered webhooks: an inbound WhatsApp
+-- message id can only be logged once. Status rows reuse the outbound message
+-- id (sent/delivered/read), so the key only covers inbound rows; NULLs never
+-- collide in a unique index. Remove any existing duplicate inbound rows first.
+ALTER TABLE messages_log
+    ADD COLUMN inbound_message_id VARCHAR(255)
+        AS (CASE WHEN direction = 'inbound' THEN whatsapp_message_id END) STORED,
+    ADD UNIQUE KEY uq_messages_log_inbound_message_id (inbound_message_id);
@@ -0,0 +1,23 @@
+-- Checkpoints for reminders.py: one row per campaign and appointment, claimed
+-- before the template goes out and marked sent (with the WhatsApp message id)
+-- or failed afterwards. A re-run skips everything that is claimed or sent, so
+-- a crashed campaign resumes without messaging anyone twice.
+CREATE TABLE reminder_sends (
+    campaign             VARCHAR(64)  NOT NULL,
+    appointment_id       VARCHAR(36)  NOT NULL,
+    status               VARCHAR(16)  NOT NULL, -- claimed | sent | failed
+    whatsapp_message_id  VARCHAR(255) NULL,
+    attempts             SMALLINT     NOT NULL DEFAULT 0,
+    claimed_at           DATETIME     NOT NULL,
+    finished_at          DATETIME     NULL,
+    PRIMARY KEY (campaign, appointment_id),
+    KEY idx_reminder_sends_appointment (appointment_id),
+    CONSTRAINT fk_reminder_sends_appointment
+        FOREIGN KEY (appointment_id) REFERENCES appointments (appointment_id)
+        ON DELETE CASCADE
+) ENGINE=InnoDB;
+
+-- The campaign walks one day of appointments across all services in
+-- (start_time, appointment_id) order, a page at a time.
+CREATE INDEX idx_appointments_start
+    ON appointments (start_time, appointment_id);
@@ -0,0 +1,6 @@
+-- "View My Appointments" pages through one customer's appointments in
+-- (start_time, appointment_id) order, continuing after the last row shown
+-- instead of using OFFSET. With this index each page is a short range scan
+-- however long the customer's history is.
+CREATE INDEX idx_appointments_customer_start
+    ON appointments (customer_id, start_time, appointment_id);
@@ -0,0 +1,13 @@
+-- Latest delivery status of each outbound message, kept on its messages_log
+-- row instead of a new row per status callback (see delivery_status.py).
+-- delivery_status_rank (sent 1, delivered 2, read 3, failed 4) only ever
+-- goes up, so a late "delivered" can't overwrite "read". The index serves
+-- the batched lookups and updates by whatsapp_message_id.
+ALTER TABLE messages_log
+    ADD COLUMN delivery_status VARCHAR(16) NULL,
+    ADD COLUMN delivery_status_rank TINYINT NOT NULL DEFAULT 0,
+    ADD COLUMN delivery_status_at DATETIME NULL,
+    ADD KEY idx_messages_log_message_id (whatsapp_message_id);
+
+-- Old per-status rows are no longer written; clear them out once deployed:
+--   DELETE FROM messages_log WHERE direction = 'outbound_status_update';
@@ -0,0 +1,16 @@
+-- Raw webhook / Graph API bodies, stored once per distinct content instead of
+-- on every messages_log row (see payload_store.py). payload_hash is the
+-- SHA-256 of the canonical JSON (sorted keys, no whitespace) and the body is
+-- zlib-compressed. New messages_log rows set payload_hash and leave
+-- raw_json_payload NULL; rows written before this migration keep theirs.
+CREATE TABLE webhook_payloads (
+    payload_hash BINARY(32) NOT NULL PRIMARY KEY,
+    compressed_payload MEDIUMBLOB NOT NULL,
+    original_bytes INT UNSIGNED NOT NULL,
+    stored_bytes INT UNSIGNED NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE messages_log
+    ADD COLUMN payload_hash BINARY(32) NULL,
+    ADD KEY idx_messages_log_payload_hash (payload_hash);
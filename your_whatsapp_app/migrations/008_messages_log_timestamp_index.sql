@@ -0,0 +1,13 @@
+-- retention.py archives and deletes whole months of messages_log, reading
+-- each month in (timestamp, message_log_id) order a chunk at a time; this
+-- index makes every chunk a short range scan (payload_store.py's export
+-- walks the same order). appointments is already covered by
+-- idx_appointments_start (migrations/004).
+--
+-- Rows are moved out rather than the tables being PARTITIONed by month:
+-- partitioned InnoDB tables can't have foreign keys (appointment_slots and
+-- reminder_sends reference appointments), and every unique key would have to
+-- include the month column, which rules out the message_log_id /
+-- appointment_id primary keys and the inbound message id key of migration 003.
+CREATE INDEX idx_messages_log_timestamp
+    ON messages_log (timestamp, message_log_id);
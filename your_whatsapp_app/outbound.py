@@ -0,0 +1,112 @@
+# outbound.py
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+from config import OUTBOUND_WORKERS, OUTBOUND_QUEUE_SIZE
+from whatsapp_api import build_message_payload, build_template_payload, post_message
+from workers import KeyedWorkerPool
+
+log = logging.getLogger(__name__)
+
+
+class OutboundQueueFull(Exception):
+    pass
+
+
+def build_payloads(to_number, messages):
+    return [
+        m if isinstance(m, dict) else build_message_payload(to_number, m[0], m[1])
+        for m in messages
+    ]
+
+def send_payloads(to_number, payloads, stop_on_failure=True):
+    # Sends on the calling thread; returns the message ids (None = not sent)
+    ids = []
+    for payload in payloads:
+        if stop_on_failure and ids and ids[-1] is None:
+            # Don't send "anything else?" if the confirmation never went out
+            ids.append(None)
+            continue
+        ids.append(post_message(payload, f"{payload.get('type')} message to {to_number}"))
+    return ids
+
+
+class OutboundDispatcher:
+    # Sends messages off the request thread. Everything submitted for one
+    # recipient goes through the same worker, so batches and consecutive
+    # submissions arrive in order; different recipients are sent concurrently.
+    # Rate limiting and retries happen inside whatsapp_api.post_message.
+
+    def __init__(self, num_workers=OUTBOUND_WORKERS, queue_size=OUTBOUND_QUEUE_SIZE):
+        self._pool = KeyedWorkerPool(num_workers, queue_size, name="outbound")
+
+    def send_batch(self, to_number, messages, stop_on_failure=True):
+        # messages: list of (message_body, message_type) tuples, or payload
+        # dicts built with build_message_payload/build_template_payload.
+        # Returns a Future resolving to the list of message ids (None for a
+        # failed or skipped message).
+        payloads = build_payloads(to_number, messages)
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            future.set_result(send_payloads(to_number, payloads, stop_on_failure))
+
+        if not self._pool.submit(to_number, run):
+            future.set_exception(OutboundQueueFull(f"Outbound queue full, dropped {len(payloads)} message(s) to {to_number}"))
+        return future
+
+    def send(self, to_number, message_body, message_type="text"):
+        return self.send_batch(to_number, [(message_body, message_type)])
+
+    def send_template(self, to_number, template_name, components=None, language_code="en_US"):
+        payload = build_template_payload(to_number, template_name, components, language_code)
+        return self.send_batch(to_number, [payload])
+
+    def stats(self):
+        return self._pool.stats()
+
+    def shutdown(self, timeout=30.0):
+        return self._pool.shutdown(timeout)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = OutboundDispatcher()
+    return _dispatcher
+
+def shutdown_dispatcher():
+    global _dispatcher
+    dispatcher, _dispatcher = _dispatcher, None
+    if dispatcher is not None:
+        dispatcher.shutdown()
+
+# Registered at import so it runs after the webhook queue has drained (atexit is LIFO)
+atexit.register(shutdown_dispatcher)
+
+def send_batch(to_number, messages):
+    return get_dispatcher().send_batch(to_number, messages)
+
+def send_batch_or_inline(to_number, messages):
+    # For messages the customer must get (booking confirmations): when the
+    # queue is full the batch is sent on the calling thread instead of being
+    # dropped. Always returns a Future, like send_batch.
+    future = send_batch(to_number, messages)
+    if future.done() and isinstance(future.exception(), OutboundQueueFull):
+        log.warning("Outbound queue full, sending %d message(s) to %s inline", len(messages), to_number)
+        future = Future()
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(send_payloads(to_number, build_payloads(to_number, messages)))
+        except Exception as e:
+            future.set_exception(e)
+    return future
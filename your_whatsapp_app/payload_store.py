@@ -0,0 +1,196 @@
+# payload_store.py
+# Raw webhook / API bodies are stored once per distinct content in
+# webhook_payloads (migrations/007), zlib-compressed and keyed by the SHA-256
+# of their canonical JSON; messages_log rows only carry that hash. A webhook
+# carrying several messages used to be written out in full for every one.
+#   python payload_store.py show <hex hash>
+#   python payload_store.py export --since 2026-10-01 --until 2026-10-02 > payloads.jsonl
+import hashlib
+import json
+import threading
+import zlib
+
+from config import PAYLOAD_STORE_COMPRESSION_LEVEL
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+def canonical_json(payload):
+    # Same content -> same bytes -> same hash, whatever the key order was.
+    # Strings (and bytes) holding JSON are taken as already serialised and
+    # stored as they are; anything else in one, such as an HTML error page, is
+    # stored as a JSON string, so every stored body parses back with
+    # load_payload and embeds as-is in an export line.
+    if isinstance(payload, (str, bytes)):
+        try:
+            json.loads(payload)
+        except ValueError:
+            text = payload if isinstance(payload, str) else payload.decode("utf-8", "replace")
+            return json.dumps(text, ensure_ascii=False).encode("utf-8")
+        return payload if isinstance(payload, bytes) else payload.encode("utf-8")
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def payload_hash(raw):
+    return hashlib.sha256(raw).digest()
+
+
+class PayloadStore:
+    # Turns the payloads of a batch of log rows into hashes plus the
+    # webhook_payloads rows to write with them, one per distinct body in the
+    # batch. Every batch writes its payload rows, even for bodies stored
+    # before (ON DUPLICATE KEY keeps the existing row): a hash is never
+    # assumed to be in MySQL already, because retention.py deletes payloads
+    # whose log rows it has archived, and a log row pointing at one of those
+    # would have nothing to load.
+
+    def __init__(self, compression_level=PAYLOAD_STORE_COMPRESSION_LEVEL):
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._stats = {
+            'payloads': 0, 'unique_in_batch': 0, 'stored': 0,
+            'raw_bytes': 0, 'stored_bytes': 0,
+        }
+
+    def prepare(self, payloads):
+        # -> ([hash or None per payload], [(hash, compressed, raw_size, stored_size), ...])
+        # Rows of one webhook share the same dict, so each object is encoded once
+        hashes = []
+        new_rows = {}
+        encoded = {} # id(payload) -> hash
+        counts = {'payloads': 0, 'unique_in_batch': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        for payload in payloads:
+            if payload is None:
+                hashes.append(None)
+                continue
+            counts['payloads'] += 1
+            digest = encoded.get(id(payload))
+            if digest is None:
+                raw = canonical_json(payload)
+                digest = payload_hash(raw)
+                encoded[id(payload)] = digest
+                if digest not in new_rows:
+                    counts['unique_in_batch'] += 1
+                    compressed = zlib.compress(raw, self.compression_level)
+                    new_rows[digest] = (digest, compressed, len(raw), len(compressed))
+                    counts['raw_bytes'] += len(raw)
+                    counts['stored_bytes'] += len(compressed)
+            hashes.append(digest)
+        with self._lock:
+            for key, value in counts.items():
+                self._stats[key] += value
+        return hashes, list(new_rows.values())
+
+    def mark_stored(self, rows):
+        # Only after the transaction that wrote them committed
+        with self._lock:
+            self._stats['stored'] += len(rows)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['compression_ratio'] = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 0.0
+        return stats
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_payload_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PayloadStore()
+    return _store
+
+
+# --- Reading payloads back ---
+def iter_decompressed(compressed, chunk_size=READ_CHUNK_BYTES):
+    # Yields the original bytes piece by piece, without holding the whole
+    # decompressed body in memory
+    decompressor = zlib.decompressobj()
+    view = memoryview(compressed)
+    for offset in range(0, len(view), chunk_size):
+        data = decompressor.decompress(view[offset:offset + chunk_size], chunk_size)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, chunk_size) if decompressor.unconsumed_tail else b""
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+def stream_payload(digest, chunk_size=READ_CHUNK_BYTES):
+    # Chunks of the stored JSON for one hash (bytes, or hex string); nothing if unknown
+    from database import get_db_connection
+    if isinstance(digest, str):
+        digest = bytes.fromhex(digest)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT compressed_payload FROM webhook_payloads WHERE payload_hash = %s", (digest,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+    if row:
+        yield from iter_decompressed(bytes(row[0]), chunk_size)
+
+def load_payload(digest):
+    raw = b"".join(stream_payload(digest))
+    return json.loads(raw) if raw else None
+
+def iter_logged_payloads(since, until, page_size=500):
+    # (message_log_id, whatsapp_message_id, direction, timestamp, payload bytes)
+    # for messages_log rows in [since, until), a keyset page at a time
+    from database import get_db_connection
+    after_timestamp, after_id = since, ''
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """
+                    SELECT m.message_log_id, m.whatsapp_message_id, m.direction, m.timestamp, p.compressed_payload
+                    FROM messages_log m JOIN webhook_payloads p ON p.payload_hash = m.payload_hash
+                    WHERE m.timestamp >= %s AND m.timestamp < %s
+                    AND (m.timestamp > %s OR (m.timestamp = %s AND m.message_log_id > %s))
+                    ORDER BY m.timestamp, m.message_log_id
+                    LIMIT %s
+                    """,
+                    (since, until, after_timestamp, after_timestamp, after_id, page_size)
+                )
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        for message_log_id, message_id, direction, timestamp, compressed in rows:
+            yield message_log_id, message_id, direction, timestamp, b"".join(iter_decompressed(bytes(compressed)))
+        if len(rows) < page_size:
+            return
+        after_timestamp, after_id = rows[-1][3], rows[-1][0]
+
+
+if __name__ == '__main__':
+    import argparse
+    import datetime
+    import sys
+
+    parser = argparse.ArgumentParser(description="Read stored webhook payloads")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print one payload by hash")
+    show.add_argument("hash")
+    export = commands.add_parser("export", help="JSON lines of logged messages with their payloads")
+    export.add_argument("--since", type=datetime.datetime.fromisoformat, required=True)
+    export.add_argument("--until", type=datetime.datetime.fromisoformat, required=True)
+    args = parser.parse_args()
+
+    out = sys.stdout.buffer
+    if args.command == "show":
+        for chunk in stream_payload(args.hash):
+            out.write(chunk)
+        out.write(b"\n")
+    else:
+        for message_log_id, message_id, direction, timestamp, raw in iter_logged_payloads(args.since, args.until):
+            header = json.dumps({
+                "message_log_id": message_log_id, "whatsapp_message_id": message_id,
+                "direction": direction, "timestamp": timestamp.isoformat(),
+            })
+            out.write(header[:-1].encode("utf-8") + b',"payload":' + raw + b"}\n")
@@ -0,0 +1,313 @@
+# reminders.py
+# Sends the reminder template for one day's appointments (tomorrow by default).
+#   python reminders.py
+#   python reminders.py --date 2026-10-18 --rate 40
+#   python reminders.py --dry-run                        # real appointments, local Graph API stub, no checkpoints or log rows
+#   python reminders.py --dry-run --fake-appointments 5000   # no database either
+# Appointments are streamed from MySQL a page at a time, sends run
+# concurrently through an outbound dispatcher within a messages-per-second
+# budget, and every send is checkpointed in reminder_sends (migrations/004):
+# claimed before it goes out, then marked sent with its WhatsApp message id
+# or failed. Re-running the same campaign picks up where a crashed run
+# stopped; failed sends are retried, claimed ones are not (we can't tell
+# whether they went out) unless --resend-unconfirmed is given. That makes a
+# lost result write expensive, so it is retried, and the worker count is kept
+# within what the connection pool can serve alongside the page reader.
+import argparse
+import datetime
+import logging
+import threading
+import time
+from collections import Counter
+
+from config import (
+    REMINDER_TEMPLATE_NAME, REMINDER_TEMPLATE_LANGUAGE, REMINDER_RATE_PER_SECOND,
+    REMINDER_WORKERS, REMINDER_MAX_IN_FLIGHT, REMINDER_PAGE_SIZE, LOG_OUTBOUND_MESSAGES
+)
+from database import get_db_connection, get_pool, transaction, log_outbound_message
+from outbound import OutboundDispatcher
+from rate_limit import TokenBucket
+from whatsapp_api import build_template_payload, on_message_sent
+
+log = logging.getLogger(__name__)
+
+# A result write that fails is retried this many times, backing off from
+# CHECKPOINT_BACKOFF_SECONDS, then once more after the last send
+CHECKPOINT_ATTEMPTS = 3
+CHECKPOINT_BACKOFF_SECONDS = 0.5
+# Connections the campaign holds besides its workers': the page being read,
+# the next claim, and the log writer's
+RESERVED_CONNECTIONS = 3
+
+
+def campaign_name(template_name, day):
+    return f"{template_name}:{day:%Y-%m-%d}"
+
+def iter_due_appointments(campaign, day, page_size=REMINDER_PAGE_SIZE, retry_statuses=('failed',)):
+    # Yields (appointment_id, start_time, phone, customer_name, service_name)
+    # for the day's active appointments that this campaign hasn't handled yet,
+    # in (start_time, appointment_id) order. Each page is read through an
+    # unbuffered cursor, so rows come off the socket as we send instead of
+    # being materialised with fetchall(); LIMIT keeps any one result set short
+    # enough that a slow send rate never leaves it open for long.
+    range_start = datetime.datetime.combine(day, datetime.time.min)
+    range_end = range_start + datetime.timedelta(days=1)
+    status_placeholders = ", ".join(["%s"] * len(retry_statuses))
+    query = f"""
+        SELECT a.appointment_id, a.start_time, c.whatsapp_phone_number, c.name, s.name
+        FROM appointments a
+        JOIN customers c ON c.customer_id = a.customer_id
+        JOIN services s ON s.service_id = a.service_id
+        LEFT JOIN reminder_sends r ON r.campaign = %s AND r.appointment_id = a.appointment_id
+        WHERE a.start_time >= %s AND a.start_time < %s
+        AND (a.start_time > %s OR (a.start_time = %s AND a.appointment_id > %s))
+        AND a.status IN ('pending', 'confirmed')
+        AND (r.status IS NULL OR r.status IN ({status_placeholders}))
+        ORDER BY a.start_time, a.appointment_id
+        LIMIT %s
+    """
+    after_start, after_id = range_start, ''
+    while True:
+        conn = get_db_connection()
+        cursor = None
+        exhausted = False
+        rows = 0
+        try:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(query, (campaign, range_start, range_end, after_start, after_start, after_id,
+                                   *retry_statuses, page_size))
+            while True:
+                chunk = cursor.fetchmany(100)
+                if not chunk:
+                    break
+                for row in chunk:
+                    rows += 1
+                    after_start, after_id = row[1], row[0]
+                    yield row
+            exhausted = True
+        finally:
+            if cursor is not None:
+                cursor.close()
+            if exhausted:
+                conn.close()
+            else:
+                # Unread rows are still on the wire; don't hand this connection out again
+                conn.invalidate()
+        if rows < page_size:
+            return
+
+def claim(campaign, appointment_id, retry_statuses=('failed',)):
+    # True if this run may send the reminder: no row yet, or the previous
+    # attempt ended in one of retry_statuses. ON DUPLICATE KEY UPDATE reports
+    # 1 for an insert, 2 for a changed row and 0 when it left the row alone
+    # (another run has it). `status` is assigned last because MySQL applies
+    # the assignments in order.
+    claimable = ", ".join(f"'{status}'" for status in retry_statuses)
+    with transaction() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO reminder_sends (campaign, appointment_id, status, attempts, claimed_at)
+            VALUES (%s, %s, 'claimed', 1, %s)
+            ON DUPLICATE KEY UPDATE
+                attempts = IF(status IN ({claimable}), attempts + 1, attempts),
+                claimed_at = IF(status IN ({claimable}), VALUES(claimed_at), claimed_at),
+                status = IF(status IN ({claimable}), 'claimed', status)
+            """,
+            (campaign, appointment_id, datetime.datetime.now())
+        )
+        return cursor.rowcount > 0
+
+def record_result(campaign, appointment_id, message_id):
+    with transaction() as cursor:
+        cursor.execute(
+            "UPDATE reminder_sends SET status = %s, whatsapp_message_id = %s, finished_at = %s WHERE campaign = %s AND appointment_id = %s",
+            ('sent' if message_id else 'failed', message_id, datetime.datetime.now(), campaign, appointment_id)
+        )
+
+def max_workers(workers, pool_size):
+    # Every worker checks out a connection to record its result; more workers
+    # than the pool has left over just queue for one and risk PoolTimeoutError
+    return max(1, min(workers, pool_size - RESERVED_CONNECTIONS))
+
+def reminder_components(customer_name, service_name, start_time):
+    # Body parameters {{1}}..{{4}} of the approved reminder template
+    values = [customer_name or "there", service_name, start_time.strftime("%A %d %B"), start_time.strftime("%H:%M")]
+    return [{"type": "body", "parameters": [{"type": "text", "text": str(v)} for v in values]}]
+
+
+class ReminderCampaign:
+    # One pass over a day's appointments. run() returns a dict of outcome counts.
+
+    def __init__(self, day, template_name=REMINDER_TEMPLATE_NAME, language_code=REMINDER_TEMPLATE_LANGUAGE,
+                 rate=REMINDER_RATE_PER_SECOND, workers=REMINDER_WORKERS, max_in_flight=REMINDER_MAX_IN_FLIGHT,
+                 page_size=REMINDER_PAGE_SIZE, dry_run=False, resend_unconfirmed=False):
+        self.day = day
+        self.campaign = campaign_name(template_name, day)
+        self.template_name = template_name
+        self.language_code = language_code
+        self.page_size = page_size
+        self.dry_run = dry_run
+        self.retry_statuses = ('failed', 'claimed') if resend_unconfirmed else ('failed',)
+        self.max_in_flight = max_in_flight
+        if not dry_run:
+            pool_size = get_pool().size
+            if max_workers(workers, pool_size) < workers:
+                log.warning("Reminder workers capped at %d to fit a connection pool of %d; raise DB_POOL_SIZE for more",
+                            max_workers(workers, pool_size), pool_size)
+                workers = max_workers(workers, pool_size)
+        self._limiter = TokenBucket(rate)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        # Queue never fills: at most max_in_flight sends are outstanding
+        self._dispatcher = OutboundDispatcher(num_workers=workers, queue_size=max_in_flight)
+        self._stats = Counter()
+        self._lock = threading.Lock()
+        # (appointment_id, message_id) whose result write failed every retry
+        self._unrecorded = []
+
+    def _count(self, key):
+        # -> the new count, read under the same lock the workers update it with
+        with self._lock:
+            self._stats[key] += 1
+            return self._stats[key]
+
+    def run(self):
+        started = time.monotonic()
+        for appointment_id, start_time, phone, customer_name, service_name in iter_due_appointments(
+                self.campaign, self.day, self.page_size, self.retry_statuses):
+            due = self._count('due')
+            if not self.dry_run and not claim(self.campaign, appointment_id, self.retry_statuses):
+                self._count('skipped_claimed_elsewhere')
+                continue
+            self._in_flight.acquire()
+            self._limiter.acquire()
+            payload = build_template_payload(
+                phone, self.template_name, reminder_components(customer_name, service_name, start_time), self.language_code)
+            future = self._dispatcher.send_batch(phone, [payload])
+            future.add_done_callback(lambda f, appointment_id=appointment_id: self._finished(appointment_id, f))
+            if due % 500 == 0:
+                log.info("Reminder campaign progress", extra={'campaign': self.campaign, **self.stats()})
+
+        # Wait for the last sends by taking every in-flight permit back
+        for _ in range(self.max_in_flight):
+            self._in_flight.acquire()
+        self._dispatcher.shutdown()
+        self._record_unrecorded()
+        stats = self.stats()
+        stats['seconds'] = round(time.monotonic() - started, 2)
+        log.info("Reminder campaign finished", extra={'campaign': self.campaign, **stats})
+        return stats
+
+    def _finished(self, appointment_id, future):
+        try:
+            message_id = None if future.exception() else future.result()[0]
+            self._count('sent' if message_id else 'failed')
+            if not self.dry_run and not self._record(appointment_id, message_id):
+                with self._lock:
+                    self._unrecorded.append((appointment_id, message_id))
+        finally:
+            self._in_flight.release()
+
+    def _record(self, appointment_id, message_id, attempts=CHECKPOINT_ATTEMPTS):
+        # -> True once record_result succeeded
+        for attempt in range(attempts):
+            try:
+                record_result(self.campaign, appointment_id, message_id)
+                return True
+            except Exception as e:
+                log.warning("Error recording reminder for %s (attempt %d): %s", appointment_id, attempt + 1, e)
+                if attempt + 1 < attempts:
+                    time.sleep(CHECKPOINT_BACKOFF_SECONDS * (2 ** attempt))
+        return False
+
+    def _record_unrecorded(self):
+        # Last try once every send is done and the pool is quiet. What still
+        # fails stays 'claimed', so a re-run won't send it again by itself:
+        # logged with its message id for --resend-unconfirmed or a manual fix
+        for appointment_id, message_id in self._unrecorded:
+            if not self._record(appointment_id, message_id, attempts=1):
+                self._count('checkpoint_errors')
+                log.error("Reminder result for %s was never recorded (message id %s)", appointment_id, message_id)
+        self._unrecorded = []
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def seed_fake_appointments(fake_db, day, count):
+    # Spreads `count` confirmed appointments over the day's opening hours
+    import random
+    import uuid
+    rng = random.Random(day.toordinal())
+    services = list(fake_db.services.values())
+    for i in range(count):
+        phone = f"2772{i:07d}"
+        customer_id = str(uuid.uuid4())
+        fake_db.customers[phone] = customer_id
+        fake_db.customer_names[customer_id] = f"Customer {i}"
+        service = rng.choice(services)
+        start = datetime.datetime.combine(day, datetime.time(9)) + datetime.timedelta(minutes=15 * rng.randrange(32))
+        appointment_id = str(uuid.uuid4())
+        fake_db.appointments[appointment_id] = {
+            'appointment_id': appointment_id, 'customer_id': customer_id, 'service_id': service['service_id'],
+            'start_time': start, 'end_time': start + datetime.timedelta(minutes=service['duration_minutes']),
+            'status': 'confirmed', 'whatsapp_conversation_id': None, 'confirmation_message_id': None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send appointment reminder templates")
+    parser.add_argument("--date", type=datetime.date.fromisoformat,
+                        default=datetime.date.today() + datetime.timedelta(days=1),
+                        help="day whose appointments get a reminder (default: tomorrow)")
+    parser.add_argument("--template", default=REMINDER_TEMPLATE_NAME)
+    parser.add_argument("--language", default=REMINDER_TEMPLATE_LANGUAGE)
+    parser.add_argument("--rate", type=float, default=REMINDER_RATE_PER_SECOND, help="messages per second")
+    parser.add_argument("--workers", type=int, default=REMINDER_WORKERS)
+    parser.add_argument("--max-in-flight", type=int, default=REMINDER_MAX_IN_FLIGHT)
+    parser.add_argument("--page-size", type=int, default=REMINDER_PAGE_SIZE)
+    parser.add_argument("--resend-unconfirmed", action="store_true",
+                        help="also resend reminders a crashed run claimed but never confirmed")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="send to a local Graph API stub and write no checkpoints or messages_log rows")
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--fake-appointments", type=int, default=0,
+                        help="with --dry-run: use an in-memory database seeded with this many appointments")
+    args = parser.parse_args()
+
+    from structured_log import configure_logging
+    configure_logging()
+
+    stub = fake_db = None
+    if LOG_OUTBOUND_MESSAGES and not args.dry_run:
+        # A dry run sends to a stub; its made-up message ids stay out of messages_log
+        on_message_sent(log_outbound_message)
+    if args.dry_run:
+        import whatsapp_api
+        from stub_graph_api import StubGraphAPI
+        stub = StubGraphAPI(latency_ms=args.stub_latency_ms).start()
+        whatsapp_api.WHATSAPP_API_URL = stub.url
+        if args.fake_appointments:
+            import fake_mysql
+            fake_db = fake_mysql.install(fake_mysql.FakeDatabase(), pool_size=args.workers + RESERVED_CONNECTIONS)
+            seed_fake_appointments(fake_db, args.date, args.fake_appointments)
+
+    campaign = ReminderCampaign(
+        args.date, args.template, args.language, rate=args.rate, workers=args.workers,
+        max_in_flight=args.max_in_flight, page_size=args.page_size,
+        # Checkpoints are only safe to write when the sends were real (or the database is fake)
+        dry_run=args.dry_run and fake_db is None, resend_unconfirmed=args.resend_unconfirmed,
+    )
+    stats = campaign.run()
+    print(f"campaign {campaign.campaign}: {stats}")
+    if stats.get('seconds'):
+        print(f"send rate: {stats.get('sent', 0) / stats['seconds']:.1f} messages/s (budget {args.rate:g}/s)")
+    if stub:
+        stub.stop()
+        print(f"stub Graph API received {sum(stub.counts.values())} calls {stub.counts}")
+    if fake_db:
+        print(f"reminder_sends: {Counter(row['status'] for row in fake_db.reminder_sends.values())}")
+
+
+if __name__ == '__main__':
+    main()
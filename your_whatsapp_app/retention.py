@@ -0,0 +1,477 @@
+# retention.py
+# Keeps messages_log and appointments small. Whole calendar months older than
+# a table's retention window are streamed out of MySQL a keyset chunk at a
+# time into gzipped JSON lines under RETENTION_ARCHIVE_DIR, then deleted, so
+# the hot tables (and every index range scan over them) only hold recent
+# months however long the app has been running.
+#   python retention.py status
+#   python retention.py archive                                  # every month past its retention
+#   python retention.py archive --table messages_log --month 2026-03
+#   python retention.py restore --table appointments --month 2026-03
+# Each run of a month writes one part file:
+#   <RETENTION_ARCHIVE_DIR>/<table>/<YYYY-MM>/part-<timestamp>.jsonl.gz
+# It is written as .partial, fsynced and renamed, then read back in full and
+# checked against the row count written before anything is deleted (a part
+# that fails the check is renamed *.rejected and its rows stay in MySQL).
+# The purge deletes exactly the rows the file holds (read back from it), so
+# rows written to the month meanwhile are never lost. Re-running a month
+# after a crash just writes another part with whatever is still in MySQL;
+# restore inserts with ON DUPLICATE KEY, so overlapping parts are harmless.
+# See migrations/008 for why this moves rows rather than using partitioning.
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import os
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter
+
+from config import (
+    RETENTION_ARCHIVE_DIR, RETENTION_MESSAGES_LOG_MONTHS, RETENTION_APPOINTMENTS_MONTHS,
+    RETENTION_CHUNK_SIZE, RETENTION_CHUNK_PAUSE_SECONDS, PAYLOAD_STORE_COMPRESSION_LEVEL
+)
+from database import transaction
+from payload_store import iter_decompressed
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_COMPRESSION_LEVEL = 6
+RESTORED_SUFFIX = ".restored"
+REJECTED_SUFFIX = ".rejected"
+
+
+# --- Months ---
+def month_start(moment):
+    return datetime.datetime(moment.year, moment.month, 1)
+
+def add_months(start, months):
+    index = start.year * 12 + start.month - 1 + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+def parse_month(text):
+    return datetime.datetime.strptime(text, "%Y-%m")
+
+def chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+# --- Tables ---
+class ArchivedTable(ABC):
+    # What retention needs to know about one table: the column that dates a
+    # row, its key (the keyset is (time_column, key)), and how a chunk of rows
+    # is read, deleted and put back. Records are the JSON-ready dicts written
+    # to the archive, one per line.
+    name = None
+    key = None
+    time_column = None
+    columns = ()
+    datetime_columns = ()
+    retention_months = 0
+
+    def __init__(self):
+        missing = [attr for attr in ('name', 'key', 'time_column', 'columns') if not getattr(self, attr)]
+        if missing:
+            raise TypeError(f"{type(self).__name__} must set {', '.join(missing)}")
+
+    @abstractmethod
+    def fetch_chunk(self, cursor, start, end, after, limit):
+        pass
+
+    @abstractmethod
+    def delete_chunk(self, cursor, records):
+        # -> Counter of what was deleted
+        pass
+
+    @abstractmethod
+    def restore_chunk(self, cursor, records):
+        # -> Counter of what was inserted
+        pass
+
+    def encode(self, row):
+        record = {column: row[column] for column in self.columns}
+        for column in self.datetime_columns:
+            if record[column] is not None:
+                record[column] = record[column].isoformat()
+        return record
+
+    def decode(self, record):
+        row = dict(record)
+        for column in self.datetime_columns:
+            if row.get(column) is not None:
+                row[column] = datetime.datetime.fromisoformat(row[column])
+        return row
+
+    def hot_stats(self, cursor):
+        cursor.execute(f"SELECT COUNT(*), MIN({self.time_column}) FROM {self.name}")
+        return cursor.fetchone()
+
+    def keyset_query(self, select, alias=""):
+        # The month's rows after (time, key), in keyset order
+        time_column, key = f"{alias}{self.time_column}", f"{alias}{self.key}"
+        return f"""
+            {select}
+            WHERE {time_column} >= %s AND {time_column} < %s
+            AND ({time_column} > %s OR ({time_column} = %s AND {key} > %s))
+            ORDER BY {time_column}, {key}
+            LIMIT %s
+        """
+
+    def insert_rows(self, cursor, table, columns, rows, on_duplicate):
+        if not rows:
+            return 0
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ", ".join([f"({placeholders(columns)})"] * len(rows))
+            + f" ON DUPLICATE KEY UPDATE {on_duplicate} = {on_duplicate}",
+            [row[column] for row in rows for column in columns]
+        )
+        return cursor.rowcount # rows already there count 0
+
+
+class MessagesLogTable(ArchivedTable):
+    # Each row carries its payload decompressed ("payload", the stored JSON
+    # text), so an archive reads on its own. Payloads no longer referenced by
+    # any log row are deleted with the rows. That can't strand a row the app
+    # is writing meanwhile: every batch writes the payloads it references
+    # (see payload_store.py), and the delete and that insert take the same
+    # webhook_payloads row lock, so the payload either survives the purge or
+    # is written again after it.
+    name = "messages_log"
+    key = "message_log_id"
+    time_column = "timestamp"
+    columns = ('message_log_id', 'whatsapp_message_id', 'direction', 'customer_id', 'timestamp', 'message_content',
+               'raw_json_payload', 'payload_hash', 'delivery_status', 'delivery_status_rank', 'delivery_status_at')
+    datetime_columns = ('timestamp', 'delivery_status_at')
+    retention_months = RETENTION_MESSAGES_LOG_MONTHS
+
+    def fetch_chunk(self, cursor, start, end, after, limit):
+        cursor.execute(
+            self.keyset_query(
+                "SELECT " + ", ".join(f"m.{column}" for column in self.columns) + ", p.compressed_payload "
+                "FROM messages_log m LEFT JOIN webhook_payloads p ON p.payload_hash = m.payload_hash",
+                alias="m."),
+            (start, end, after[0], after[0], after[1], limit)
+        )
+        return cursor.fetchall()
+
+    def encode(self, row):
+        record = super().encode(row)
+        if record['payload_hash'] is not None:
+            record['payload_hash'] = bytes(record['payload_hash']).hex()
+        compressed = row['compressed_payload']
+        record['payload'] = b"".join(iter_decompressed(bytes(compressed))).decode("utf-8") if compressed else None
+        return record
+
+    def decode(self, record):
+        row = super().decode(record)
+        if row['payload_hash'] is not None:
+            row['payload_hash'] = bytes.fromhex(row['payload_hash'])
+        return row
+
+    def delete_chunk(self, cursor, records):
+        ids = [record['message_log_id'] for record in records]
+        cursor.execute(f"DELETE FROM messages_log WHERE message_log_id IN ({placeholders(ids)})", ids)
+        deleted = Counter(rows=cursor.rowcount)
+        hashes = list({bytes.fromhex(record['payload_hash']) for record in records if record['payload_hash']})
+        if hashes:
+            cursor.execute(
+                f"""
+                DELETE FROM webhook_payloads WHERE payload_hash IN ({placeholders(hashes)})
+                AND NOT EXISTS (SELECT 1 FROM messages_log m WHERE m.payload_hash = webhook_payloads.payload_hash)
+                """,
+                hashes
+            )
+            deleted['payloads'] = cursor.rowcount
+        return deleted
+
+    def restore_chunk(self, cursor, records):
+        payloads = {}
+        for row in records:
+            if row['payload_hash'] is not None and row['payload'] is not None:
+                raw = row['payload'].encode("utf-8")
+                compressed = zlib.compress(raw, PAYLOAD_STORE_COMPRESSION_LEVEL)
+                payloads[row['payload_hash']] = {'payload_hash': row['payload_hash'], 'compressed_payload': compressed,
+                                                 'original_bytes': len(raw), 'stored_bytes': len(compressed)}
+        restored = Counter()
+        restored['payloads'] = self.insert_rows(
+            cursor, "webhook_payloads", ('payload_hash', 'compressed_payload', 'original_bytes', 'stored_bytes'),
+            list(payloads.values()), "payload_hash")
+        restored['rows'] = self.insert_rows(cursor, "messages_log", self.columns, records, "message_log_id")
+        return restored
+
+
+class AppointmentsTable(ArchivedTable):
+    # Each appointment carries its reminder_sends rows. Its appointment_slots
+    # go with it and aren't restored: archived months are long past, and slots
+    # only matter for what can still be booked (see booking.backfill_slots).
+    name = "appointments"
+    key = "appointment_id"
+    time_column = "start_time"
+    columns = ('appointment_id', 'customer_id', 'service_id', 'start_time', 'end_time', 'status',
+               'whatsapp_conversation_id', 'confirmation_message_id')
+    datetime_columns = ('start_time', 'end_time')
+    retention_months = RETENTION_APPOINTMENTS_MONTHS
+    reminder_columns = ('campaign', 'appointment_id', 'status', 'whatsapp_message_id', 'attempts', 'claimed_at', 'finished_at')
+    reminder_datetime_columns = ('claimed_at', 'finished_at')
+
+    def fetch_chunk(self, cursor, start, end, after, limit):
+        cursor.execute(
+            self.keyset_query(f"SELECT {', '.join(self.columns)} FROM appointments"),
+            (start, end, after[0], after[0], after[1], limit)
+        )
+        rows = cursor.fetchall()
+        for row in rows:
+            row['reminder_sends'] = []
+        if rows:
+            by_id = {row['appointment_id']: row for row in rows}
+            ids = list(by_id)
+            cursor.execute(
+                f"SELECT {', '.join(self.reminder_columns)} FROM reminder_sends WHERE appointment_id IN ({placeholders(ids)})",
+                ids
+            )
+            for reminder in cursor.fetchall():
+                by_id[reminder['appointment_id']]['reminder_sends'].append(reminder)
+        return rows
+
+    def encode(self, row):
+        record = super().encode(row)
+        record['reminder_sends'] = [
+            {column: value.isoformat() if column in self.reminder_datetime_columns and value is not None else value
+             for column, value in reminder.items()}
+            for reminder in row['reminder_sends']
+        ]
+        return record
+
+    def decode(self, record):
+        row = super().decode(record)
+        row['reminder_sends'] = [
+            {column: datetime.datetime.fromisoformat(value) if column in self.reminder_datetime_columns and value is not None else value
+             for column, value in reminder.items()}
+            for reminder in record.get('reminder_sends', [])
+        ]
+        return row
+
+    def delete_chunk(self, cursor, records):
+        # Children first, so this doesn't depend on the ON DELETE CASCADEs
+        ids = [record['appointment_id'] for record in records]
+        deleted = Counter()
+        cursor.execute(f"DELETE FROM reminder_sends WHERE appointment_id IN ({placeholders(ids)})", ids)
+        deleted['reminder_sends'] = cursor.rowcount
+        cursor.execute(f"DELETE FROM appointment_slots WHERE appointment_id IN ({placeholders(ids)})", ids)
+        deleted['slots'] = cursor.rowcount
+        cursor.execute(f"DELETE FROM appointments WHERE appointment_id IN ({placeholders(ids)})", ids)
+        deleted['rows'] = cursor.rowcount
+        return deleted
+
+    def restore_chunk(self, cursor, records):
+        restored = Counter()
+        restored['rows'] = self.insert_rows(cursor, "appointments", self.columns, records, "appointment_id")
+        reminders = [reminder for row in records for reminder in row['reminder_sends']]
+        restored['reminder_sends'] = self.insert_rows(cursor, "reminder_sends", self.reminder_columns, reminders, "campaign")
+        return restored
+
+
+TABLES = {table.name: table for table in (MessagesLogTable(), AppointmentsTable())}
+
+
+# --- Archive files ---
+def month_dir(table, month, root=RETENTION_ARCHIVE_DIR):
+    return os.path.join(root, table.name, f"{month:%Y-%m}")
+
+def archive_parts(table, month, root=RETENTION_ARCHIVE_DIR, suffix=""):
+    directory = month_dir(table, month, root)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".jsonl.gz" + suffix))
+
+def iter_archive(path):
+    # One record per line, decompressed as it is read; gzip verifies the
+    # file's CRC and length when it reaches the end
+    with gzip.open(path, "rt", encoding="utf-8") as lines:
+        for line in lines:
+            yield json.loads(line)
+
+def export_month(table, month, root=RETENTION_ARCHIVE_DIR, chunk_size=RETENTION_CHUNK_SIZE):
+    # Streams the month's rows into a new part file. Only one chunk is held in
+    # memory at a time, and each chunk is its own short read. -> (path, rows);
+    # no file is left behind for an empty month.
+    start, end = month, add_months(month, 1)
+    directory = month_dir(table, month, root)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{datetime.datetime.now():%Y%m%dT%H%M%S%f}.jsonl.gz")
+    partial = path + ".partial"
+    rows = 0
+    after = (start, '')
+    try:
+        with open(partial, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=ARCHIVE_COMPRESSION_LEVEL) as out:
+                while True:
+                    with transaction(dictionary=True) as cursor:
+                        chunk = table.fetch_chunk(cursor, start, end, after, chunk_size)
+                    for row in chunk:
+                        out.write(json.dumps(table.encode(row), ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+                        out.write(b"\n")
+                    rows += len(chunk)
+                    if len(chunk) < chunk_size:
+                        break
+                    after = (chunk[-1][table.time_column], chunk[-1][table.key])
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        os.remove(partial)
+        raise
+    if not rows:
+        os.remove(partial)
+        return None, 0
+    os.replace(partial, path)
+    return path, rows
+
+def verify_archive(table, path, rows):
+    # Reads the part back through before anything is deleted: every record
+    # must decode, gzip must find the CRC and length it wrote, and the count
+    # must be what export_month wrote. A part that fails is renamed
+    # *.rejected, so neither the purge nor a restore reads it.
+    archived = 0
+    try:
+        for record in iter_archive(path):
+            table.decode(record)
+            archived += 1
+        problem = None if archived == rows else f"holds {archived} rows, {rows} were written"
+    except (OSError, EOFError, ValueError, KeyError, zlib.error) as e:
+        problem = f"is unreadable ({e!r})"
+    if problem:
+        os.replace(path, path + REJECTED_SUFFIX)
+        raise RuntimeError(f"{path} {problem}; nothing was deleted")
+
+def purge_archived(table, path, chunk_size=RETENTION_CHUNK_SIZE, pause=RETENTION_CHUNK_PAUSE_SECONDS):
+    # Deletes the rows a verified part file holds, a chunk per transaction
+    deleted = Counter()
+    for chunk in chunks(iter_archive(path), chunk_size):
+        with transaction() as cursor:
+            deleted.update(table.delete_chunk(cursor, chunk))
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+def archive_month(table, month, root=RETENTION_ARCHIVE_DIR, chunk_size=RETENTION_CHUNK_SIZE,
+                  pause=RETENTION_CHUNK_PAUSE_SECONDS):
+    started = time.monotonic()
+    path, rows = export_month(table, month, root, chunk_size)
+    stats = {'table': table.name, 'month': f"{month:%Y-%m}", 'archived': rows, 'path': path}
+    if path:
+        verify_archive(table, path, rows)
+        deleted = purge_archived(table, path, chunk_size, pause)
+        stats.update({f"deleted_{key}": value for key, value in deleted.items()})
+        stats['archive_bytes'] = os.path.getsize(path)
+    stats['seconds'] = round(time.monotonic() - started, 2)
+    log.info("Archived month", extra=stats)
+    return stats
+
+def due_months(table, now=None, keep_months=None):
+    # Months from the oldest row up to the start of the retention window
+    keep_months = table.retention_months if keep_months is None else keep_months
+    cutoff = add_months(month_start(now or datetime.datetime.now()), -keep_months)
+    with transaction() as cursor:
+        _, oldest = table.hot_stats(cursor)
+    months = []
+    month = month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+def run_retention(tables=None, now=None, root=RETENTION_ARCHIVE_DIR, chunk_size=RETENTION_CHUNK_SIZE,
+                  pause=RETENTION_CHUNK_PAUSE_SECONDS):
+    results = []
+    for table in tables or TABLES.values():
+        for month in due_months(table, now):
+            results.append(archive_month(table, month, root, chunk_size, pause))
+    return results
+
+def restore_month(table, month, root=RETENTION_ARCHIVE_DIR, chunk_size=RETENTION_CHUNK_SIZE):
+    # Puts a month's archived rows back, a chunk per transaction, keeping any
+    # row that is already there. Each restored part is renamed *.restored: it
+    # stays on disk, but the next archive run of the month writes a fresh part
+    # from what is in MySQL then.
+    restored = Counter()
+    for path in archive_parts(table, month, root):
+        for chunk in chunks(iter_archive(path), chunk_size):
+            with transaction() as cursor:
+                restored.update(table.restore_chunk(cursor, [table.decode(record) for record in chunk]))
+        os.replace(path, path + RESTORED_SUFFIX)
+        restored['parts'] += 1
+    stats = {'table': table.name, 'month': f"{month:%Y-%m}", **restored}
+    log.info("Restored month", extra=stats)
+    return stats
+
+def status(root=RETENTION_ARCHIVE_DIR):
+    # -> {table: {'rows', 'oldest', 'retention_months', 'archived': {month: (parts, bytes)}}}
+    report = {}
+    for table in TABLES.values():
+        with transaction() as cursor:
+            rows, oldest = table.hot_stats(cursor)
+        archived = {}
+        table_dir = os.path.join(root, table.name)
+        for month in sorted(os.listdir(table_dir)) if os.path.isdir(table_dir) else []:
+            parts = archive_parts(table, parse_month(month), root)
+            if parts:
+                archived[month] = (len(parts), sum(os.path.getsize(part) for part in parts))
+        report[table.name] = {'rows': rows, 'oldest': oldest, 'retention_months': table.retention_months,
+                              'archived': archived}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old months of messages_log / appointments, or restore them")
+    parser.add_argument("--root", default=RETENTION_ARCHIVE_DIR, help="archive directory")
+    parser.add_argument("--chunk-size", type=int, default=RETENTION_CHUNK_SIZE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="hot table sizes and archived months")
+    archive = commands.add_parser("archive", help="archive and delete months past retention (or one --month)")
+    archive.add_argument("--table", choices=sorted(TABLES), action="append", help="default: all tables")
+    archive.add_argument("--month", type=parse_month, help="YYYY-MM; must be outside the table's retention")
+    archive.add_argument("--pause", type=float, default=RETENTION_CHUNK_PAUSE_SECONDS,
+                         help="seconds between delete chunks")
+    restore = commands.add_parser("restore", help="put an archived month back into MySQL")
+    restore.add_argument("--table", choices=sorted(TABLES), required=True)
+    restore.add_argument("--month", type=parse_month, required=True)
+    args = parser.parse_args()
+
+    from structured_log import configure_logging
+    configure_logging()
+
+    if args.command == "status":
+        for name, report in status(args.root).items():
+            oldest = f"{report['oldest']:%Y-%m-%d}" if report['oldest'] else "-"
+            print(f"{name}: {report['rows']} rows, oldest {oldest}, keeps {report['retention_months']} months + current")
+            for month, (parts, size) in report['archived'].items():
+                print(f"  {month}  {parts} part(s)  {size / 1024:.1f} KiB")
+    elif args.command == "archive":
+        tables = [TABLES[name] for name in args.table] if args.table else list(TABLES.values())
+        if args.month:
+            for table in tables:
+                if args.month not in due_months(table):
+                    parser.error(f"{args.month:%Y-%m} of {table.name} is within its retention or has no rows")
+                print(archive_month(table, args.month, args.root, args.chunk_size, args.pause))
+        else:
+            for result in run_retention(tables, root=args.root, chunk_size=args.chunk_size, pause=args.pause):
+                print(result)
+    else:
+        print(restore_month(TABLES[args.table], args.month, args.root, args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+# service_catalog.py
+import logging
+import threading
+import time
+
+from config import SERVICE_CATALOG_TTL_SECONDS
+from database import get_available_services
+
+log = logging.getLogger(__name__)
+
+
+def normalize_service_name(name):
+    return " ".join(str(name).lower().split())
+
+
+class CatalogSnapshot:
+    # Immutable view of the services table; replaced wholesale on refresh so
+    # readers never need a lock.
+
+    def __init__(self, services, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.services = tuple(services) # ordered by name, as the query returns them
+        self.by_id = {str(s['service_id']): s for s in self.services}
+        self.by_name = {normalize_service_name(s['name']): s for s in self.services}
+
+
+class ServiceCatalog:
+    def __init__(self, loader=get_available_services, ttl_seconds=SERVICE_CATALOG_TTL_SECONDS):
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._snapshot = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def reload(self):
+        # Synchronous load from the database; returns the new version
+        services = self._loader()
+        with self._lock:
+            self._version += 1
+            self._snapshot = CatalogSnapshot(services, self._version)
+            return self._version
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Only the very first caller (if startup loading failed) waits on MySQL
+            self.reload()
+            return self._snapshot
+        if self.ttl_seconds and time.monotonic() - snapshot.loaded_at > self.ttl_seconds:
+            self._refresh_in_background()
+        return snapshot
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.reload()
+            except Exception as e:
+                # Keep serving the old snapshot; we'll try again on the next access
+                log.error("Error refreshing service catalog: %s", e)
+                with self._lock:
+                    self._snapshot.loaded_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="service-catalog-refresh", daemon=True).start()
+
+    @property
+    def version(self):
+        return self._version
+
+    def all(self):
+        return list(self.snapshot().services)
+
+    def get(self, service_id):
+        return self.snapshot().by_id.get(str(service_id))
+
+    def find_by_name(self, name):
+        return self.snapshot().by_name.get(normalize_service_name(name))
+
+
+_catalog = ServiceCatalog()
+
+def get_service_catalog():
+    return _catalog
+
+def reload_service_catalog():
+    return _catalog.reload()
@@ -0,0 +1,128 @@
+# state_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from cache import LRUCache
+from config import STATE_STORE_BACKEND, STATE_STORE_PATH, STATE_STORE_TTL_SECONDS, STATE_STORE_MAX_ENTRIES
+
+
+def _encode(state):
+    return json.dumps(state, separators=(",", ":"))
+
+def _decode(raw):
+    return json.loads(raw)
+
+
+class ConversationStateStore(ABC):
+    # Conversation state per WhatsApp number. get() returns a fresh dict, so
+    # handlers must call set() after changing it; nothing is shared by reference.
+
+    @abstractmethod
+    def get(self, key, default=None):
+        pass
+
+    @abstractmethod
+    def set(self, key, state):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class InMemoryStateStore(ConversationStateStore):
+    # Single-process store. States are kept as compact JSON strings (a few
+    # dozen bytes instead of a dict per conversation), expire after `ttl_seconds`
+    # without an update and the least recently used are evicted past `max_entries`.
+
+    def __init__(self, max_entries=STATE_STORE_MAX_ENTRIES, ttl_seconds=STATE_STORE_TTL_SECONDS):
+        self._cache = LRUCache(max_entries, ttl_seconds)
+
+    def get(self, key, default=None):
+        raw = self._cache.get(key)
+        return _decode(raw) if raw is not None else default
+
+    def set(self, key, state):
+        self._cache.set(key, _encode(state))
+
+    def delete(self, key):
+        self._cache.pop(key)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class SQLiteStateStore(ConversationStateStore):
+    # Shared by every worker process on the host through one SQLite file in
+    # WAL mode. Expired rows are ignored on read and purged periodically.
+
+    PURGE_EVERY = 500 # set() calls between purges of expired rows
+
+    def __init__(self, path=STATE_STORE_PATH, ttl_seconds=STATE_STORE_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_states ("
+            " phone_number TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states (expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit; each statement is its own transaction
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        row = self._conn().execute(
+            "SELECT state FROM conversation_states WHERE phone_number = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        return _decode(row[0]) if row else default
+
+    def set(self, key, state):
+        self._conn().execute(
+            "INSERT INTO conversation_states (phone_number, state, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(phone_number) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+            (key, _encode(state), time.time() + self.ttl_seconds)
+        )
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        if purge:
+            self.purge_expired()
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM conversation_states WHERE phone_number = ?", (key,))
+
+    def purge_expired(self):
+        return self._conn().execute("DELETE FROM conversation_states WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def stats(self):
+        count = self._conn().execute("SELECT COUNT(*) FROM conversation_states").fetchone()[0]
+        return {'size': count}
+
+
+def create_state_store(backend=STATE_STORE_BACKEND):
+    if backend == "memory":
+        return InMemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    raise ValueError(f"Unknown STATE_STORE_BACKEND: {backend}")
@@ -0,0 +1,215 @@
+# structured_log.py
+# Logging setup for the app: records are formatted as one compact JSON object
+# per line and written by a background listener thread, so a request thread
+# only pays for the level check and a queue put. Per-logger levels, sampling
+# of chatty events (status updates) and phone number redaction are configured
+# from config.py.
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+
+from config import (
+    LOG_LEVEL, LOG_LEVELS, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES, LOG_REDACT_PHONE_NUMBERS
+)
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+# E.164-ish numbers as WhatsApp sends them ("27710000000", "+27 71..." is not
+# used), but only behind a "+" or a word that says a phone number follows: a
+# bare 8-15 digit run is as likely a timestamp, a count or part of an id.
+# "entry" is MySQL's "Duplicate entry '27710000000' for key ...". Structured
+# fields are matched by name instead (_PHONE_FIELDS).
+_PHONE_RE = re.compile(
+    r"((?<![\w.\-])\+|\b(?:to|from|phone|number|customer|recipient|wa_id|entry)\W{1,4})(\d{8,15})(?![\w\-])",
+    re.IGNORECASE
+)
+_PHONE_FIELDS = {"phone", "phone_number", "from_number", "to_number", "to", "from", "recipient_id", "wa_id", "input"}
+
+# Formats tracebacks for redaction before the output formatter sees them
+_traceback_formatter = logging.Formatter()
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+def parse_levels(spec):
+    # "database=DEBUG,werkzeug=WARNING" -> {"database": "DEBUG", "werkzeug": "WARNING"}
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+def parse_sample_rates(spec):
+    # "status_update=0.05" -> {"status_update": 0.05}
+    return {name: float(rate) for name, rate in parse_levels(spec).items()}
+
+
+def redact_phone(value):
+    text = str(value)
+    return "***" + text[-4:] if len(text) > 4 else "***"
+
+def redact_text(text):
+    return _PHONE_RE.sub(lambda m: m.group(1) + redact_phone(m.group(2)), text)
+
+def redact_fields(value):
+    # Copy of a webhook/API payload with the phone number fields masked
+    if isinstance(value, dict):
+        return {k: redact_phone(v) if k in _PHONE_FIELDS and isinstance(v, (str, int)) else redact_fields(v)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact_fields(v) for v in value]
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    # {"ts": ..., "level": ..., "logger": ..., "msg": ..., <extra fields>}
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class TextFormatter(logging.Formatter):
+    # For a terminal during development: "12:00:00 INFO app: msg key=value"
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{k}={v}" for k, v in record.__dict__.items() if k not in _RECORD_ATTRS and not k.startswith("_"))
+        return f"{line} {fields}" if fields else line
+
+
+class RedactPhoneNumbers(logging.Filter):
+    # Masks phone numbers in the message, the traceback and known phone
+    # fields. Runs on the listener thread, after the record left the request
+    # thread. The traceback is formatted here and cached in exc_text, which
+    # both formatters print instead of formatting exc_info again.
+    def filter(self, record):
+        record.msg = redact_text(record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = redact_text(record.exc_text)
+        if record.stack_info:
+            record.stack_info = redact_text(record.stack_info)
+        for key in _PHONE_FIELDS & set(record.__dict__):
+            if record.__dict__[key] is not None:
+                record.__dict__[key] = redact_phone(record.__dict__[key])
+        if getattr(record, "payload", None) is not None:
+            record.payload = redact_fields(record.payload)
+        return True
+
+
+class SampleEvents(logging.Filter):
+    # Keeps a fraction of records tagged with extra={"event": name} for events
+    # listed in the sample rates. Warnings and errors are never sampled away.
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.dropped = 0
+
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or record.levelno >= logging.WARNING or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    # Never blocks the caller: when the queue is full the record is dropped and
+    # counted. Once the listener has stopped (interpreter exit) records are
+    # written directly so shutdown messages still come out.
+    def __init__(self, log_queue, target):
+        super().__init__(log_queue)
+        self.target = target
+        self.stopped = False
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Same process, so no pickling: just merge the args now, while they
+        # still hold the values from the call site
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self.stopped:
+            self.target.handle(record)
+        else:
+            super().emit(record)
+
+
+def configure_logging(level=LOG_LEVEL, levels=LOG_LEVELS, log_format=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE,
+                      sample_rates=LOG_SAMPLE_RATES, redact=LOG_REDACT_PHONE_NUMBERS, stream=None):
+    # Installs the queue handler on the root logger; safe to call more than once
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+        if redact:
+            output.addFilter(RedactPhoneNumbers())
+
+        _handler = BackgroundQueueHandler(queue.Queue(queue_size), output)
+        _handler.addFilter(SampleEvents(parse_sample_rates(sample_rates)))
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(level.upper())
+        for name, logger_level in parse_levels(levels).items():
+            logging.getLogger(name).setLevel(logger_level)
+
+        _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+def stop_logging():
+    # Writes out whatever is still queued and switches to direct writes
+    global _listener
+    with _setup_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        _handler.stopped = True
+        listener.stop()
+
+def get_logging_stats():
+    if _handler is None:
+        return {}
+    sampler = _handler.filters[0]
+    return {
+        'queue_depth': _handler.queue.qsize(),
+        'dropped_queue_full': _handler.dropped,
+        'sampled_out': sampler.dropped,
+    }
@@ -0,0 +1,110 @@
+# stub_graph_api.py
+# Local stand-in for the WhatsApp Cloud API /messages endpoint, for load tests
+# and dry runs. Point WHATSAPP_API_URL at it:
+#   python stub_graph_api.py --port 8089 --latency-ms 80 --error-rate 0.02
+#   WHATSAPP_API_URL=http://127.0.0.1:8089/v19.0 python app.py
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once; the default backlog of 5 resets them
+    request_queue_size = 1024
+
+
+class StubGraphAPI:
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, error_rate=0.0, rate_limit_rate=0.0):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests = []  # (recipient, type) in arrival order
+        self.message_ids = [] # ids handed out, for generating status callbacks
+        self.counts = {'ok': 0, '429': 0, '500': 0}
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, like the real API
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000.0)
+
+                roll = random.random()
+                if roll < stub.rate_limit_rate:
+                    stub._count('429')
+                    return self._reply(429, {"error": {"code": 130429, "message": "Rate limit hit"}}, {"Retry-After": "0"})
+                if roll < stub.rate_limit_rate + stub.error_rate:
+                    stub._count('500')
+                    return self._reply(500, {"error": {"code": 1, "message": "Stub internal error"}})
+
+                message_id = f"wamid.stub.{uuid.uuid4().hex}"
+                with stub._lock:
+                    stub.requests.append((body.get('to'), body.get('type')))
+                    stub.message_ids.append(message_id)
+                stub._count('ok')
+                self._reply(200, {
+                    "messaging_product": "whatsapp",
+                    "contacts": [{"input": body.get('to'), "wa_id": body.get('to')}],
+                    "messages": [{"id": message_id}],
+                })
+
+            def _reply(self, status, data, headers=None):
+                raw = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _Server((host, port), Handler)
+        self._thread = None
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v19.0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-graph-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stub for the WhatsApp Cloud API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    stub = StubGraphAPI(args.host, args.port, args.latency_ms, args.error_rate, args.rate_limit_rate)
+    print(f"Stub Graph API listening on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,25 @@
+# conftest.py
+# The app modules live flat in your_whatsapp_app/; make them importable from
+# the tests wherever pytest is started.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    # database.py pointed at a fresh fake_mysql.FakeDatabase, with the
+    # process-wide caches in front of it emptied
+    import availability_cache
+    import database
+    import fake_mysql
+    import payload_store
+    db = fake_mysql.FakeDatabase()
+    monkeypatch.setattr(database, '_pool', db.pool(4))
+    monkeypatch.setattr(availability_cache, '_availability_cache', None)
+    monkeypatch.setattr(payload_store, '_store', None)
+    database._customer_id_cache.clear()
+    return db
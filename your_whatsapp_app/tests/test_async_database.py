@@ -0,0 +1,59 @@
+# test_async_database.py
+# The ASGI backend runs the same statements as database.py; against the same
+# data both must give the same answers.
+import asyncio
+import datetime
+
+import pytest
+
+import async_database
+import database
+import fake_mysql
+
+
+@pytest.fixture
+def both(fake_db, monkeypatch):
+    monkeypatch.setattr(async_database, '_pool', fake_mysql.FakeAsyncPool(fake_db, 4))
+    return fake_db
+
+
+def test_customers_resolve_to_the_same_ids(both):
+    sync_id = database.resolve_customer("27820000001", "A")
+    database._customer_id_cache.clear()
+    assert asyncio.run(async_database.resolve_customer("27820000001", "A")) == sync_id
+    database._customer_id_cache.clear()
+    resolved = asyncio.run(async_database.resolve_customers([("27820000001", "A"), ("27820000002", "B")]))
+    assert resolved == {"27820000001": sync_id, "27820000002": both.customers["27820000002"]}
+
+def test_appointment_pages_match(both):
+    customer_id = database.resolve_customer("27820000001", "A")
+    day = datetime.date.today() + datetime.timedelta(days=3)
+    for hour in (9, 10, 11):
+        assert asyncio.run(async_database.book_appointment(
+            customer_id, "svc-haircut", f"{day} {hour:02d}:00", 30, "27820000001"))
+    first = database.get_customer_appointments(customer_id, limit=2)
+    assert asyncio.run(async_database.get_customer_appointments(customer_id, limit=2)) == first
+    after = (first[-1]['start_time'], first[-1]['appointment_id'])
+    assert asyncio.run(async_database.get_customer_appointments(customer_id, after=after, limit=2)) == \
+        database.get_customer_appointments(customer_id, after=after, limit=2)
+    appointment_id = first[0]['appointment_id']
+    assert asyncio.run(async_database.get_customer_appointment(customer_id, appointment_id)) == \
+        database.get_customer_appointment(customer_id, appointment_id)
+    assert asyncio.run(async_database.get_customer_appointment("someone-else", appointment_id)) is None
+
+def test_reads_hand_their_connection_back_for_reuse(both):
+    # aiomysql closes a connection released mid-transaction, and with
+    # autocommit off a plain SELECT opens one
+    customer_id = database.resolve_customer("27820000001", "A")
+    day = datetime.date.today() + datetime.timedelta(days=3)
+
+    async def reads():
+        await async_database.get_available_time_slots(30, day.strftime("%Y-%m-%d"), "svc-haircut")
+        await async_database.get_customer_appointments(customer_id)
+        await async_database.get_customer_appointment(customer_id, "missing")
+        assert not await async_database.update_appointment_status("missing", 'cancelled')
+
+    opened = both.connections_opened
+    asyncio.run(reads())
+    assert async_database._pool.closed_in_transaction == 0
+    assert both.connections_opened - opened == 1
@@ -0,0 +1,64 @@
+# test_async_whatsapp_api.py
+import asyncio
+
+import pytest
+
+import async_whatsapp_api
+import whatsapp_api
+
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def text(self):
+        return self.body
+
+    def raise_for_status(self):
+        pass # only 2xx answers here
+
+
+class FakeSession:
+    # Answers every post with the same status and body
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.posts = 0
+
+    def post(self, url, json=None):
+        self.posts += 1
+        return FakeResponse(self.status, self.body)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    def install(status, body):
+        fake = FakeSession(status, body)
+        monkeypatch.setattr(async_whatsapp_api, 'get_session', lambda: fake)
+        # No messages_log row for the made-up message ids
+        monkeypatch.setattr(whatsapp_api, '_sent_hooks', [])
+        return fake
+    return install
+
+def send_stats():
+    return dict(whatsapp_api.get_send_stats())
+
+
+def test_accepted_message_returns_its_id(session):
+    session(200, '{"messages": [{"id": "wamid.1"}]}')
+    assert asyncio.run(async_whatsapp_api.send_whatsapp_message("27820000001", "hi")) == "wamid.1"
+
+@pytest.mark.parametrize("body", ["<html>Service Unavailable</html>", ""])
+def test_accepted_response_that_is_not_json_is_a_failed_send(session, body):
+    fake = session(200, body)
+    failed = send_stats()['failed']
+    assert asyncio.run(async_whatsapp_api.send_whatsapp_message("27820000001", "hi")) is None
+    assert fake.posts == 1 # not retried
+    assert send_stats()['failed'] == failed + 1
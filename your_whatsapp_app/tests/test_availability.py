@@ -0,0 +1,89 @@
+# test_availability.py
+import datetime
+import random
+
+import pytest
+
+from availability import (
+    blocked_intervals, free_slots, compute_availability_from_bookings, next_available_from_bookings
+)
+
+DAY = datetime.date(2025, 7, 21) # a Monday
+HOURS = (datetime.time(9, 0), datetime.time(12, 0))
+EVERY_DAY = range(7)
+
+
+def at(hhmm, day=DAY):
+    return datetime.datetime.combine(day, datetime.datetime.strptime(hhmm, "%H:%M").time())
+
+def minutes(n):
+    return datetime.timedelta(minutes=n)
+
+def brute_force_blocked(bookings, capacity):
+    # Minute-by-minute reference for blocked_intervals
+    if not bookings:
+        return []
+    first = min(s for s, _ in bookings)
+    last = max(e for _, e in bookings)
+    blocked = []
+    t = first
+    while t < last:
+        if sum(1 for s, e in bookings if s <= t < e) >= capacity:
+            if blocked and blocked[-1][1] == t:
+                blocked[-1] = (blocked[-1][0], t + minutes(1))
+            else:
+                blocked.append((t, t + minutes(1)))
+        t += minutes(1)
+    return blocked
+
+
+def test_single_capacity_merges_overlapping_and_touching_bookings():
+    bookings = [(at("09:00"), at("09:30")), (at("09:30"), at("10:00")), (at("09:45"), at("10:15")), (at("11:00"), at("11:30"))]
+    assert blocked_intervals(bookings) == [(at("09:00"), at("10:15")), (at("11:00"), at("11:30"))]
+
+def test_capacity_two_blocks_only_the_overlap():
+    bookings = [(at("09:00"), at("10:00")), (at("09:30"), at("10:30")), (at("11:00"), at("12:00"))]
+    assert blocked_intervals(bookings, capacity=2) == [(at("09:30"), at("10:00"))]
+
+def test_capacity_two_with_back_to_back_bookings_is_not_blocked():
+    bookings = [(at("09:00"), at("09:30")), (at("09:30"), at("10:00"))]
+    assert blocked_intervals(bookings, capacity=2) == []
+
+@pytest.mark.parametrize("capacity", [1, 2, 3])
+def test_sweep_matches_brute_force(capacity):
+    rng = random.Random(capacity)
+    for _ in range(50):
+        bookings = []
+        for _ in range(rng.randrange(1, 12)):
+            start = at("09:00") + minutes(15 * rng.randrange(24))
+            bookings.append((start, start + minutes(15 * rng.randrange(1, 8))))
+        bookings.sort()
+        assert blocked_intervals(bookings, capacity) == brute_force_blocked(bookings, capacity)
+
+
+def test_free_slots_skips_blocked_and_respects_close():
+    blocked = [(at("09:30"), at("10:15"))]
+    slots = free_slots(at("09:00"), at("12:00"), minutes(60), minutes(30), blocked)
+    assert slots == [at("10:30"), at("11:00")]
+
+def test_free_slots_not_before():
+    slots = free_slots(at("09:00"), at("12:00"), minutes(30), minutes(30), [], not_before=at("10:40"))
+    assert slots == [at("11:00"), at("11:30")]
+
+def test_availability_across_days_and_working_days():
+    next_day = DAY + datetime.timedelta(days=1)
+    bookings = [(at("09:00"), at("11:30")), (at("09:00", next_day), at("12:00", next_day))]
+    availability = compute_availability_from_bookings(
+        bookings, 30, DAY, DAY + datetime.timedelta(days=6), working_hours=HOURS, working_days=(0, 1)
+    )
+    assert availability[DAY] == [at("11:30")]
+    assert availability[next_day] == []
+    assert all(slots == [] for day, slots in availability.items() if day.weekday() > 1)
+
+def test_next_available_returns_earliest_in_order():
+    bookings = [(at("09:00"), at("12:00"))]
+    found = next_available_from_bookings(
+        bookings, 60, DAY, DAY + datetime.timedelta(days=3), limit=4, working_hours=HOURS, working_days=EVERY_DAY
+    )
+    next_day = DAY + datetime.timedelta(days=1)
+    assert found == [at("09:00", next_day), at("09:30", next_day), at("10:00", next_day), at("10:30", next_day)]
@@ -0,0 +1,106 @@
+# test_booking.py
+import datetime
+
+import pytest
+
+import availability
+import database
+from booking import slot_starts
+
+DAY = datetime.date(2025, 7, 21)
+
+
+def at(hhmm, day=DAY):
+    return datetime.datetime.combine(day, datetime.datetime.strptime(hhmm, "%H:%M").time())
+
+
+@pytest.fixture
+def opens_at_quarter_past(monkeypatch):
+    # An opening time that is not on a 30 minute grid counted from midnight
+    hours = availability.parse_working_hours("09:15-17:00")
+    monkeypatch.setattr(availability, 'parse_working_hours', lambda spec=None: hours)
+    return hours
+
+
+def test_slots_cover_every_started_grid_cell():
+    assert slot_starts(at("09:00"), at("10:00"), 30) == [at("09:00"), at("09:30")]
+    assert slot_starts(at("09:10"), at("09:40"), 30) == [at("09:00"), at("09:30")]
+
+def test_grid_is_anchored_at_opening_time(opens_at_quarter_past):
+    assert slot_starts(at("09:15"), at("09:45"), 30) == [at("09:15")]
+    assert slot_starts(at("10:15"), at("11:15"), 30) == [at("10:15"), at("10:45")]
+
+def test_offered_slot_after_a_booking_can_be_booked(fake_db, opens_at_quarter_past):
+    assert database.book_appointment("cust-1", "svc-massage", "2025-07-21 09:15", 60, "27820000001")
+    booked = [(at("09:15"), at("10:15"))]
+    offered = availability.compute_availability_from_bookings(
+        booked, 60, DAY, working_hours=opens_at_quarter_past, working_days=range(7))[DAY]
+    assert offered[0] == at("10:15")
+    assert database.book_appointment("cust-2", "svc-massage", "2025-07-21 10:15", 60, "27820000002")
+
+def test_overlapping_booking_is_rejected(fake_db, opens_at_quarter_past):
+    assert database.book_appointment("cust-1", "svc-massage", "2025-07-21 09:15", 60, "27820000001")
+    assert database.book_appointment("cust-2", "svc-massage", "2025-07-21 09:45", 60, "27820000002") is None
+    assert len(fake_db.appointments) == 1
+
+def test_cancel_releases_and_reactivation_reserves_again(fake_db):
+    appointment_id = database.book_appointment("cust-1", "svc-haircut", "2025-07-21 09:00", 30, "27820000001")
+    assert database.update_appointment_status(appointment_id, 'cancelled')
+    assert not fake_db.slots
+    assert database.update_appointment_status(appointment_id, 'confirmed')
+    assert set(fake_db.slots.values()) == {appointment_id}
+    assert database.update_appointment_status(appointment_id, 'pending') # already holds its slots
+    assert set(fake_db.slots.values()) == {appointment_id}
+
+def test_reactivation_fails_when_the_time_was_rebooked(fake_db):
+    first = database.book_appointment("cust-1", "svc-haircut", "2025-07-21 09:00", 30, "27820000001")
+    database.update_appointment_status(first, 'cancelled')
+    second = database.book_appointment("cust-2", "svc-haircut", "2025-07-21 09:00", 30, "27820000002")
+    assert second
+    assert not database.update_appointment_status(first, 'confirmed')
+    assert fake_db.appointments[first]['status'] == 'cancelled'
+    assert set(fake_db.slots.values()) == {second}
+
+def test_async_reactivation_fails_when_the_time_was_rebooked(fake_db, monkeypatch):
+    import asyncio
+    import async_database
+    import fake_mysql
+    monkeypatch.setattr(async_database, '_pool', fake_mysql.FakeAsyncPool(fake_db, 4))
+    first = database.book_appointment("cust-1", "svc-haircut", "2025-07-21 09:00", 30, "27820000001")
+    assert asyncio.run(async_database.update_appointment_status(first, 'cancelled'))
+    assert asyncio.run(async_database.update_appointment_status(first, 'confirmed'))
+    assert asyncio.run(async_database.update_appointment_status(first, 'cancelled'))
+    second = database.book_appointment("cust-2", "svc-haircut", "2025-07-21 09:00", 30, "27820000002")
+    assert not asyncio.run(async_database.update_appointment_status(first, 'confirmed'))
+    assert set(fake_db.slots.values()) == {second}
+
+def test_reschedule_into_an_overlapping_time(fake_db):
+    old = database.book_appointment("cust-1", "svc-massage", "2025-07-21 09:00", 60, "27820000001")
+    new = database.book_appointment("cust-1", "svc-massage", "2025-07-21 09:30", 60, "27820000001", replaces=old)
+    assert new
+    assert fake_db.appointments[old]['status'] == 'cancelled'
+    assert set(fake_db.slots.values()) == {new}
+
+def test_failed_reschedule_keeps_the_old_appointment(fake_db):
+    old = database.book_appointment("cust-1", "svc-massage", "2025-07-21 09:00", 60, "27820000001")
+    other = database.book_appointment("cust-2", "svc-massage", "2025-07-21 11:00", 60, "27820000002")
+    assert database.book_appointment("cust-1", "svc-massage", "2025-07-21 10:30", 60, "27820000001", replaces=old) is None
+    assert fake_db.appointments[old]['status'] == 'confirmed'
+    assert sorted(set(fake_db.slots.values())) == sorted({old, other})
+    assert len(fake_db.appointments) == 2
+
+@pytest.mark.parametrize('replaces', ['cancelled', 'missing'])
+def test_reschedule_of_an_inactive_appointment_fails(fake_db, monkeypatch, replaces):
+    import asyncio
+    import async_database
+    import fake_mysql
+    monkeypatch.setattr(async_database, '_pool', fake_mysql.FakeAsyncPool(fake_db, 4))
+    booked = database.book_appointment("cust-1", "svc-massage", "2025-07-21 09:00", 60, "27820000001")
+    if replaces == 'cancelled':
+        database.update_appointment_status(booked, 'cancelled')
+    old = booked if replaces == 'cancelled' else "appt-unknown"
+    assert database.book_appointment("cust-1", "svc-massage", "2025-07-21 11:00", 60, "27820000001", replaces=old) is None
+    assert asyncio.run(async_database.book_appointment(
+        "cust-1", "svc-massage", "2025-07-21 11:00", 60, "27820000001", replaces=old)) is None
+    assert list(fake_db.appointments) == [booked]
+    assert set(fake_db.slots.values()) == (set() if replaces == 'cancelled' else {booked})
@@ -0,0 +1,63 @@
+# test_cache.py
+import pytest
+
+import cache
+from cache import LRUCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Drives cache.time.monotonic by hand
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entry_is_evicted():
+    lru = LRUCache(max_entries=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.get('a') == 1 # 'b' is now the oldest
+    lru.set('c', 3)
+    assert 'b' not in lru
+    assert lru.get('a') == 1 and lru.get('c') == 3
+    assert lru.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl(clock):
+    lru = LRUCache(max_entries=10, ttl_seconds=30)
+    lru.set('a', 1)
+    lru.set('b', 2, ttl_seconds=60)
+    clock[0] += 30
+    assert lru.get('a') is None
+    assert 'a' not in lru
+    assert lru.get('b') == 2
+    stats = lru.stats()
+    assert stats['expirations'] == 1 and stats['hits'] == 1 and stats['misses'] == 1
+
+def test_add_only_replaces_missing_or_expired_keys(clock):
+    lru = LRUCache(max_entries=10, ttl_seconds=10)
+    assert lru.add('a', 1)
+    assert not lru.add('a', 2)
+    assert lru.get('a') == 1
+    clock[0] += 11
+    assert lru.add('a', 3)
+    assert lru.get('a') == 3
+
+def test_contains_does_not_touch_counters_or_order():
+    lru = LRUCache(max_entries=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert 'a' in lru
+    lru.set('c', 3) # 'a' was not refreshed by the membership test
+    assert 'a' not in lru
+    assert lru.stats()['hits'] == lru.stats()['misses'] == 0
+
+def test_pop_and_clear_count_invalidations():
+    lru = LRUCache(max_entries=10)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    assert lru.pop('a') == 1
+    assert lru.pop('a', 'gone') == 'gone'
+    lru.clear()
+    assert len(lru) == 0
+    assert lru.stats()['invalidations'] == 2
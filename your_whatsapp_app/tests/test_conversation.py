@@ -0,0 +1,104 @@
+# test_conversation.py
+import datetime
+import types
+
+import pytest
+
+import conversation
+from conversation import ConversationBackend, ConversationFlow, blocking, run_sync
+from state_store import InMemoryStateStore
+
+
+class RecordingBackend:
+    # Plain functions standing in for database.py / whatsapp_api.py
+    def __init__(self, booked_id="appt-1"):
+        self.sent = []
+        self.confirmations = []
+        self.bookings = []
+        self.booked_id = booked_id
+
+    def send_whatsapp_message(self, to_number, message_body, message_type="text"):
+        self.sent.append((to_number, message_type, message_body))
+        return "wamid.test"
+
+    def send_confirmation(self, to_number, appointment_id, messages):
+        self.confirmations.append((to_number, appointment_id, messages))
+
+    def book_appointment(self, customer_id, service_id, start_time_str, duration_minutes, conversation_id, replaces=None):
+        self.bookings.append((service_id, start_time_str, duration_minutes, replaces))
+        return self.booked_id
+
+    def get_available_time_slots(self, duration, date, service_id=None):
+        return ["09:00", "09:30"]
+
+    def calls(self):
+        def unused(*args, **kwargs):
+            raise AssertionError("not expected in this test")
+        calls = {name: unused for name in ConversationBackend.CALLS}
+        for name in ('send_whatsapp_message', 'send_confirmation', 'book_appointment', 'get_available_time_slots'):
+            calls[name] = getattr(self, name)
+        return {name: blocking(fn) for name, fn in calls.items()}
+
+
+@pytest.fixture
+def states(monkeypatch):
+    store = InMemoryStateStore(max_entries=10, ttl_seconds=60)
+    monkeypatch.setattr(conversation, 'conversation_states', store)
+    return store
+
+
+def test_backend_requires_every_call():
+    calls = RecordingBackend().calls()
+    del calls['send_confirmation']
+    with pytest.raises(TypeError, match="send_confirmation"):
+        ConversationBackend(**calls)
+    with pytest.raises(TypeError, match="send_template"):
+        ConversationBackend(send_template=None, **RecordingBackend().calls())
+
+def test_run_sync_returns_the_result_and_refuses_to_suspend():
+    async def done():
+        return 42
+    assert run_sync(done()) == 42
+    @types.coroutine
+    def suspend():
+        yield
+    async def waits():
+        await suspend()
+    with pytest.raises(RuntimeError, match="suspended"):
+        run_sync(waits())
+
+def test_date_then_slot_books_and_hands_off_the_confirmation(states):
+    backend = RecordingBackend()
+    flow = ConversationFlow(ConversationBackend(**backend.calls()))
+    states.set("27820000001", {'step': 'select_date', 'service_id': 'svc-haircut', 'service_name': 'Haircut', 'duration': 30})
+    day = (datetime.date.today() + datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+
+    run_sync(flow.handle_text_message("27820000001", "cust-1", day))
+    rows = backend.sent[-1][2]['action']['sections'][0]['rows']
+    assert [row['id'] for row in rows] == [f"book_slot_{day} 09:00", f"book_slot_{day} 09:30"]
+    assert states.get("27820000001")['step'] == 'select_time'
+
+    run_sync(flow.handle_list_selection("27820000001", "cust-1", rows[0]['id'], states.get("27820000001")))
+    assert backend.bookings == [('svc-haircut', f"{day} 09:00", 30, None)]
+    (to_number, appointment_id, messages), = backend.confirmations
+    assert (to_number, appointment_id) == ("27820000001", "appt-1")
+    assert "confirmed" in messages[0][0] and messages[2][1] == "interactive"
+    assert states.get("27820000001") is None
+
+def test_reschedule_passes_the_replaced_appointment(states):
+    backend = RecordingBackend()
+    flow = ConversationFlow(ConversationBackend(**backend.calls()))
+    state = {'step': 'select_time', 'service_id': 'svc-haircut', 'service_name': 'Haircut', 'duration': 30,
+             'reschedule_appointment_id': 'appt-old'}
+    run_sync(flow.handle_list_selection("27820000001", "cust-1", "book_slot_2030-01-02 10:00", state))
+    assert backend.bookings == [('svc-haircut', "2030-01-02 10:00", 30, 'appt-old')]
+    assert "moved" in backend.confirmations[0][2][0][0]
+
+def test_failed_booking_offers_the_menu(states):
+    backend = RecordingBackend(booked_id=None)
+    flow = ConversationFlow(ConversationBackend(**backend.calls()))
+    state = {'step': 'select_time', 'service_id': 'svc-haircut', 'service_name': 'Haircut', 'duration': 30}
+    run_sync(flow.handle_list_selection("27820000001", "cust-1", "book_slot_2030-01-02 10:00", state))
+    assert backend.confirmations == []
+    assert "no longer available" in backend.sent[0][2]
+    assert backend.sent[-1][1] == "interactive"
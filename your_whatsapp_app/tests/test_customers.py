@@ -0,0 +1,36 @@
+# test_customers.py
+import database
+
+
+def test_resolve_customer_creates_once_and_then_uses_the_cache(fake_db):
+    customer_id = database.resolve_customer("27820000001", "Thandi")
+    assert customer_id == fake_db.customers["27820000001"]
+    calls = fake_db.total_calls()
+    assert database.resolve_customer("27820000001", "Thandi") == customer_id
+    assert fake_db.total_calls() == calls
+
+def test_resolve_customer_keeps_the_existing_id(fake_db):
+    fake_db.customers["27820000001"] = "existing-id"
+    assert database.resolve_customer("27820000001", "Thandi") == "existing-id"
+
+def test_resolve_customers_is_one_upsert_and_one_select(fake_db):
+    fake_db.customers["27820000002"] = "existing-id"
+    cached = database.resolve_customer("27820000003", "Cached")
+    fake_db.calls.clear()
+
+    resolved = database.resolve_customers([
+        ("27820000001", "New"), ("27820000002", "Existing"), ("27820000003", "Cached"), ("27820000001", "New"),
+    ])
+    assert resolved == {
+        "27820000001": fake_db.customers["27820000001"],
+        "27820000002": "existing-id",
+        "27820000003": cached,
+    }
+    assert sum(n for key, n in fake_db.calls.items() if key.startswith("INSERT")) == 1
+    assert sum(n for key, n in fake_db.calls.items() if key.startswith("SELECT")) == 1
+
+def test_resolve_customers_all_cached_skips_the_database(fake_db):
+    database.resolve_customers([("27820000001", "A"), ("27820000002", "B")])
+    calls = fake_db.total_calls()
+    assert set(database.resolve_customers([("27820000001", "A"), ("27820000002", "B")])) == {"27820000001", "27820000002"}
+    assert fake_db.total_calls() == calls
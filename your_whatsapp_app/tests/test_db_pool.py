@@ -0,0 +1,131 @@
+# test_db_pool.py
+import gc
+import time
+
+import pytest
+from mysql.connector.errors import OperationalError
+
+import database
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+class StubConnection:
+    # Enough of a mysql-connector connection for the pool
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.in_transaction = False
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self, *args, **kwargs):
+        if not self.alive:
+            raise OperationalError("MySQL Connection not available.")
+        return StubCursor(self)
+
+    def is_connected(self):
+        return self.alive
+
+    def rollback(self):
+        if not self.alive:
+            raise OperationalError("Lost connection to MySQL server")
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def commit(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+class StubCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        self.conn.in_transaction = True
+
+    def fetchone(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def stub_pool(size=2, alive=True, **kwargs):
+    made = []
+    def connect():
+        made.append(StubConnection(alive))
+        return made[-1]
+    return ConnectionPool(connect, size=size, timeout=kwargs.pop('timeout', 0.05), **kwargs), made
+
+
+def test_dead_connection_gives_its_slot_back(monkeypatch):
+    pool, made = stub_pool(size=2, alive=False)
+    monkeypatch.setattr(database, '_pool', pool)
+    for _ in range(3):
+        with pytest.raises(OperationalError):
+            database.get_customer_by_phone("27820000001")
+    stats = pool.stats()
+    assert (stats['open'], stats['idle'], stats['discarded']) == (0, 0, 3)
+    assert all(conn.closed for conn in made)
+
+def test_connection_error_in_the_block_drops_the_connection():
+    pool, made = stub_pool(size=1)
+    with pytest.raises(OperationalError):
+        with pool.connection() as conn:
+            conn.cursor()
+            raise OperationalError("Lost connection to MySQL server during query")
+    assert made[0].closed and pool.stats()['open'] == 0
+    with pool.connection():
+        pass
+    assert len(made) == 2
+
+def test_leaked_checkout_returns_its_slot_when_collected():
+    pool, made = stub_pool(size=1)
+    pool.connection().cursor() # never closed
+    gc.collect()
+    assert pool.stats()['open'] == 0 and made[0].closed
+    with pool.connection():
+        pass
+
+def test_checkout_times_out_when_every_connection_is_in_use():
+    pool, _ = stub_pool(size=1)
+    held = pool.connection()
+    started = time.monotonic()
+    with pytest.raises(PoolTimeoutError):
+        pool.connection(timeout=0.05)
+    assert time.monotonic() - started >= 0.05
+    assert pool.stats()['timeouts'] == 1
+    held.close()
+    pool.connection(timeout=0.05).close()
+
+def test_old_connections_are_recycled():
+    pool, made = stub_pool(size=1, recycle=0.01)
+    pool.connection().close()
+    time.sleep(0.02)
+    pool.connection().close()
+    assert len(made) == 2 and made[0].closed
+    assert pool.stats()['recycled'] == 1
+
+def test_idle_connection_is_pinged_before_reuse():
+    pool, made = stub_pool(size=1, ping_after=0)
+    pool.connection().close()
+    pool.connection().close()
+    assert len(made) == 1 # alive, reused
+    made[0].alive = False
+    conn = pool.connection()
+    assert conn._conn is made[1]
+    assert pool.stats()['failed_health_checks'] == 1
+    conn.close()
+
+def test_release_rolls_back_an_open_transaction():
+    pool, made = stub_pool(size=1)
+    with pool.connection() as conn:
+        conn.cursor().execute("UPDATE appointments SET status = 'cancelled'")
+    assert made[0].rollbacks == 1 and pool.stats()['idle'] == 1
+
+    with pool.connection() as conn:
+        conn.cursor().execute("UPDATE appointments SET status = 'cancelled'")
+        made[0].alive = False # rollback on release fails -> dropped, not reused
+    assert pool.stats()['open'] == 0 and made[0].closed
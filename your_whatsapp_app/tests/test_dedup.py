@@ -0,0 +1,68 @@
+# test_dedup.py
+import pytest
+
+import cache
+from dedup import WebhookDeduplicator, LocalSeenIds, event_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Drives cache.time.monotonic by hand
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+def message(message_id):
+    return {'id': message_id, 'from': "27820000001"}
+
+
+class BrokenSeenIds:
+    def claim(self, key):
+        raise ConnectionError("redis is down")
+
+    def release(self, key):
+        raise ConnectionError("redis is down")
+
+
+def test_statuses_are_keyed_by_status():
+    status = {'id': "wamid.1", 'status': 'delivered'}
+    assert event_key('status', status) != event_key('status', dict(status, status='read'))
+    assert event_key('message', message("wamid.1")) != event_key('status', status)
+
+def test_redelivery_within_the_window_is_dropped(clock):
+    dedup = WebhookDeduplicator(max_entries=10, window_seconds=60)
+    assert dedup.first_delivery('message', message("wamid.1"))
+    clock[0] += 59
+    assert not dedup.first_delivery('message', message("wamid.1"))
+    clock[0] += 2 # past the window of the first delivery
+    assert dedup.first_delivery('message', message("wamid.1"))
+    assert dedup.stats()['duplicates_dropped'] == 1
+
+def test_oldest_ids_are_evicted_when_full():
+    dedup = WebhookDeduplicator(max_entries=2, window_seconds=60)
+    for message_id in ("wamid.1", "wamid.2", "wamid.3"):
+        assert dedup.first_delivery('message', message(message_id))
+    assert not dedup.first_delivery('message', message("wamid.3"))
+    assert dedup.first_delivery('message', message("wamid.1")) # evicted, seen as new
+    assert dedup.stats()['tracked_ids'] == 2
+
+def test_shared_backend_catches_redelivery_to_another_process():
+    shared = LocalSeenIds(max_entries=10, window_seconds=60)
+    first, second = WebhookDeduplicator(shared=shared), WebhookDeduplicator(shared=shared)
+    assert first.first_delivery('message', message("wamid.1"))
+    assert not second.first_delivery('message', message("wamid.1"))
+
+def test_shared_backend_errors_fail_open():
+    dedup = WebhookDeduplicator(shared=BrokenSeenIds())
+    assert dedup.first_delivery('message', message("wamid.1"))
+    dedup.forget('message', message("wamid.1")) # doesn't raise either
+    assert dedup.first_delivery('message', message("wamid.1"))
+    assert dedup.stats()['shared_errors'] == 2
+
+def test_forget_readmits_the_event_everywhere():
+    shared = LocalSeenIds(max_entries=10, window_seconds=60)
+    first, second = WebhookDeduplicator(shared=shared), WebhookDeduplicator(shared=shared)
+    assert first.first_delivery('message', message("wamid.1"))
+    first.forget('message', message("wamid.1"))
+    assert second.first_delivery('message', message("wamid.1"))
+    assert not first.first_delivery('message', message("wamid.1")) # claimed by second now
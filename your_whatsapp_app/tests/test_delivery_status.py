@@ -0,0 +1,121 @@
+# test_delivery_status.py
+import datetime
+
+import pytest
+
+import database
+import whatsapp_api
+from delivery_status import DeliveryStatusTracker, status_rank
+
+T0 = datetime.datetime(2025, 7, 21, 9, 0)
+
+
+class Applier:
+    # apply_fn that records every window and reports `unknown` ids as missing
+    def __init__(self, unknown=()):
+        self.windows = []
+        self.unknown = set(unknown)
+        self.fail = False
+
+    def __call__(self, statuses):
+        if self.fail:
+            raise RuntimeError("database down")
+        self.windows.append(dict(statuses))
+        return [message_id for message_id in statuses if message_id in self.unknown]
+
+
+@pytest.fixture
+def applier():
+    return Applier()
+
+@pytest.fixture
+def tracker(applier):
+    # Flushed by hand; the background interval never comes round
+    tracker = DeliveryStatusTracker(applier, flush_interval=60, max_attempts=3)
+    yield tracker
+    tracker.close()
+
+
+def test_ranks_only_move_forward():
+    assert status_rank('sent') < status_rank('delivered') < status_rank('read') < status_rank('failed')
+    assert status_rank('deleted') == 0
+
+def test_statuses_for_one_message_coalesce_to_the_newest(tracker, applier):
+    tracker.record("wamid.1", 'sent', T0)
+    tracker.record("wamid.1", 'read', T0 + datetime.timedelta(seconds=2))
+    tracker.record("wamid.1", 'delivered', T0 + datetime.timedelta(seconds=1)) # late, ignored
+    tracker.flush()
+    assert applier.windows == [{"wamid.1": (3, 'read', T0 + datetime.timedelta(seconds=2))}]
+    stats = tracker.stats()
+    assert stats['coalesced'] == 1 and stats['stale_ignored'] == 1 and stats['applied'] == 1
+
+def test_unknown_ids_are_retried_then_dropped(tracker, applier):
+    applier.unknown.add("wamid.early")
+    tracker.record("wamid.early", 'delivered', T0)
+    for _ in range(3):
+        tracker.flush()
+    assert len(applier.windows) == 3
+    assert tracker.stats()['dropped_unknown'] == 1 and tracker.stats()['pending'] == 0
+
+def test_newer_status_wins_over_a_retried_one(tracker, applier):
+    applier.unknown.add("wamid.1")
+    tracker.record("wamid.1", 'sent', T0)
+    tracker.flush()
+    tracker.record("wamid.1", 'read', T0)
+    applier.unknown.clear()
+    tracker.flush()
+    assert applier.windows[-1] == {"wamid.1": (3, 'read', T0)}
+
+def test_failed_flush_keeps_the_window_without_using_an_attempt(tracker, applier):
+    tracker.record("wamid.1", 'delivered', T0)
+    applier.fail = True
+    for _ in range(5):
+        tracker.flush()
+    applier.fail = False
+    tracker.flush()
+    assert applier.windows == [{"wamid.1": (2, 'delivered', T0)}]
+    assert tracker.stats()['failed_flushes'] == 5
+
+def test_window_is_bounded(applier):
+    tracker = DeliveryStatusTracker(applier, flush_interval=60, max_pending=2)
+    try:
+        assert tracker.record("wamid.1", 'sent', T0)
+        assert tracker.record("wamid.2", 'sent', T0)
+        assert not tracker.record("wamid.3", 'sent', T0)
+        assert tracker.record("wamid.1", 'read', T0) # known ids still update
+    finally:
+        tracker.close()
+    assert applier.windows == [{"wamid.1": (3, 'read', T0), "wamid.2": (1, 'sent', T0)}]
+
+
+def test_statuses_apply_monotonically_to_outbound_rows(fake_db):
+    fake_db.messages_log.append(("log-1", "wamid.1", 'outbound', None, T0, "{}", None))
+    assert database.apply_delivery_statuses({"wamid.1": (3, 'read', T0), "wamid.2": (2, 'delivered', T0)}) == {"wamid.2"}
+    database.apply_delivery_statuses({"wamid.1": (2, 'delivered', T0)})
+    assert fake_db.delivery_statuses["wamid.1"][0] == 'read'
+
+
+@pytest.fixture
+def no_hooks(monkeypatch):
+    # Keeps hooks registered by other imports (app.py logs every send) out
+    monkeypatch.setattr(whatsapp_api, '_sent_hooks', [])
+
+def test_sent_hooks_see_accepted_messages_only(no_hooks):
+    seen = []
+    hook = whatsapp_api.on_message_sent(lambda message_id, payload, response: seen.append(message_id))
+    try:
+        whatsapp_api.message_sent({'to': "27820000001"}, {'messages': [{'id': "wamid.1"}]}, "test", 1)
+        whatsapp_api.message_sent({'to': "27820000001"}, {}, "test", 1)
+    finally:
+        whatsapp_api.remove_message_sent_hook(hook)
+    assert seen == ["wamid.1"]
+
+def test_failing_hook_does_not_fail_the_send(no_hooks):
+    def broken(message_id, payload, response):
+        raise RuntimeError("log writer gone")
+
+    whatsapp_api.on_message_sent(broken)
+    try:
+        assert whatsapp_api.message_sent({}, {'messages': [{'id': "wamid.1"}]}, "test", 1) == "wamid.1"
+    finally:
+        whatsapp_api.remove_message_sent_hook(broken)
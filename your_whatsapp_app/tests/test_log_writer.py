@@ -0,0 +1,117 @@
+# test_log_writer.py
+import datetime
+import threading
+
+import pytest
+
+import database
+from log_writer import BufferedLogWriter
+
+
+class Sink:
+    # flush_fn that records every batch and can be told to fail
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        if self.fail:
+            raise RuntimeError("database down")
+        with self.lock:
+            self.batches.append(list(rows))
+
+    def rows(self):
+        return [row for batch in self.batches for row in batch]
+
+
+@pytest.fixture
+def sink():
+    return Sink()
+
+def writer_for(sink, **kwargs):
+    # A long flush interval so only batch_size, flush() and close() write
+    kwargs.setdefault('flush_interval', 60)
+    return BufferedLogWriter(sink, **kwargs)
+
+
+def test_rows_are_written_in_order_in_batches(sink):
+    writer = writer_for(sink, batch_size=3)
+    for i in range(7):
+        assert writer.write(i)
+    writer.close()
+    assert sink.rows() == list(range(7))
+    assert all(len(batch) <= 3 for batch in sink.batches)
+    assert writer.stats()['written'] == 7
+
+def test_full_batch_is_flushed_without_waiting_for_the_interval(sink):
+    writer = writer_for(sink, batch_size=2)
+    writer.write('a')
+    writer.write('b')
+    for _ in range(100):
+        if sink.batches:
+            break
+        threading.Event().wait(0.01)
+    assert sink.batches == [['a', 'b']]
+    writer.close()
+
+@pytest.mark.parametrize("policy, kept", [('drop_oldest', ['b', 'c']), ('drop_newest', ['a', 'b'])])
+def test_overflow_policies(sink, policy, kept):
+    writer = writer_for(sink, batch_size=100, max_queue=2, overflow_policy=policy)
+    for row in 'abc':
+        writer.write(row)
+    assert writer.stats()['dropped'] == 1
+    writer.close()
+    assert sink.rows() == kept
+
+def test_block_policy_gives_up_after_timeout(sink):
+    writer = writer_for(sink, batch_size=100, max_queue=1, overflow_policy='block', block_timeout=0.05)
+    assert writer.write('a')
+    assert not writer.write('b')
+    writer.close()
+    assert sink.rows() == ['a']
+
+def test_failed_flush_counts_the_batch_and_leaves_the_rest(sink):
+    writer = writer_for(sink, batch_size=100)
+    for i in range(4):
+        writer.write(i)
+    writer.batch_size = 2 # only now, so the writes don't wake the writer thread
+    sink.fail = True
+    writer.flush()
+    stats = writer.stats()
+    assert stats['failed'] == 2 and stats['queue_depth'] == 2
+    sink.fail = False
+    writer.close()
+    assert sink.rows() == [2, 3]
+
+def test_writes_after_close_are_dropped(sink):
+    writer = writer_for(sink)
+    writer.close()
+    assert not writer.write('late')
+    assert writer.stats()['dropped'] == 1
+
+def test_unknown_overflow_policy_is_rejected(sink):
+    with pytest.raises(ValueError):
+        BufferedLogWriter(sink, overflow_policy='spill')
+
+
+def test_insert_message_logs_is_one_insert_per_batch(fake_db):
+    now = datetime.datetime(2025, 7, 21, 9, 0)
+    webhook = {'entry': [{'id': 'waba'}]}
+    rows = [(f"log-{i}", f"wamid.{i}", 'inbound', None, now, f"message {i}", webhook) for i in range(5)]
+    fake_db.calls.clear()
+    database.insert_message_logs(rows)
+    assert fake_db.calls['INSERT messages_log'] == 1
+    assert fake_db.calls['INSERT webhook_payloads'] == 1
+    assert [row[0] for row in fake_db.messages_log] == [f"log-{i}" for i in range(5)]
+    assert len(fake_db.webhook_payloads) == 1 # the shared webhook body is stored once
+
+def test_payload_purged_meanwhile_is_written_again(fake_db):
+    # retention.py deletes payloads of archived rows; a later batch with the
+    # same body must not leave its log row pointing at nothing
+    now = datetime.datetime(2025, 7, 21, 9, 0)
+    webhook = {'entry': [{'id': 'waba'}]}
+    database.insert_message_logs([("log-1", "wamid.1", 'inbound', None, now, "first", webhook)])
+    fake_db.webhook_payloads.clear()
+    database.insert_message_logs([("log-2", "wamid.2", 'inbound', None, now, "second", webhook)])
+    assert set(fake_db.webhook_payloads) == {fake_db.messages_log[1][6]}
@@ -0,0 +1,61 @@
+# test_outbound.py
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import outbound
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    # Replaces the Graph API call; returns the list of (to, body) sent
+    sent = []
+
+    def post_message(payload, label):
+        sent.append((payload['to'], payload.get('text', {}).get('body')))
+        return None if payload.get('text', {}).get('body') == "fail" else f"wamid.{len(sent)}"
+
+    monkeypatch.setattr(outbound, 'post_message', post_message)
+    return sent
+
+
+def test_batch_is_sent_in_order(posted):
+    dispatcher = outbound.OutboundDispatcher(num_workers=2, queue_size=10)
+    try:
+        ids = dispatcher.send_batch("27820000001", [("one", "text"), ("two", "text")]).result(5)
+    finally:
+        dispatcher.shutdown()
+    assert ids == ["wamid.1", "wamid.2"]
+    assert posted == [("27820000001", "one"), ("27820000001", "two")]
+
+
+def test_batch_stops_after_a_failed_message(posted):
+    ids = outbound.send_payloads("27820000001", outbound.build_payloads("27820000001", [("fail", "text"), ("two", "text")]))
+    assert ids == [None, None]
+    assert posted == [("27820000001", "fail")]
+
+
+def test_full_queue_rejects_batch(posted):
+    dispatcher = outbound.OutboundDispatcher(num_workers=1, queue_size=1)
+    release = threading.Event()
+    try:
+        dispatcher._pool.submit("27820000001", release.wait)
+        dispatcher._pool.submit("27820000001", release.wait) # fills the queue behind the running job
+        future = dispatcher.send_batch("27820000001", [("one", "text")])
+        assert isinstance(future.exception(0), outbound.OutboundQueueFull)
+    finally:
+        release.set()
+        dispatcher.shutdown()
+
+
+def test_send_batch_or_inline_falls_back_when_queue_full(posted, monkeypatch):
+    def full(to_number, messages):
+        future = Future()
+        future.set_exception(outbound.OutboundQueueFull("full"))
+        return future
+
+    monkeypatch.setattr(outbound, 'send_batch', full)
+    future = outbound.send_batch_or_inline("27820000001", [("confirmed", "text"), ("anything else?", "text")])
+    assert future.result(0) == ["wamid.1", "wamid.2"]
+    assert posted == [("27820000001", "confirmed"), ("27820000001", "anything else?")]
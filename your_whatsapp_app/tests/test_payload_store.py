@@ -0,0 +1,45 @@
+# test_payload_store.py
+import json
+import random
+import zlib
+
+import pytest
+
+import database
+import payload_store
+from payload_store import canonical_json, iter_decompressed
+
+
+def test_key_order_does_not_change_the_bytes():
+    assert canonical_json({'b': 1, 'a': [1, 2]}) == canonical_json({'a': [1, 2], 'b': 1}) == b'{"a":[1,2],"b":1}'
+
+@pytest.mark.parametrize("payload", ['{"b": 1, "a": 2}', b'{"b": 1, "a": 2}', '"text"', "[]"])
+def test_json_strings_are_stored_as_they_are(payload):
+    raw = canonical_json(payload)
+    assert raw == (payload if isinstance(payload, bytes) else payload.encode("utf-8"))
+
+@pytest.mark.parametrize("payload", ["<html>Bad Gateway</html>", b"\xff\xfe not json", "", "Überlastet"])
+def test_other_strings_are_stored_as_json_strings(payload):
+    raw = canonical_json(payload)
+    assert isinstance(json.loads(raw), str)
+
+def test_large_payload_round_trips_in_chunks():
+    rng = random.Random(7)
+    payload = {'entry': [{'id': f"waba-{i}", 'text': "".join(rng.choice("abcdef0123456789") for _ in range(200))}
+                         for i in range(2000)]}
+    raw = canonical_json(payload)
+    chunks = list(iter_decompressed(zlib.compress(raw, 6), chunk_size=4096))
+    assert len(chunks) > 10
+    assert max(len(chunk) for chunk in chunks) <= 4096
+    assert b"".join(chunks) == raw
+
+def test_stored_payloads_load_back(fake_db):
+    webhook = {'object': 'whatsapp_business_account', 'entry': [{'id': "waba", 'text': "x" * 200000}]}
+    database.insert_message_logs([
+        ("log-1", "wamid.1", 'inbound', None, None, "hi", webhook),
+        ("log-2", "wamid.2", 'outbound', None, None, "hi", "<html>Bad Gateway</html>"),
+    ])
+    (first, second), _ = payload_store.PayloadStore().prepare([webhook, "<html>Bad Gateway</html>"])
+    assert payload_store.load_payload(first) == webhook
+    assert payload_store.load_payload(second.hex()) == "<html>Bad Gateway</html>"
+    assert payload_store.load_payload(b"\x00" * 32) is None
@@ -0,0 +1,27 @@
+# test_profiler_endpoint.py
+import pytest
+
+import app as flask_app
+import metrics
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(flask_app, 'METRICS_ADMIN_TOKEN', 'secret')
+    yield flask_app.app.test_client()
+    metrics.profiler.stop()
+
+
+@pytest.mark.parametrize("interval", ["abc", "0", "-1", "nan", "inf", "600"])
+def test_bad_interval_is_rejected(client, interval):
+    response = client.post(f"/debug/profiler?token=secret&action=start&interval={interval}")
+    assert response.status_code == 400
+    assert not metrics.profiler.running
+
+def test_start_and_stop(client):
+    response = client.post("/debug/profiler?token=secret&action=start&interval=0.05")
+    assert response.status_code == 200 and response.get_json()['running']
+    assert client.post("/debug/profiler?token=secret&action=stop").get_json()['running'] is False
+
+def test_token_is_required(client):
+    assert client.post("/debug/profiler?action=start").status_code == 403
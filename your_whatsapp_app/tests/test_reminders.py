@@ -0,0 +1,98 @@
+# test_reminders.py
+import datetime
+
+import pytest
+
+import outbound
+import reminders
+from db_pool import PoolTimeoutError
+from reminders import ReminderCampaign, claim, record_result
+
+DAY = datetime.date(2030, 1, 2)
+CAMPAIGN = reminders.campaign_name(reminders.REMINDER_TEMPLATE_NAME, DAY)
+
+
+@pytest.fixture
+def seeded(fake_db, monkeypatch):
+    # Three appointments on DAY; the Graph API call is replaced and records the recipients
+    reminders.seed_fake_appointments(fake_db, DAY, 3)
+    fake_db.sent = []
+
+    def post_message(payload, label):
+        fake_db.sent.append(payload['to'])
+        return f"wamid.{len(fake_db.sent)}"
+
+    monkeypatch.setattr(outbound, 'post_message', post_message)
+    monkeypatch.setattr(reminders, 'CHECKPOINT_BACKOFF_SECONDS', 0)
+    return fake_db
+
+def appointment_ids(fake_db):
+    return sorted(fake_db.appointments, key=lambda a: (fake_db.appointments[a]['start_time'], a))
+
+def statuses(fake_db):
+    return {aid: row['status'] for (_, aid), row in fake_db.reminder_sends.items()}
+
+def run(**kwargs):
+    return ReminderCampaign(DAY, rate=1000, max_in_flight=5, **kwargs).run()
+
+
+def test_claim_inserts_then_only_retries_failed(fake_db):
+    assert claim(CAMPAIGN, "appt-1")
+    assert not claim(CAMPAIGN, "appt-1") # claimed by a run that may have sent it
+    assert claim(CAMPAIGN, "appt-1", retry_statuses=('failed', 'claimed'))
+
+    record_result(CAMPAIGN, "appt-1", None)
+    assert claim(CAMPAIGN, "appt-1")
+    assert fake_db.reminder_sends[(CAMPAIGN, "appt-1")]['attempts'] == 3
+
+    record_result(CAMPAIGN, "appt-1", "wamid.1")
+    assert not claim(CAMPAIGN, "appt-1", retry_statuses=('failed', 'claimed'))
+
+def test_workers_leave_room_in_the_pool():
+    assert reminders.max_workers(16, 10) == 7
+    assert reminders.max_workers(4, 10) == 4
+    assert reminders.max_workers(16, 2) == 1
+
+def test_every_send_is_checkpointed(seeded):
+    stats = run()
+    assert (stats['due'], stats['sent']) == (3, 3)
+    assert set(statuses(seeded).values()) == {'sent'}
+    assert sorted(row['whatsapp_message_id'] for row in seeded.reminder_sends.values()) == ["wamid.1", "wamid.2", "wamid.3"]
+
+def test_rerun_resumes_after_a_crash(seeded):
+    claimed, failed, _ = appointment_ids(seeded)
+    claim(CAMPAIGN, claimed) # crashed before its result was written
+    claim(CAMPAIGN, failed)
+    record_result(CAMPAIGN, failed, None)
+
+    stats = run()
+    assert (stats['due'], stats['sent']) == (2, 2)
+    assert statuses(seeded) == {aid: 'sent' for aid in appointment_ids(seeded) if aid != claimed} | {claimed: 'claimed'}
+    assert run().get('due', 0) == 0 # nothing left to do
+
+    assert run(resend_unconfirmed=True)['sent'] == 1
+    assert set(statuses(seeded).values()) == {'sent'}
+
+def test_failed_result_write_is_retried(seeded, monkeypatch):
+    failures = [reminders.CHECKPOINT_ATTEMPTS + 1]
+
+    def flaky_record_result(*args):
+        if failures[0]:
+            failures[0] -= 1
+            raise PoolTimeoutError("Timed out waiting for a database connection")
+        record_result(*args)
+
+    monkeypatch.setattr(reminders, 'record_result', flaky_record_result)
+    stats = run()
+    # One appointment used up its retries during the run and was recorded at the end
+    assert stats['sent'] == 3 and 'checkpoint_errors' not in stats
+    assert set(statuses(seeded).values()) == {'sent'}
+
+def test_result_that_never_gets_written_is_reported(seeded, monkeypatch):
+    def broken_record_result(*args):
+        raise PoolTimeoutError("Timed out waiting for a database connection")
+
+    monkeypatch.setattr(reminders, 'record_result', broken_record_result)
+    stats = run()
+    assert (stats['sent'], stats['checkpoint_errors']) == (3, 3)
+    assert set(statuses(seeded).values()) == {'claimed'}
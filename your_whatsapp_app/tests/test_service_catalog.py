@@ -0,0 +1,90 @@
+# test_service_catalog.py
+import threading
+
+import pytest
+
+import service_catalog
+from service_catalog import ServiceCatalog
+
+HAIRCUT = {'service_id': 1, 'name': "Haircut", 'duration_minutes': 30}
+COLOUR = {'service_id': 2, 'name': "Hair  Colour", 'duration_minutes': 90}
+
+
+class Loader:
+    # Stands in for database.get_available_services; raises while `error` is set
+    def __init__(self, *services):
+        self.services = list(services)
+        self.calls = 0
+        self.error = None
+
+    def __call__(self):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return list(self.services)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Drives service_catalog.time.monotonic by hand
+    now = [1000.0]
+    monkeypatch.setattr(service_catalog.time, 'monotonic', lambda: now[0])
+    return now
+
+def wait_for_refresh():
+    for t in threading.enumerate():
+        if t.name == "service-catalog-refresh":
+            t.join(5)
+
+
+def test_snapshot_is_loaded_once_and_indexed(clock):
+    loader = Loader(HAIRCUT, COLOUR)
+    catalog = ServiceCatalog(loader, ttl_seconds=60)
+    assert [s['name'] for s in catalog.all()] == ["Haircut", "Hair  Colour"]
+    assert catalog.get("2") is COLOUR
+    assert catalog.find_by_name(" hair colour ") is COLOUR
+    assert catalog.get(3) is None
+    clock[0] += 60
+    catalog.all()
+    assert (loader.calls, catalog.version) == (1, 1)
+
+def test_stale_snapshot_is_served_while_it_refreshes(clock):
+    loader = Loader(HAIRCUT)
+    catalog = ServiceCatalog(loader, ttl_seconds=60)
+    catalog.reload()
+    loader.services.append(COLOUR)
+    clock[0] += 61
+    assert catalog.get(2) is None # the old snapshot, refresh started
+    wait_for_refresh()
+    assert catalog.get(2) is COLOUR
+    assert (loader.calls, catalog.version) == (2, 2)
+
+def test_failed_refresh_keeps_the_old_snapshot_until_the_next_ttl(clock):
+    loader = Loader(HAIRCUT)
+    catalog = ServiceCatalog(loader, ttl_seconds=60)
+    catalog.reload()
+    loader.error = ConnectionError("MySQL is down")
+    clock[0] += 61
+    catalog.all()
+    wait_for_refresh()
+    assert catalog.get(1) is HAIRCUT and catalog.version == 1
+    catalog.all() # within the TTL of the failed attempt: no retry
+    wait_for_refresh()
+    assert loader.calls == 2
+
+    loader.error = None
+    loader.services.append(COLOUR)
+    clock[0] += 61
+    catalog.all()
+    wait_for_refresh()
+    assert catalog.get(2) is COLOUR and loader.calls == 3
+
+def test_failed_first_load_is_retried_by_the_next_caller():
+    loader = Loader(HAIRCUT)
+    loader.error = ConnectionError("MySQL is down")
+    catalog = ServiceCatalog(loader, ttl_seconds=60)
+    with pytest.raises(ConnectionError):
+        catalog.get(1)
+    loader.error = None
+    assert catalog.get(1) is HAIRCUT
+    assert (loader.calls, catalog.version) == (2, 1)
@@ -0,0 +1,62 @@
+# test_state_store.py
+import pytest
+
+import cache
+from state_store import ConversationStateStore, InMemoryStateStore, SQLiteStateStore, create_state_store
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return InMemoryStateStore(max_entries=10, ttl_seconds=60)
+    return SQLiteStateStore(path=str(tmp_path / "states.db"), ttl_seconds=60)
+
+
+def test_get_returns_a_copy_until_set(store):
+    store.set("27820000001", {'step': 'select_service'})
+    state = store.get("27820000001")
+    state['step'] = 'select_date'
+    assert store.get("27820000001") == {'step': 'select_service'}
+    store.set("27820000001", state)
+    assert store.get("27820000001") == {'step': 'select_date'}
+
+def test_delete_and_default(store):
+    store.set("27820000001", {'step': 'select_service'})
+    store.delete("27820000001")
+    store.delete("27820000001") # deleting twice is fine
+    assert store.get("27820000001", {}) == {}
+
+def test_memory_store_expires_and_evicts(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    store = InMemoryStateStore(max_entries=2, ttl_seconds=60)
+    store.set("a", {'n': 1})
+    store.set("b", {'n': 2})
+    store.set("c", {'n': 3})
+    assert store.get("a") is None
+    now[0] += 61
+    assert store.get("b") is None and store.get("c") is None
+
+def test_sqlite_store_ignores_and_purges_expired_rows(tmp_path, monkeypatch):
+    import state_store
+    store = SQLiteStateStore(path=str(tmp_path / "states.db"), ttl_seconds=60)
+    store.set("a", {'n': 1})
+    later = state_store.time.time() + 61
+    monkeypatch.setattr(state_store.time, 'time', lambda: later)
+    assert store.get("a") is None
+    assert store.purge_expired() == 1
+
+def test_incomplete_backend_fails_when_created():
+    class NoDelete(ConversationStateStore):
+        def get(self, key, default=None):
+            return default
+
+        def set(self, key, state):
+            pass
+
+    with pytest.raises(TypeError):
+        NoDelete()
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_state_store("redis")
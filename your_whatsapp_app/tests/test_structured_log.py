@@ -0,0 +1,76 @@
+# test_structured_log.py
+import json
+import logging
+import sys
+
+import pytest
+
+import structured_log
+from structured_log import JsonFormatter, TextFormatter, RedactPhoneNumbers, SampleEvents, redact_text
+
+
+def make_record(msg, *args, level=logging.INFO, exc_info=None, **extra):
+    record = logging.LogRecord("app", level, __file__, 1, msg, args, exc_info)
+    record.__dict__.update(extra)
+    return record
+
+def raised(exc):
+    try:
+        raise exc
+    except Exception:
+        return sys.exc_info()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Error resolving customer 27820000001: timeout", "Error resolving customer ***0001: timeout"),
+    ("text message to 27820000001", "text message to ***0001"),
+    ("Customer with phone number 27820000001 already exists", "Customer with phone number ***0001 already exists"),
+    ("call +27820000001", "call +***0001"),
+    ("1062 (23000): Duplicate entry '27820000001' for key 'p'", "1062 (23000): Duplicate entry '***0001' for key 'p'"),
+])
+def test_phone_numbers_are_masked(text, expected):
+    assert redact_text(text) == expected
+
+@pytest.mark.parametrize("text", [
+    "status timestamp 1700000000 applied",
+    "Error flushing 250000000 log rows",
+    "Message wamid.HBgLMjc4MjAwMDAwMDE failed",
+    "Appointment 12345678901 not reactivated",
+])
+def test_other_numbers_are_left_alone(text):
+    assert redact_text(text) == text
+
+def test_fields_and_payload_are_masked():
+    record = make_record("sent", to="27820000001", payload={'entry': [{'wa_id': "27820000001", 'timestamp': "1700000000"}]})
+    RedactPhoneNumbers().filter(record)
+    assert record.to == "***0001"
+    assert record.payload == {'entry': [{'wa_id': "***0001", 'timestamp': "1700000000"}]}
+
+@pytest.mark.parametrize("formatter", [JsonFormatter(), TextFormatter()])
+def test_traceback_is_masked(formatter):
+    record = make_record("Error resolving customer %s: %s", "27820000001", "boom", level=logging.ERROR,
+                         exc_info=raised(ValueError("no customer with phone number 27820000001")))
+    RedactPhoneNumbers().filter(record)
+    line = formatter.format(record)
+    assert "27820000001" not in line
+    assert "ValueError: no customer with phone number ***0001" in (json.loads(line)['exc'] if isinstance(formatter, JsonFormatter) else line)
+
+def test_sampling_keeps_a_fraction_of_listed_events(monkeypatch):
+    sampler = SampleEvents({'status_update': 0.25})
+    draws = iter([0.1, 0.3, 0.2, 0.9])
+    monkeypatch.setattr(structured_log.random, 'random', lambda: next(draws))
+    kept = [sampler.filter(make_record("status", event='status_update')) for _ in range(4)]
+    assert kept == [True, False, True, False]
+    assert sampler.dropped == 2
+
+def test_sampling_never_drops_warnings_or_other_events():
+    sampler = SampleEvents({'status_update': 0.0})
+    assert sampler.filter(make_record("failed", level=logging.WARNING, event='status_update'))
+    assert sampler.filter(make_record("booked", event='booking'))
+    assert sampler.filter(make_record("plain"))
+    assert not sampler.filter(make_record("status", event='status_update'))
+    assert sampler.dropped == 1
+
+def test_sample_rates_are_parsed():
+    assert structured_log.parse_sample_rates("status_update=0.05, webhook_received=1") == {
+        'status_update': 0.05, 'webhook_received': 1.0}
@@ -0,0 +1,97 @@
+# test_workers.py
+import threading
+import time
+
+import pytest
+
+import app as flask_app
+import conversation
+from dedup import WebhookDeduplicator
+from workers import KeyedWorkerPool
+
+
+@pytest.fixture
+def blocked_pool():
+    # One worker with room for one queued job, busy until release is set
+    pool = KeyedWorkerPool(num_workers=1, queue_size=1, name="test")
+    started, release = threading.Event(), threading.Event()
+    pool.submit("busy", lambda: (started.set(), release.wait()))
+    started.wait(5)
+    yield pool, release
+    release.set()
+    pool.shutdown(5)
+
+def webhook(*message_ids, sender="27820000001"):
+    messages = [{'id': message_id, 'from': sender, 'type': 'text', 'text': {'body': "hi"}} for message_id in message_ids]
+    return {'object': 'whatsapp_business_account',
+            'entry': [{'changes': [{'field': 'messages', 'value': {'messages': messages}}]}]}
+
+
+def test_jobs_for_one_key_run_in_submission_order():
+    pool = KeyedWorkerPool(num_workers=4, queue_size=100)
+    ran = []
+    for i in range(50):
+        key = f"2782000000{i % 3}"
+        pool.submit(key, lambda key=key, i=i: (time.sleep(0.001 * (i % 2)), ran.append((key, i))))
+    assert pool.shutdown(5)
+    for key in {key for key, _ in ran}:
+        numbers = [i for k, i in ran if k == key]
+        assert numbers == sorted(numbers)
+    assert len(ran) == 50 and pool.stats()['completed'] == 50
+
+def test_failing_job_does_not_stop_the_worker():
+    pool = KeyedWorkerPool(num_workers=1, queue_size=10)
+    ran = []
+    pool.submit("k", lambda: 1 / 0)
+    pool.submit("k", lambda: ran.append("after"))
+    assert pool.shutdown(5)
+    assert ran == ["after"]
+    assert (pool.stats()['failed'], pool.stats()['completed']) == (1, 1)
+
+def test_full_queue_rejects(blocked_pool):
+    pool, release = blocked_pool
+    assert pool.submit("k", lambda: None) # waits behind the busy job
+    assert not pool.submit("k", lambda: None)
+    assert not pool.submit("k", lambda: None, timeout=0.05)
+    assert pool.stats()['rejected'] == 2
+
+def test_shutdown_drains_queued_jobs_then_refuses_more():
+    pool = KeyedWorkerPool(num_workers=2, queue_size=100)
+    ran = []
+    for i in range(20):
+        pool.submit(i, lambda i=i: (time.sleep(0.005), ran.append(i)))
+    assert pool.shutdown(5)
+    assert sorted(ran) == list(range(20))
+    assert not pool.submit(0, lambda: None)
+
+def test_shutdown_reports_a_queue_that_did_not_drain(blocked_pool):
+    pool, release = blocked_pool
+    assert not pool.shutdown(0.05)
+
+def test_rejected_webhook_events_are_readmitted(blocked_pool, monkeypatch):
+    pool, release = blocked_pool
+    dedup = WebhookDeduplicator(max_entries=100, window_seconds=60)
+    for module in (flask_app, conversation):
+        monkeypatch.setattr(module, 'deduplicator', dedup)
+    monkeypatch.setattr(flask_app, '_webhook_pool', pool)
+    monkeypatch.setattr(flask_app, 'WEBHOOK_ENQUEUE_TIMEOUT_SECONDS', 0)
+    processed = []
+    monkeypatch.setattr(flask_app, 'process_message', lambda message, data: processed.append(message['id']))
+
+    # The first message takes the last queue slot, the other two are rejected
+    assert not flask_app.enqueue_webhook(webhook("wamid.1", "wamid.2", "wamid.3"))
+    release.set()
+    pool.shutdown(5)
+    assert processed == ["wamid.1"]
+    # WhatsApp's retry brings the whole webhook again; only the rejected events are new
+    assert [event['id'] for _, event in conversation.new_webhook_events(webhook("wamid.1", "wamid.2", "wamid.3"))] == ["wamid.2", "wamid.3"]
+
+def test_drain_on_shutdown_runs_what_was_queued(monkeypatch):
+    pool = KeyedWorkerPool(num_workers=1, queue_size=10)
+    monkeypatch.setattr(flask_app, '_webhook_pool', pool)
+    ran = []
+    for i in range(5):
+        pool.submit("27820000001", lambda i=i: (time.sleep(0.005), ran.append(i)))
+    flask_app.drain_webhook_pool()
+    assert ran == list(range(5))
+    assert flask_app._webhook_pool is None
@@ -1,15 +1,54 @@
 # whatsapp_api.py
 import requests
-import json
-from config import WHATSAPP_API_URL, PHONE_NUMBER_ID, ACCESS_TOKEN
+import logging
+import threading
+import time
+from collections import deque
+from requests.adapters import HTTPAdapter
+from config import (
+    WHATSAPP_API_URL, PHONE_NUMBER_ID, ACCESS_TOKEN,
+    GRAPH_API_POOL_SIZE, GRAPH_API_TIMEOUT_SECONDS, GRAPH_API_MAX_RETRIES,
+    GRAPH_API_BACKOFF_SECONDS, GRAPH_API_RATE_LIMIT_PER_SECOND
+)
+from rate_limit import TokenBucket
+from metrics import timed
 
-def send_whatsapp_message(to_number, message_body, message_type="text"):
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    url = f"{WHATSAPP_API_URL}/{PHONE_NUMBER_ID}/messages"
+log = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+# Shared with async_whatsapp_api.py: both send from the same phone number
+rate_limiter = TokenBucket(GRAPH_API_RATE_LIMIT_PER_SECOND)
+
+_stats_lock = threading.Lock()
+_send_stats = {'sent': 0, 'failed': 0, 'retries': 0, 'rate_limit_wait_seconds': 0.0}
+_recent_latencies = deque(maxlen=1000) # seconds, successful and failed sends
+_sent_hooks = []
+
+def get_session():
+    # One keep-alive session for the whole process: headers are built once and
+    # TLS connections to the Graph API are reused across messages.
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GRAPH_API_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "Authorization": f"Bearer {ACCESS_TOKEN}",
+                    "Content-Type": "application/json",
+                })
+                _session = session
+    return _session
 
+def messages_url():
+    return f"{WHATSAPP_API_URL}/{PHONE_NUMBER_ID}/messages"
+
+def build_message_payload(to_number, message_body, message_type="text"):
     payload = {
         "messaging_product": "whatsapp",
         "to": to_number,
@@ -29,26 +68,10 @@ def send_whatsapp_message(to_number, message_body, message_type="text"):
         #     "action": {"buttons": [{"type": "reply", "reply": {"id": "unique_id", "title": "Button Text"}}]}
         # }
         payload["interactive"] = message_body # message_body would be a dict for interactive
+    return payload
 
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        response_data = response.json()
-        print(f"WhatsApp API Response: {json.dumps(response_data, indent=4)}")
-        return response_data.get('messages', [])[0].get('id') if response_data.get('messages') else None
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending WhatsApp message: {e}")
-        print(f"Response content: {response.text if 'response' in locals() else 'N/A'}")
-        return None
-
-def send_template_message(to_number, template_name, components=None, language_code="en_US"):
-    headers = {
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    url = f"{WHATSAPP_API_URL}/{PHONE_NUMBER_ID}/messages"
-
-    payload = {
+def build_template_payload(to_number, template_name, components=None, language_code="en_US"):
+    return {
         "messaging_product": "whatsapp",
         "to": to_number,
         "type": "template",
@@ -58,13 +81,106 @@ def send_template_message(to_number, template_name, components=None, language_co
             "components": components if components else []
         }
     }
-    try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        response_data = response.json()
-        print(f"Template Message Response: {json.dumps(response_data, indent=4)}")
-        return response_data.get('messages', [])[0].get('id') if response_data.get('messages') else None
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending template message: {e}")
-        print(f"Response content: {response.text if 'response' in locals() else 'N/A'}")
-        return None
\ No newline at end of file
+
+def retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return GRAPH_API_BACKOFF_SECONDS * (2 ** attempt)
+
+def record_send(ok, latency, retries, rate_wait):
+    with _stats_lock:
+        _send_stats['sent' if ok else 'failed'] += 1
+        _send_stats['retries'] += retries
+        _send_stats['rate_limit_wait_seconds'] += rate_wait
+        _recent_latencies.append(latency)
+
+def on_message_sent(hook):
+    # Registers hook(message_id, payload, response_data), called for every
+    # message the Graph API accepted, from this client and async_whatsapp_api.
+    # The app registers database.log_outbound_message here; tools that send
+    # to a stub (reminders.py --dry-run, the benches) leave it out.
+    if hook not in _sent_hooks:
+        _sent_hooks.append(hook)
+    return hook
+
+def remove_message_sent_hook(hook):
+    if hook in _sent_hooks:
+        _sent_hooks.remove(hook)
+
+def message_sent(payload, response_data, label, attempts):
+    # Bookkeeping for an accepted message; returns its WhatsApp message id
+    message_id = response_data.get('messages', [])[0].get('id') if response_data.get('messages') else None
+    log.debug("%s sent", label, extra={
+        'event': 'message_sent', 'message_id': message_id, 'to': payload.get('to'),
+        'attempts': attempts, 'payload': response_data,
+    })
+    if message_id:
+        for hook in list(_sent_hooks):
+            try:
+                hook(message_id, payload, response_data)
+            except Exception as e:
+                log.error("Error in message sent hook for %s: %s", message_id, e)
+    return message_id
+
+@timed("graph_api")
+def post_message(payload, label="WhatsApp message"):
+    # Sends one payload, retrying 429/5xx and connection errors with exponential
+    # backoff (or the Retry-After header). Returns the WhatsApp message id.
+    session = get_session()
+    started = time.monotonic()
+    rate_wait = 0.0
+    response = None
+    attempt = 0
+    while True:
+        rate_wait += rate_limiter.acquire()
+        try:
+            response = session.post(messages_url(), json=payload, timeout=GRAPH_API_TIMEOUT_SECONDS)
+            retryable = response.status_code in RETRYABLE_STATUS_CODES
+            if not retryable:
+                response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
+                record_send(True, time.monotonic() - started, attempt, rate_wait)
+                return message_sent(payload, response.json(), label, attempt + 1)
+            error = f"HTTP {response.status_code}"
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            response = None
+            retryable = True
+            error = e
+        except requests.exceptions.RequestException as e:
+            log.error("Error sending %s: %s", label, e, extra={
+                'to': payload.get('to'), 'response': response.text if response is not None else None,
+            })
+            record_send(False, time.monotonic() - started, attempt, rate_wait)
+            return None
+
+        if attempt >= GRAPH_API_MAX_RETRIES:
+            log.error("Error sending %s: %s, giving up after %d attempts", label, error, attempt + 1, extra={
+                'to': payload.get('to'), 'response': response.text if response is not None else None,
+            })
+            record_send(False, time.monotonic() - started, attempt, rate_wait)
+            return None
+        delay = retry_delay(response, attempt)
+        log.warning("Retrying %s in %.2fs (%s)", label, delay, error)
+        time.sleep(delay)
+        attempt += 1
+
+@timed("graph_api")
+def send_whatsapp_message(to_number, message_body, message_type="text"):
+    payload = build_message_payload(to_number, message_body, message_type)
+    return post_message(payload, "WhatsApp message")
+
+@timed("graph_api")
+def send_template_message(to_number, template_name, components=None, language_code="en_US"):
+    payload = build_template_payload(to_number, template_name, components, language_code)
+    return post_message(payload, "Template message")
+
+def get_send_stats():
+    with _stats_lock:
+        stats = dict(_send_stats)
+        latencies = sorted(_recent_latencies)
+    for name, pct in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99)):
+        stats[f'latency_{name}'] = latencies[min(len(latencies) - 1, int(pct * len(latencies)))] if latencies else None
+    return stats
@@ -0,0 +1,98 @@
+# workers.py
+import logging
+import queue
+import threading
+import time
+import zlib
+
+_STOP = object()
+
+log = logging.getLogger(__name__)
+
+
+class KeyedWorkerPool:
+    # Runs jobs on a fixed set of worker threads. Every key is pinned to one
+    # worker (by hash), so jobs for the same key run one after another in the
+    # order they were submitted while different keys run in parallel.
+
+    def __init__(self, num_workers=4, queue_size=1000, name="worker"):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        self.name = name
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(num_workers)]
+        self._threads = []
+        self._accepting = True
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._run, args=(q,), name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _queue_for(self, key):
+        return self._queues[zlib.crc32(str(key).encode("utf-8")) % len(self._queues)]
+
+    def submit(self, key, fn, *args, timeout=0.0, **kwargs):
+        # Returns False when the worker's queue is still full after `timeout`
+        # seconds (or the pool is shutting down) so the caller can push back.
+        if not self._accepting:
+            self._count('rejected')
+            return False
+        try:
+            if timeout:
+                self._queue_for(key).put((fn, args, kwargs), timeout=timeout)
+            else:
+                self._queue_for(key).put_nowait((fn, args, kwargs))
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('submitted')
+        return True
+
+    def _run(self, q):
+        while True:
+            job = q.get()
+            try:
+                if job is _STOP:
+                    return
+                fn, args, kwargs = job
+                try:
+                    fn(*args, **kwargs)
+                    self._count('completed')
+                except Exception as e:
+                    self._count('failed')
+                    log.exception("Error in %s job %s: %s", self.name, getattr(fn, '__name__', fn), e)
+            finally:
+                q.task_done()
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self.queue_depth()
+        stats['workers'] = len(self._threads)
+        return stats
+
+    def shutdown(self, timeout=30.0):
+        # Stop accepting work, let queued jobs finish, then stop the threads.
+        # Returns True if everything drained within `timeout`.
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        for q in self._queues:
+            while True:
+                try:
+                    q.put(_STOP, timeout=max(0.0, deadline - time.monotonic()) or 0.01)
+                    break
+                except queue.Full:
+                    if time.monotonic() >= deadline:
+                        break
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        return not any(t.is_alive() for t in self._threads)